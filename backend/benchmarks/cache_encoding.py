@@ -0,0 +1,63 @@
+# Compares the v2 pydantic JSON cache entries with the compact v3 encoding.
+#
+# Run from the backend directory:
+#   python -m benchmarks.cache_encoding
+
+import timeit
+from datetime import datetime, timedelta, UTC
+from typing import Optional
+
+from pydantic import BaseModel
+
+from cache_encoding import (
+    cache_entry_from_result,
+    encode_cache_entry,
+    decode_cache_entry,
+)
+from route_durations.route_duration_provider import RouteDurationResult
+
+NUMBER = 100_000
+
+
+# The pydantic model the v2 entries were written with.
+class CacheEntryV2(BaseModel):
+    is_present: bool
+    value: Optional[RouteDurationResult]
+
+
+def main():
+    value = RouteDurationResult(
+        duration=timedelta(minutes=37, seconds=12),
+        x_headers={
+            "x-src": "otp",
+            "x-cache-computed-at": datetime.now(UTC).isoformat(),
+        },
+    )
+    cache_entry_v2 = CacheEntryV2(is_present=True, value=value)
+    cache_entry = cache_entry_from_result(value)
+
+    v2 = cache_entry_v2.model_dump_json().encode("utf-8")
+    v3 = encode_cache_entry(cache_entry)
+
+    formats = {
+        "v2 json": (
+            lambda: cache_entry_v2.model_dump_json(),
+            lambda: decode_cache_entry(v2),
+            v2,
+        ),
+        "v3 binary": (
+            lambda: encode_cache_entry(cache_entry),
+            lambda: decode_cache_entry(v3),
+            v3,
+        ),
+    }
+
+    print(f"{'format':>10} {'bytes':>6} {'encode us':>10} {'decode us':>10}")
+    for name, (encode, decode, encoded) in formats.items():
+        encode_us = timeit.timeit(encode, number=NUMBER) / NUMBER * 1e6
+        decode_us = timeit.timeit(decode, number=NUMBER) / NUMBER * 1e6
+        print(f"{name:>10} {len(encoded):>6} {encode_us:>10.2f} {decode_us:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# Measures how fast a new worker is ready: the import time of main per
+# ENABLED_PROVIDERS, with the slowest modules it imports, and the time from
+# starting uvicorn to the first tile, answered by the stub upstream servers of
+# the load test.
+#
+# Run from the backend directory:
+#   python -m benchmarks.cold_start
+#   python -m benchmarks.cold_start --providers vrr,otp,hafas,otp-iso otp --src otp
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from .loadtest.__main__ import start_process, stop_process
+
+RUNS = 5
+TILE_URL = "/api/{src}/51.4508,7.0131/64/13/{x}/4389.png"
+
+
+def import_times(env: dict) -> tuple[float, list[tuple[float, str]]]:
+    # Returns the median import time of main in ms, and the modules main
+    # imports directly by their cumulative import time.
+    totals = []
+    modules = []
+    for _ in range(RUNS):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import main"],
+            env={**os.environ, **env},
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+        modules = []
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            if not cumulative.strip().isdigit():
+                continue
+            if name.rstrip() == " main":
+                totals.append(int(cumulative) / 1000)
+            elif name.startswith("   ") and not name.startswith("    "):
+                modules.append((int(cumulative) / 1000, name.strip()))
+
+    return statistics.median(totals), sorted(modules, reverse=True)
+
+
+def time_to_first_tile(env: dict, src: str, port: int) -> tuple[float, float]:
+    # Returns the seconds from starting the worker to its first tile, and the
+    # seconds of the second tile.
+    url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        env={**os.environ, **env},
+        stderr=subprocess.DEVNULL,
+    )
+
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with {process.returncode}")
+            try:
+                response = httpx.get(url + TILE_URL.format(src=src, x=4264), timeout=30)
+                break
+            except httpx.TransportError:
+                time.sleep(0.01)
+        first = time.perf_counter() - start
+        response.raise_for_status()
+
+        start = time.perf_counter()
+        httpx.get(url + TILE_URL.format(src=src, x=4265), timeout=30)
+        second = time.perf_counter() - start
+    finally:
+        stop_process(process)
+
+    return first, second
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--providers",
+        nargs="+",
+        default=["vrr,otp,hafas,otp-iso", "otp"],
+        help="ENABLED_PROVIDERS values to compare",
+    )
+    parser.add_argument("--src", default="otp")
+    parser.add_argument("--stub-port", type=int, default=8901)
+    parser.add_argument("--app-port", type=int, default=8902)
+    args = parser.parse_args()
+
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    stub = start_process(
+        [
+            "-m",
+            "benchmarks.loadtest.stub_servers",
+            "--port",
+            str(args.stub_port),
+            "--latency-ms",
+            "0",
+            "--jitter-ms",
+            "0",
+        ],
+        {},
+        f"{stub_url}/stats",
+    )
+
+    try:
+        for providers in args.providers:
+            env = {
+                "ENABLED_PROVIDERS": providers,
+                "VRR_TRIP_URL": f"{stub_url}/vrr/XML_TRIP_REQUEST2",
+                "VRR_STOPFINDER_URL": f"{stub_url}/vrr/XML_STOPFINDER_REQUEST",
+                "OTP_URL": stub_url,
+                "HAFAS_URL": f"{stub_url}/hafas/mgate.exe",
+            }
+
+            total, modules = import_times(env)
+            print(f"ENABLED_PROVIDERS={providers}")
+            print(f"  import main: {total:.0f} ms (median of {RUNS})")
+            for cumulative, name in modules[:6]:
+                print(f"    {cumulative:6.1f} ms {name}")
+
+            if args.src in providers.split(","):
+                first, second = time_to_first_tile(env, args.src, args.app_port)
+                print(
+                    f"  first {args.src} tile {first * 1000:.0f} ms after start,"
+                    f" second {second * 1000:.0f} ms"
+                )
+    finally:
+        stop_process(stub)
+
+
+if __name__ == "__main__":
+    main()
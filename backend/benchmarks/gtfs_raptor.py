@@ -0,0 +1,208 @@
+# Loads a GTFS feed into a GtfsTimetable and times the RAPTOR searches and the
+# tile lookups of a full map, for a real feed or a generated one of about the
+# size of the VRR feed.
+#
+# Run from the backend directory:
+#   python -m benchmarks.gtfs_raptor --feed ~/gtfs/vrr.zip
+#   python -m benchmarks.gtfs_raptor --lines 1500
+
+import argparse
+import csv
+import math
+import os
+import random
+import tempfile
+import time
+from datetime import date
+
+import numpy as np
+
+import tilenames2
+from gtfs_timetable import GtfsTimetable
+from stop_index import Stop, StopIndex
+from util import get_9am_on_next_monday
+
+# The generated feed covers the Ruhr area.
+BBOX = (51.30, 6.70, 51.65, 7.60)  # S,W,N,E
+STOP_SPACING_METERS = 600
+STOP_SNAP_METERS = 250
+STOPS_PER_LINE = 25
+HEADWAYS_MINUTES = [10, 15, 20, 30, 60]
+SERVICE_HOURS = (5, 24)
+DWELL_SECONDS = 30
+METERS_PER_SECOND = 7.0
+
+Z = 12
+TILE_SIZE = 64
+
+
+def generate_feed(path: str, lines: int, seed: int = 42):
+    # Straight-ish lines with a stop every STOP_SPACING_METERS, reusing the
+    # stops of earlier lines nearby so that lines cross and share stops.
+    rng = random.Random(seed)
+    south, west, north, east = BBOX
+    stops: list[Stop] = []
+    index_stops: list[Stop] = []
+    index = StopIndex(index_stops)
+
+    def stop_near(lat: float, lng: float) -> int:
+        candidates = index.within((lat, lng), STOP_SNAP_METERS)
+        if candidates:
+            return min(candidates, key=lambda candidate: candidate[1])[0]
+
+        stop = Stop(f"s{len(stops)}", f"Stop {len(stops)}", lat, lng)
+        stops.append(stop)
+        index_stops.append(stop)
+        index.cells.setdefault(index.cell(lat, lng), []).append(len(stops) - 1)
+        return len(stops) - 1
+
+    line_stops = []
+    for _ in range(lines):
+        lat, lng = rng.uniform(south, north), rng.uniform(west, east)
+        heading = rng.uniform(0, 2 * math.pi)
+        sequence = []
+        for _ in range(STOPS_PER_LINE):
+            stop = stop_near(lat, lng)
+            if stop not in sequence:
+                sequence.append(stop)
+            heading += rng.gauss(0, 0.3)
+            lat += STOP_SPACING_METERS * math.cos(heading) / 111320
+            lng += (
+                STOP_SPACING_METERS
+                * math.sin(heading)
+                / (111320 * math.cos(math.radians(lat)))
+            )
+        line_stops.append(sequence)
+
+    os.makedirs(path, exist_ok=True)
+
+    def write(name: str, header: list[str], rows):
+        with open(os.path.join(path, name), "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(header)
+            writer.writerows(rows)
+
+    write(
+        "stops.txt",
+        ["stop_id", "stop_name", "stop_lat", "stop_lon"],
+        ((stop.stop_id, stop.name, stop.lat, stop.lng) for stop in stops),
+    )
+    write(
+        "calendar.txt",
+        ["service_id", "monday", "tuesday", "wednesday", "thursday", "friday"]
+        + ["saturday", "sunday", "start_date", "end_date"],
+        [["daily", 1, 1, 1, 1, 1, 1, 1, "20000101", "20991231"]],
+    )
+
+    trips = []
+    stop_times = []
+    for line, sequence in enumerate(line_stops):
+        headway = rng.choice(HEADWAYS_MINUTES) * 60
+        for direction, stop_sequence in enumerate((sequence, sequence[::-1])):
+            offset = rng.randrange(headway)
+            for start in range(
+                SERVICE_HOURS[0] * 3600 + offset, SERVICE_HOURS[1] * 3600, headway
+            ):
+                trip_id = f"l{line}d{direction}t{start}"
+                trips.append((f"l{line}", "daily", trip_id))
+
+                t = start
+                previous = None
+                for i, stop in enumerate(stop_sequence):
+                    if previous is not None:
+                        a, b = stops[previous], stops[stop]
+                        meters = math.dist(
+                            (a.lat * 111320, a.lng * 69600),
+                            (b.lat * 111320, b.lng * 69600),
+                        )
+                        t += int(meters / METERS_PER_SECOND) + DWELL_SECONDS
+                    time_text = f"{t // 3600:02d}:{t // 60 % 60:02d}:{t % 60:02d}"
+                    stop_times.append(
+                        (trip_id, time_text, time_text, stops[stop].stop_id, i)
+                    )
+                    previous = stop
+
+    write("trips.txt", ["route_id", "service_id", "trip_id"], trips)
+    write(
+        "stop_times.txt",
+        ["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence"],
+        stop_times,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--feed", help="GTFS directory or zip, generated if not set")
+    parser.add_argument("--lines", type=int, default=1500)
+    parser.add_argument("--date", help="service date, defaults to next Monday")
+    parser.add_argument("--origins", type=int, default=20)
+    args = parser.parse_args()
+
+    departure = get_9am_on_next_monday()
+    service_date = departure.date()
+    if args.date:
+        service_date = date.fromisoformat(args.date)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        feed = args.feed
+        if feed is None:
+            feed = tmp
+            start = time.perf_counter()
+            generate_feed(feed, args.lines)
+            print(
+                f"Generated a feed with {args.lines} lines"
+                f" in {time.perf_counter() - start:.1f}s"
+            )
+
+        start = time.perf_counter()
+        timetable = GtfsTimetable.from_gtfs(feed, service_date)
+        print(f"Loaded {timetable.stats()} in {time.perf_counter() - start:.1f}s")
+
+    departure_seconds = departure.hour * 3600 + departure.minute * 60
+    rng = random.Random(1)
+    origins = [
+        (stop.lat + rng.uniform(-0.003, 0.003), stop.lng + rng.uniform(-0.003, 0.003))
+        for stop in rng.sample(timetable.stops, min(args.origins, len(timetable.stops)))
+    ]
+
+    timetable.earliest_arrivals(origins[0], departure_seconds)  # warm up
+    search_ms = []
+    results = []
+    for origin in origins:
+        start = time.perf_counter()
+        results.append(timetable.earliest_arrivals(origin, departure_seconds))
+        search_ms.append((time.perf_counter() - start) * 1000)
+
+    print(
+        f"Search: {np.mean(search_ms):.1f} ms mean,"
+        f" {np.percentile(search_ms, 95):.1f} ms p95 over {len(origins)} origins,"
+        f" {np.mean([r.reached_stops() for r in results]):.0f} stops reached,"
+        f" {np.mean([r.rounds for r in results]):.1f} rounds"
+    )
+
+    # Every tile of the map at Z, answered from the first search.
+    lats = [stop.lat for stop in timetable.stops]
+    lngs = [stop.lng for stop in timetable.stops]
+    x1, y1 = tilenames2.tile_xy(max(lats), min(lngs), Z, TILE_SIZE)
+    x2, y2 = tilenames2.tile_xy(min(lats), max(lngs), Z, TILE_SIZE)
+    xs, ys = np.meshgrid(np.arange(x1, x2 + 1) + 0.5, np.arange(y1, y2 + 1) + 0.5)
+    tile_lats, tile_lngs = tilenames2.xy_to_latlon_batch(
+        xs.ravel(), ys.ravel(), Z, TILE_SIZE
+    )
+
+    start = time.perf_counter()
+    durations = [
+        results[0].duration_to(latlng)
+        for latlng in zip(tile_lats.tolist(), tile_lngs.tolist())
+    ]
+    elapsed = time.perf_counter() - start
+    reachable = sum(duration is not None for duration in durations)
+    print(
+        f"Map: {len(durations)} tiles at z{Z}/{TILE_SIZE}px in"
+        f" {elapsed * 1000:.0f} ms ({elapsed / len(durations) * 1e6:.0f} us/tile),"
+        f" {reachable} reachable, plus one search of {search_ms[0]:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
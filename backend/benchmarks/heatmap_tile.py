@@ -0,0 +1,64 @@
+# Measures CPU time and peak memory per rendered tile of the flat single
+# duration tiles against N x N sampled heatmap tiles.
+#
+# Run from the backend directory:
+#   python -m benchmarks.heatmap_tile
+
+import random
+import time
+import tracemalloc
+from datetime import timedelta
+
+import numpy as np
+
+from tile_renderer import render_heatmap_tile, render_tile_uncached
+
+TILE_SIZES = [64, 128, 256]
+SAMPLES = [2, 4, 8]
+NUM_TILES = 200
+
+
+def random_grid(rng: random.Random, samples: int) -> np.ndarray:
+    minutes = [
+        float("nan") if rng.random() < 0.05 else rng.uniform(0, 75)
+        for _ in range(samples * samples)
+    ]
+    return np.array(minutes).reshape(samples, samples)
+
+
+def measure(render, args: list) -> tuple[float, float, int]:
+    # Returns ms per tile, peak KiB per tile and the average PNG size.
+    start = time.perf_counter()
+    sizes = [len(render(*arg)) for arg in args]
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    render(*args[0])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed / len(args) * 1000, peak / 1024, sum(sizes) // len(sizes)
+
+
+def main():
+    rng = random.Random(42)
+
+    print(f"{'size':>6} {'mode':>10} {'ms/tile':>9} {'peak KiB':>10} {'PNG bytes':>10}")
+    for tile_size in TILE_SIZES:
+        durations = [timedelta(minutes=rng.uniform(0, 75)) for _ in range(NUM_TILES)]
+        ms, peak, png = measure(
+            render_tile_uncached, [(tile_size, duration) for duration in durations]
+        )
+        print(f"{tile_size:>6} {'flat':>10} {ms:>9.2f} {peak:>10.0f} {png:>10}")
+
+        for samples in SAMPLES:
+            grids = [random_grid(rng, samples) for _ in range(NUM_TILES)]
+            ms, peak, png = measure(
+                render_heatmap_tile, [(tile_size, grid) for grid in grids]
+            )
+            mode = f"{samples}x{samples}"
+            print(f"{tile_size:>6} {mode:>10} {ms:>9.2f} {peak:>10.0f} {png:>10}")
+
+
+if __name__ == "__main__":
+    main()
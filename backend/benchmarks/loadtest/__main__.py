@@ -0,0 +1,253 @@
+# Offline load test: starts the stub upstream servers and the backend as
+# subprocesses, replays simulated map sessions against the tile endpoint and
+# reports latency percentiles, throughput, errors and upstream calls per tile
+# for each cache configuration. Provisional tiles (no-store, derived from a
+# lower zoom level or shed by the upstream limiter) are counted on their own
+# and left out of the latency and throughput, which are of the final tiles.
+#
+# Run from the backend directory:
+#   python -m benchmarks.loadtest --src vrr --users 20 --latency-ms 80
+#   python -m benchmarks.loadtest --src otp --upstream-limit 64:0:1000
+#   python -m benchmarks.loadtest --configs none,l1,sqlite --error-rate 0.02
+#   python -m benchmarks.loadtest --memcached 127.0.0.1:11211
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+
+from .workload import WorkloadConfig, generate_sessions
+
+# Environment of the backend per cache configuration.
+CACHE_CONFIGS = {
+    "none": {"L1_CACHE_SIZE": "0", "TILE_QUADTREE": "0"},
+    "l1": {},
+    "sqlite": {"MEMCACHED_URL": "sqlite://{tmp}/loadtest-cache.db"},
+    "memcached": {"MEMCACHED_URL": "{memcached}"},
+}
+# Stub counter of the upstream requests per src, an OTP batch counts once.
+UPSTREAM_COUNTERS = {
+    "vrr": "vrr",
+    "otp": "otp",
+    "otp-iso": "otp_isochrone",
+    "hafas": "hafas",
+}
+
+
+def start_process(args: list[str], env: dict, url: str) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, *args], env={**os.environ, **env}, cwd=os.getcwd()
+    )
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(args)} exited with {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError(f"{' '.join(args)} did not start")
+
+
+def stop_process(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def run_sessions(
+    base_url: str, src: str, sessions: list, config: WorkloadConfig, per_user: int
+) -> tuple[list[float], int, int]:
+    latencies = []
+    errors = 0
+    provisional = 0
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+
+        async def fetch(origin: tuple, z: int, x: int, y: int, semaphore):
+            nonlocal errors, provisional
+            url = (
+                f"/api/{src}/{origin[0]},{origin[1]}/{config.tile_size}"
+                f"/{z}/{x}/{y}.png"
+            )
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                except httpx.HTTPError:
+                    errors += 1
+                    return
+                elapsed = time.perf_counter() - start
+
+                if response.status_code != 200:
+                    errors += 1
+                elif (
+                    "no-store" in response.headers.get("cache-control", "")
+                    or "x-upstream-overloaded" in response.headers
+                ):
+                    provisional += 1
+                else:
+                    latencies.append(elapsed)
+
+        async def user(origin: tuple, steps: list):
+            # Browsers allow about 6 connections per host.
+            semaphore = asyncio.Semaphore(per_user)
+            for tiles in steps:
+                await asyncio.gather(
+                    *(fetch(origin, z, x, y, semaphore) for z, x, y in tiles)
+                )
+
+        await asyncio.gather(*(user(origin, steps) for origin, steps in sessions))
+
+    return latencies, errors, provisional
+
+
+def upstream_limit_env(args) -> dict:
+    # Upstreams are not limited unless configured, set a limit to see the
+    # backend shed load.
+    if args.upstream_limit is None:
+        return {}
+
+    name = args.src.upper().replace("-", "_")
+    return {f"UPSTREAM_LIMIT_{name}": args.upstream_limit}
+
+
+def run_config(name: str, args, sessions: list, workload: WorkloadConfig) -> dict:
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            "VRR_TRIP_URL": f"{stub_url}/vrr/XML_TRIP_REQUEST2",
+            "VRR_STOPFINDER_URL": f"{stub_url}/vrr/XML_STOPFINDER_REQUEST",
+            "OTP_URL": stub_url,
+            "HAFAS_URL": f"{stub_url}/hafas/mgate.exe",
+            "PRERENDER_TILE_SIZES": str(workload.tile_size),
+            **upstream_limit_env(args),
+            **{
+                key: value.format(tmp=tmp, memcached=args.memcached)
+                for key, value in CACHE_CONFIGS[name].items()
+            },
+        }
+        app = start_process(
+            [
+                "-m",
+                "uvicorn",
+                "main:app",
+                "--port",
+                str(args.app_port),
+                "--log-level",
+                "warning",
+            ],
+            env,
+            f"{app_url}/api/stats",
+        )
+
+        try:
+            httpx.post(f"{stub_url}/stats/reset")
+            start = time.perf_counter()
+            latencies, errors, provisional = asyncio.run(
+                run_sessions(app_url, args.src, sessions, workload, args.per_user)
+            )
+            elapsed = time.perf_counter() - start
+            upstream = httpx.get(f"{stub_url}/stats").json()
+        finally:
+            stop_process(app)
+
+    milliseconds = np.array(latencies) * 1000
+    if not latencies:
+        milliseconds = np.array([np.nan])
+    requests = len(latencies) + errors + provisional
+    upstream_calls = upstream.get(UPSTREAM_COUNTERS[args.src], 0)
+    return {
+        "config": name,
+        "tiles": len(latencies),
+        "p50": np.percentile(milliseconds, 50),
+        "p95": np.percentile(milliseconds, 95),
+        "p99": np.percentile(milliseconds, 99),
+        "tiles_per_second": len(latencies) / elapsed,
+        "errors": errors,
+        "provisional": provisional,
+        "upstream_per_tile": upstream_calls / max(1, requests),
+        "upstream": upstream,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--src", default="vrr", choices=sorted(UPSTREAM_COUNTERS))
+    parser.add_argument("--configs", default="none,l1,sqlite")
+    parser.add_argument("--memcached", help="host:port, adds the memcached config")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--per-user", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--recordings")
+    parser.add_argument(
+        "--upstream-limit", help="concurrency:rate:queue, e.g. 64:0:1000"
+    )
+    parser.add_argument("--stub-port", type=int, default=8901)
+    parser.add_argument("--app-port", type=int, default=8902)
+    args = parser.parse_args()
+
+    configs = args.configs.split(",")
+    if args.memcached and "memcached" not in configs:
+        configs.append("memcached")
+
+    workload = WorkloadConfig(
+        users=args.users, steps_per_user=args.steps, seed=args.seed
+    )
+    sessions = generate_sessions(workload)
+    requests = sum(len(tiles) for _, steps in sessions for tiles in steps)
+    print(f"{args.users} users, {requests} tile requests each run, src {args.src}")
+
+    stub_args = [
+        "-m",
+        "benchmarks.loadtest.stub_servers",
+        "--port",
+        str(args.stub_port),
+        "--latency-ms",
+        str(args.latency_ms),
+        "--jitter-ms",
+        str(args.jitter_ms),
+        "--error-rate",
+        str(args.error_rate),
+    ]
+    if args.recordings:
+        stub_args += ["--recordings", args.recordings]
+    stub = start_process(stub_args, {}, f"http://127.0.0.1:{args.stub_port}/stats")
+
+    try:
+        print(
+            f"{'config':<10} {'tiles':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+            f" {'tiles/s':>8} {'errors':>6} {'provisional':>11} {'upstream/tile':>13}"
+        )
+        for name in configs:
+            result = run_config(name, args, sessions, workload)
+            print(
+                f"{result['config']:<10} {result['tiles']:>6}"
+                f" {result['p50']:>8.1f} {result['p95']:>8.1f} {result['p99']:>8.1f}"
+                f" {result['tiles_per_second']:>8.1f} {result['errors']:>6}"
+                f" {result['provisional']:>11} {result['upstream_per_tile']:>13.3f}"
+            )
+    finally:
+        stop_process(stub)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+# Local stand-ins for the VRR EFA, OpenTripPlanner and DB HAFAS APIs, so load
+# tests run without network access. Responses are synthetic (durations grow
+# with the distance) or replayed from recordings, with configurable latency
+# and injected errors.
+#
+# Run from the backend directory:
+#   python -m benchmarks.loadtest.stub_servers --port 8901 --latency-ms 80
+#
+# and point the backend to it:
+#   VRR_TRIP_URL=http://127.0.0.1:8901/vrr/XML_TRIP_REQUEST2
+#   VRR_STOPFINDER_URL=http://127.0.0.1:8901/vrr/XML_STOPFINDER_REQUEST
+#   OTP_URL=http://127.0.0.1:8901
+#   HAFAS_URL=http://127.0.0.1:8901/hafas/mgate.exe
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from stop_index import distance_meters
+
+# Destinations further away than this have no journey.
+MAX_DISTANCE_METERS = 40000
+
+
+@dataclass
+class StubConfig:
+    latency_ms: float = 50
+    jitter_ms: float = 20
+    error_rate: float = 0.0
+    # Directory with vrr_trip.json, otp_plan.json and hafas_tripsearch.json,
+    # each a list of recorded responses.
+    recordings: Optional[str] = None
+
+
+def seeded_random(*values) -> random.Random:
+    return random.Random(zlib.crc32(repr(values).encode("utf-8")))
+
+
+def synthetic_duration_seconds(origin: tuple, destination: tuple) -> Optional[int]:
+    distance = distance_meters(origin, destination)
+    if distance > MAX_DISTANCE_METERS:
+        return None
+
+    # About 20 km/h door to door, plus waiting and walking.
+    rng = seeded_random(origin, destination)
+    return int(300 + distance / 5.5 + rng.uniform(0, 600))
+
+
+def load_recordings(directory: Optional[str]) -> dict[str, list]:
+    recordings = {}
+    if directory is None:
+        return recordings
+
+    for name in ("vrr_trip", "otp_plan", "hafas_tripsearch"):
+        path = os.path.join(directory, f"{name}.json")
+        if os.path.exists(path):
+            with open(path) as file:
+                recordings[name] = json.load(file)
+
+    return recordings
+
+
+def parse_vrr_coordinates(value: str) -> tuple[float, float]:
+    # "lng:lat:WGS84[dd.ddddd]"
+    lng, lat, _ = value.split(":", 2)
+    return (float(lat), float(lng))
+
+
+def otp_plan(origin: tuple, destination: tuple, num_itineraries: int) -> dict:
+    seconds = synthetic_duration_seconds(origin, destination)
+    if seconds is None:
+        return {"itineraries": []}
+
+    rng = seeded_random(origin, destination, "otp")
+    return {
+        "itineraries": [
+            {"duration": seconds + i * rng.randint(0, 300)}
+            for i in range(max(1, num_itineraries))
+        ]
+    }
+
+
+def square_ring(center: tuple, half_size_degrees: float) -> list:
+    lat, lng = center
+    return [
+        [lng - half_size_degrees, lat - half_size_degrees],
+        [lng + half_size_degrees, lat - half_size_degrees],
+        [lng + half_size_degrees, lat + half_size_degrees],
+        [lng - half_size_degrees, lat + half_size_degrees],
+        [lng - half_size_degrees, lat - half_size_degrees],
+    ]
+
+
+def create_stub_app(config: StubConfig) -> FastAPI:
+    app = FastAPI()
+    calls = Counter()
+    recordings = load_recordings(config.recordings)
+
+    async def simulate(upstream: str) -> Optional[JSONResponse]:
+        calls[upstream] += 1
+        await asyncio.sleep(
+            max(0, config.latency_ms + random.uniform(-1, 1) * config.jitter_ms) / 1000
+        )
+
+        if random.random() < config.error_rate:
+            calls[f"{upstream}_errors"] += 1
+            return JSONResponse({"error": "injected"}, status_code=503)
+
+        return None
+
+    def replay(name: str, *key) -> Optional[dict]:
+        if name not in recordings:
+            return None
+
+        responses = recordings[name]
+        return responses[zlib.crc32(repr(key).encode("utf-8")) % len(responses)]
+
+    @app.get("/stats")
+    def get_stats():
+        return dict(calls)
+
+    @app.post("/stats/reset")
+    def reset_stats():
+        calls.clear()
+        return {}
+
+    @app.get("/vrr/XML_TRIP_REQUEST2")
+    async def vrr_trip(request: Request):
+        error = await simulate("vrr")
+        if error is not None:
+            return error
+
+        origin = parse_vrr_coordinates(request.query_params["name_origin"])
+        destination = parse_vrr_coordinates(request.query_params["name_destination"])
+
+        recorded = replay("vrr_trip", origin, destination)
+        if recorded is not None:
+            return recorded
+
+        seconds = synthetic_duration_seconds(origin, destination)
+        if seconds is None:
+            return {"journeys": []}
+
+        return {"journeys": [{"legs": [{"duration": seconds}]}]}
+
+    @app.get("/vrr/XML_STOPFINDER_REQUEST")
+    async def vrr_stopfinder(request: Request):
+        error = await simulate("vrr_stopfinder")
+        if error is not None:
+            return error
+
+        name = request.query_params.get("name_sf", "")
+        return {
+            "locations": [
+                {
+                    "id": f"stub:{name}:{i}",
+                    "name": f"{name} {i}",
+                    "type": "stop",
+                    "coord": [51.45 + i / 100, 7.01 + i / 100],
+                }
+                for i in range(5)
+            ]
+        }
+
+    @app.post("/otp/routers/default/index/graphql")
+    async def otp_graphql(request: Request):
+        body = await request.json()
+        variables = body["variables"]
+        origin = (variables["from_lat"], variables["from_lon"])
+        num_itineraries = variables.get("numItineraries", 1)
+
+        # Single plans use to_lat/to_lon, batches alias p0..pN with
+        # to_lat_0/to_lon_0 ..
+        if "to_lat" in variables:
+            destinations = {"plan": (variables["to_lat"], variables["to_lon"])}
+        else:
+            destinations = {
+                f"p{i}": (variables[f"to_lat_{i}"], variables[f"to_lon_{i}"])
+                for i in range(len(variables))
+                if f"to_lat_{i}" in variables
+            }
+
+        error = await simulate("otp")
+        calls["otp_plans"] += len(destinations)
+        if error is not None:
+            return error
+
+        data = {}
+        for alias, destination in destinations.items():
+            recorded = replay("otp_plan", origin, destination)
+            data[alias] = recorded or otp_plan(origin, destination, num_itineraries)
+
+        return {"data": data}
+
+    @app.get("/otp/traveltime/isochrone")
+    async def otp_isochrone(request: Request):
+        error = await simulate("otp_isochrone")
+        if error is not None:
+            return error
+
+        lat, lng = (float(part) for part in request.query_params["location"].split(","))
+        cutoffs = [
+            int(cutoff.rstrip("S")) for cutoff in request.query_params.getlist("cutoff")
+        ]
+
+        # Squares growing with the cutoff, about 20 km/h.
+        return {
+            "type": "FeatureCollection",
+            "features": [
+                {
+                    "type": "Feature",
+                    "properties": {"time": str(seconds)},
+                    "geometry": {
+                        "type": "Polygon",
+                        "coordinates": [
+                            square_ring((lat, lng), seconds * 5.5 / 111320)
+                        ],
+                    },
+                }
+                for seconds in sorted(cutoffs)
+            ],
+        }
+
+    @app.post("/hafas/mgate.exe")
+    async def hafas_mgate(request: Request):
+        error = await simulate("hafas")
+        if error is not None:
+            return error
+
+        body = json.loads(await request.body())
+        trip_search = body["svcReqL"][0]["req"]
+        origin_lid = trip_search["depLocL"][0]["lid"]
+        destination_lid = trip_search["arrLocL"][0]["lid"]
+
+        recorded = replay("hafas_tripsearch", origin_lid, destination_lid)
+        if recorded is not None:
+            return recorded
+
+        origin = parse_hafas_lid(origin_lid)
+        destination = parse_hafas_lid(destination_lid)
+        seconds = synthetic_duration_seconds(origin, destination)
+
+        connections = []
+        if seconds is not None:
+            hours, rest = divmod(seconds, 3600)
+            connections.append(
+                {
+                    "ctxRecon": "stub",
+                    "date": trip_search["outDate"],
+                    "dur": f"{hours:02d}{rest // 60:02d}{rest % 60:02d}",
+                    "secL": [],
+                }
+            )
+
+        return {
+            "svcResL": [{"err": "OK", "res": {"outConL": connections, "common": {}}}]
+        }
+
+    return app
+
+
+def parse_hafas_lid(lid: str) -> tuple[float, float]:
+    # "A=2@O=@X=7010000@Y=51450000@"
+    parts = dict(part.split("=", 1) for part in lid.split("@") if "=" in part)
+    return (int(parts["Y"]) / 1000000, int(parts["X"]) / 1000000)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--recordings")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        recordings=args.recordings,
+    )
+    uvicorn.run(
+        create_stub_app(config), host=args.host, port=args.port, log_level="warning"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Generates the tile requests of simulated map users: every user picks one of
+# a few popular origins, then pans and zooms a Leaflet viewport around it.
+# Each step requests the tiles of the viewport that were not visible before,
+# like the browser does.
+
+import random
+from dataclasses import dataclass
+
+import tilenames2
+
+# Popular origins (main stations) with their share of the users.
+POPULAR_ORIGINS = [
+    ((51.4508, 7.0131), 0.35),  # Essen Hbf
+    ((51.2198, 6.7943), 0.25),  # Düsseldorf Hbf
+    ((51.5178, 7.4593), 0.20),  # Dortmund Hbf
+    ((51.4783, 7.2232), 0.10),  # Bochum Hbf
+    ((51.4312, 6.7757), 0.10),  # Duisburg Hbf
+]
+
+
+@dataclass
+class WorkloadConfig:
+    users: int = 20
+    steps_per_user: int = 8
+    viewport_width: int = 1280
+    viewport_height: int = 800
+    tile_size: int = 64
+    min_zoom: int = 11
+    max_zoom: int = 15
+    seed: int = 42
+
+
+TileRequest = tuple[int, int, int]  # z, x, y
+
+
+def viewport_tiles(center: tuple, z: int, config: WorkloadConfig) -> set:
+    # The tiles visible around center, like Leaflet's GridLayer loads them.
+    x, y = tilenames2.latlon_to_xy(center[0], center[1], z, config.tile_size)
+    half_width = config.viewport_width / config.tile_size / 2
+    half_height = config.viewport_height / config.tile_size / 2
+
+    return {
+        (z, tile_x, tile_y)
+        for tile_x in range(int(x - half_width), int(x + half_width) + 1)
+        for tile_y in range(int(y - half_height), int(y + half_height) + 1)
+    }
+
+
+def user_session(
+    rng: random.Random, config: WorkloadConfig
+) -> tuple[tuple, list[list[TileRequest]]]:
+    # Returns the origin and the tiles requested at each step of one user.
+    origins, weights = zip(*POPULAR_ORIGINS)
+    origin = rng.choices(origins, weights)[0]
+
+    center = origin
+    z = rng.randint(config.min_zoom, config.min_zoom + 1)
+    seen = set()
+    steps = []
+
+    for _ in range(config.steps_per_user):
+        tiles = viewport_tiles(center, z, config)
+        steps.append(sorted(tiles - seen))
+        seen |= tiles
+
+        # Pan by up to half a viewport, or zoom in or out by one level.
+        action = rng.random()
+        if action < 0.6:
+            degrees_per_pixel = 360 / (config.tile_size * 2**z)
+            center = (
+                center[0]
+                + rng.uniform(-0.5, 0.5) * config.viewport_height * degrees_per_pixel,
+                center[1]
+                + rng.uniform(-0.5, 0.5) * config.viewport_width * degrees_per_pixel,
+            )
+        elif action < 0.85:
+            z = min(config.max_zoom, z + 1)
+        else:
+            z = max(config.min_zoom, z - 1)
+
+    return origin, steps
+
+
+def generate_sessions(config: WorkloadConfig) -> list:
+    rng = random.Random(config.seed)
+    return [user_session(rng, config) for _ in range(config.users)]
@@ -0,0 +1,129 @@
+# Measures OTP plan latency and result quality for several query profiles
+# (numItineraries, searchWindow), compared to the original "full" profile.
+#
+# Run from the backend directory against a local OTP (OTP_URL):
+#   python -m benchmarks.otp_query_profiles --samples 200
+# or against a stub with a synthetic latency model, to try the harness offline:
+#   python -m benchmarks.otp_query_profiles --stub
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+import httpx
+
+import clients.http
+from clients.opentripplanner_api import (
+    OtpQueryProfile,
+    QUERY_PROFILES,
+    query_trip_between_latlng_points_async,
+    get_best_journey_time_from_plan,
+)
+from util import get_9am_on_next_monday
+
+ORIGIN = (51.4508, 7.0131)  # Essen Hbf
+
+
+def parse_profiles(value: str) -> list[OtpQueryProfile]:
+    profiles = []
+    for profile in value.split(","):
+        num_itineraries, search_window_seconds = profile.split(":")
+        profiles.append(
+            OtpQueryProfile(int(num_itineraries), int(search_window_seconds))
+        )
+    return profiles
+
+
+def random_destinations(n: int) -> list:
+    rng = random.Random(42)
+    return [
+        (ORIGIN[0] + rng.uniform(-0.15, 0.15), ORIGIN[1] + rng.uniform(-0.25, 0.25))
+        for _ in range(n)
+    ]
+
+
+def stub_transport() -> httpx.MockTransport:
+    # Router cost grows with the search window and the number of itineraries.
+    async def handler(request: httpx.Request) -> httpx.Response:
+        variables = json.loads(request.content)["variables"]
+        num_itineraries = variables["numItineraries"]
+        search_window_seconds = variables["searchWindow"]
+
+        await asyncio.sleep(
+            0.005 + 0.002 * num_itineraries + 0.00001 * search_window_seconds
+        )
+
+        # One departure every 6 minutes, ordered by departure time like OTP
+        # returns them. Later departures are only seen with a wider window.
+        rng = random.Random(f"{variables['to_lat']},{variables['to_lon']}")
+        durations = [rng.randint(600, 4800) for _ in range(10)]
+        durations = durations[: search_window_seconds // 360][:num_itineraries]
+
+        itineraries = [{"duration": duration} for duration in durations]
+        return httpx.Response(
+            200, json={"data": {"plan": {"itineraries": itineraries}}}
+        )
+
+    return httpx.MockTransport(handler)
+
+
+async def run_profile(profile: OtpQueryProfile, destinations: list) -> tuple:
+    latencies = []
+    durations = []
+
+    for destination in destinations:
+        start = time.perf_counter()
+        trip = await query_trip_between_latlng_points_async(
+            ORIGIN,
+            destination,
+            departure_datetime=get_9am_on_next_monday(),
+            profile=profile,
+        )
+        latencies.append(time.perf_counter() - start)
+        durations.append(get_best_journey_time_from_plan(trip))
+
+    return latencies, durations
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--profiles", default="10:3600,5:1800,3:1800,1:1800,1:900")
+    parser.add_argument("--stub", action="store_true")
+    args = parser.parse_args()
+
+    if args.stub:
+        clients.http._async_client = httpx.AsyncClient(transport=stub_transport())
+
+    destinations = random_destinations(args.samples)
+    _, baseline = await run_profile(QUERY_PROFILES["full"], destinations)
+
+    print(
+        f"{'itineraries':>11} {'window s':>9} {'p50 ms':>8} {'p95 ms':>8}"
+        f" {'worse than full':>16}"
+    )
+    for profile in parse_profiles(args.profiles):
+        latencies, durations = await run_profile(profile, destinations)
+
+        worse = sum(
+            1
+            for duration, full_duration in zip(durations, baseline)
+            if full_duration is not None
+            and (duration is None or duration > full_duration)
+        )
+        p50 = statistics.median(latencies) * 1000
+        p95 = statistics.quantiles(latencies, n=20)[-1] * 1000
+
+        print(
+            f"{profile.num_itineraries:>11} {profile.search_window_seconds:>9}"
+            f" {p50:>8.1f} {p95:>8.1f} {worse / len(destinations):>15.0%}"
+        )
+
+    await clients.http.close_clients()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
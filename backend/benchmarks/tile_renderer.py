@@ -0,0 +1,52 @@
+# Compares cold (uncached) and warm (cached) tile rendering throughput.
+#
+# Run from the backend directory:
+#   python -m benchmarks.tile_renderer
+
+import random
+import time
+from datetime import timedelta
+
+from tile_renderer import render_tile, render_tile_uncached, tile_cache_info
+
+
+TILE_SIZES = [64, 128, 256]
+NUM_TILES = 500
+
+
+def random_durations(n: int) -> list:
+    rng = random.Random(42)
+    durations = []
+    for _ in range(n):
+        if rng.random() < 0.05:
+            durations.append(None)
+        else:
+            durations.append(timedelta(seconds=rng.randint(0, 75 * 60)))
+    return durations
+
+
+def tiles_per_second(render, tile_size: int, durations: list) -> float:
+    start = time.perf_counter()
+    for duration in durations:
+        render(tile_size, duration)
+    return len(durations) / (time.perf_counter() - start)
+
+
+def main():
+    durations = random_durations(NUM_TILES)
+
+    print(f"{'size':>6} {'cold tiles/s':>14} {'warm tiles/s':>14} {'speed-up':>10}")
+    for tile_size in TILE_SIZES:
+        cold = tiles_per_second(render_tile_uncached, tile_size, durations)
+
+        # First pass fills the cache, second pass measures pure hits.
+        tiles_per_second(render_tile, tile_size, durations)
+        warm = tiles_per_second(render_tile, tile_size, durations)
+
+        print(f"{tile_size:>6} {cold:>14.0f} {warm:>14.0f} {warm / cold:>9.0f}x")
+
+    print(tile_cache_info())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# Compares the scalar tilenames2 conversions with their numpy batch versions
+# for 10k and 1M points, and checks that both agree.
+#
+# Run from the backend directory:
+#   python -m benchmarks.tilenames
+
+import time
+
+import numpy as np
+
+import tilenames2
+
+Z = 14
+TILE_SIZE = 64
+POINT_COUNTS = [10_000, 1_000_000]
+# Both paths compute the same formulas, they may only differ in rounding.
+TOLERANCE_DEGREES = 1e-9
+TOLERANCE_TILES = 1e-6
+
+
+def random_points(n: int) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(42)
+    lat = rng.uniform(-85, 85, n)
+    lon = rng.uniform(-180, 180, n)
+    return lat, lon
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def check_agreement(name: str, scalar: list, batch: tuple, tolerance: float):
+    for i, values in enumerate(batch):
+        expected = np.array([value[i] for value in scalar])
+        difference = np.max(np.abs(expected - values))
+        if difference > tolerance:
+            raise AssertionError(f"{name}: paths differ by {difference}")
+
+
+def report(name: str, n: int, scalar_seconds: float, batch_seconds: float):
+    print(
+        f"{name:>14} {n:>9} {scalar_seconds:>10.3f} {batch_seconds:>10.4f}"
+        f" {scalar_seconds / batch_seconds:>8.0f}x"
+    )
+
+
+def main():
+    print(
+        f"{'function':>14} {'points':>9} {'scalar s':>10} {'batch s':>10} {'speed-up':>9}"
+    )
+
+    for n in POINT_COUNTS:
+        lat, lon = random_points(n)
+        lat_list, lon_list = lat.tolist(), lon.tolist()
+
+        scalar, scalar_seconds = timed(
+            lambda: [
+                tilenames2.latlon_to_xy(a, b, Z, TILE_SIZE)
+                for a, b in zip(lat_list, lon_list)
+            ]
+        )
+        batch, batch_seconds = timed(
+            lambda: tilenames2.latlon_to_xy_batch(lat, lon, Z, TILE_SIZE)
+        )
+        check_agreement("latlon_to_xy", scalar, batch, TOLERANCE_TILES)
+        report("latlon_to_xy", n, scalar_seconds, batch_seconds)
+
+        x, y = batch
+        x_list, y_list = x.tolist(), y.tolist()
+
+        scalar, scalar_seconds = timed(
+            lambda: [
+                tilenames2.xy_to_latlon(a, b, Z, TILE_SIZE)
+                for a, b in zip(x_list, y_list)
+            ]
+        )
+        batch, batch_seconds = timed(
+            lambda: tilenames2.xy_to_latlon_batch(x, y, Z, TILE_SIZE)
+        )
+        check_agreement("xy_to_latlon", scalar, batch, TOLERANCE_DEGREES)
+        report("xy_to_latlon", n, scalar_seconds, batch_seconds)
+
+        tile_x, tile_y = tilenames2.tile_xy_batch(lat, lon, Z, TILE_SIZE)
+        tile_x_list, tile_y_list = tile_x.tolist(), tile_y.tolist()
+
+        scalar, scalar_seconds = timed(
+            lambda: [
+                tilenames2.tile_edges(a, b, Z, TILE_SIZE)
+                for a, b in zip(tile_x_list, tile_y_list)
+            ]
+        )
+        batch, batch_seconds = timed(
+            lambda: tilenames2.tile_edges_batch(tile_x, tile_y, Z, TILE_SIZE)
+        )
+        check_agreement("tile_edges", scalar, batch, TOLERANCE_DEGREES)
+        report("tile_edges", n, scalar_seconds, batch_seconds)
+
+    print("Scalar and batch results agree.")
+
+
+if __name__ == "__main__":
+    main()
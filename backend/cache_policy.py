@@ -0,0 +1,57 @@
+import os
+import random
+import time
+from datetime import datetime
+from typing import Optional
+
+from cache_encoding import CacheEntry
+
+# Entries older than the soft TTL are still served, but refreshed in the
+# background. The hard TTL is when memcached drops them.
+CACHE_SOFT_TTL_SECONDS = int(os.environ.get("CACHE_SOFT_TTL_SECONDS", "86400"))
+CACHE_HARD_TTL_SECONDS = int(os.environ.get("CACHE_HARD_TTL_SECONDS", "604800"))
+
+# "N/A" results, where upstream answered but found no journey.
+CACHE_NA_SOFT_TTL_SECONDS = int(os.environ.get("CACHE_NA_SOFT_TTL_SECONDS", "21600"))
+CACHE_NA_HARD_TTL_SECONDS = int(os.environ.get("CACHE_NA_HARD_TTL_SECONDS", "86400"))
+
+# Failed upstream calls are only remembered briefly, with jitter so a burst of
+# failures does not expire (and get retried) all at once.
+CACHE_ERROR_TTL_SECONDS = int(os.environ.get("CACHE_ERROR_TTL_SECONDS", "600"))
+CACHE_ERROR_TTL_JITTER = float(os.environ.get("CACHE_ERROR_TTL_JITTER", "0.5"))
+
+
+def soft_ttl_seconds(cache_entry: CacheEntry) -> Optional[int]:
+    # None if the entry is never refreshed in the background.
+    if not cache_entry.is_present:
+        return None
+
+    if cache_entry.duration is None:
+        return CACHE_NA_SOFT_TTL_SECONDS
+
+    return CACHE_SOFT_TTL_SECONDS
+
+
+def hard_ttl_seconds(cache_entry: CacheEntry) -> int:
+    if not cache_entry.is_present:
+        jitter = random.uniform(-CACHE_ERROR_TTL_JITTER, CACHE_ERROR_TTL_JITTER)
+        return max(1, int(CACHE_ERROR_TTL_SECONDS * (1 + jitter)))
+
+    if cache_entry.duration is None:
+        return CACHE_NA_HARD_TTL_SECONDS
+
+    return CACHE_HARD_TTL_SECONDS
+
+
+def is_stale(cache_entry: CacheEntry) -> bool:
+    soft_ttl = soft_ttl_seconds(cache_entry)
+    if soft_ttl is None:
+        return False
+
+    computed_at = cache_entry.x_headers.get("x-cache-computed-at")
+    if computed_at is None:
+        # Written before entries were timestamped.
+        return True
+
+    age = time.time() - datetime.fromisoformat(computed_at).timestamp()
+    return age > soft_ttl
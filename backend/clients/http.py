@@ -0,0 +1,151 @@
+import asyncio
+import os
+import random
+import time
+from typing import Optional
+
+import httpx
+
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+HTTP_KEEPALIVE_SECONDS = float(os.environ.get("HTTP_KEEPALIVE_SECONDS", "30"))
+HTTP_TIMEOUT_SECONDS = float(os.environ.get("HTTP_TIMEOUT_SECONDS", "30"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(
+    os.environ.get("HTTP_CONNECT_TIMEOUT_SECONDS", "5")
+)
+
+# Transport errors, 429 and 5xx are retried with exponential backoff.
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "2"))
+HTTP_BACKOFF_SECONDS = float(os.environ.get("HTTP_BACKOFF_SECONDS", "0.2"))
+
+_async_client: Optional[httpx.AsyncClient] = None
+_client: Optional[httpx.Client] = None
+
+
+class HttpStats:
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+        self.retries = 0
+
+    def trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+
+    async def trace_async(self, event_name: str, info: dict):
+        self.trace(event_name, info)
+
+    def stats(self) -> dict:
+        reuse_rate = 0.0
+        if self.requests:
+            reuse_rate = max(0.0, 1 - self.connections_opened / self.requests)
+
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "connection_reuse_rate": reuse_rate,
+            "retries": self.retries,
+        }
+
+
+http_stats = HttpStats()
+
+
+def client_options() -> dict:
+    return {
+        "limits": httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+        ),
+        "timeout": httpx.Timeout(
+            HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS
+        ),
+    }
+
+
+def get_async_client() -> httpx.AsyncClient:
+    # One pooled keep-alive client per worker, shared by all upstream APIs.
+    global _async_client
+
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(**client_options())
+
+    return _async_client
+
+
+def get_client() -> httpx.Client:
+    # The blocking counterpart, used by the synchronous clients.
+    global _client
+
+    if _client is None:
+        _client = httpx.Client(**client_options())
+
+    return _client
+
+
+def should_retry(response: Optional[httpx.Response], attempt: int) -> bool:
+    if attempt >= HTTP_RETRIES:
+        return False
+
+    return (
+        response is None or response.status_code == 429 or response.status_code >= 500
+    )
+
+
+def backoff_seconds(attempt: int) -> float:
+    return HTTP_BACKOFF_SECONDS * 2**attempt * random.uniform(0.5, 1.5)
+
+
+async def request_async(method: str, url: str, **kwargs) -> httpx.Response:
+    for attempt in range(HTTP_RETRIES + 1):
+        http_stats.requests += 1
+        response = None
+
+        try:
+            response = await get_async_client().request(
+                method, url, extensions={"trace": http_stats.trace_async}, **kwargs
+            )
+        except httpx.TransportError:
+            if not should_retry(None, attempt):
+                raise
+
+        if not should_retry(response, attempt):
+            return response
+
+        http_stats.retries += 1
+        await asyncio.sleep(backoff_seconds(attempt))
+
+
+def request(method: str, url: str, **kwargs) -> httpx.Response:
+    for attempt in range(HTTP_RETRIES + 1):
+        http_stats.requests += 1
+        response = None
+
+        try:
+            response = get_client().request(
+                method, url, extensions={"trace": http_stats.trace}, **kwargs
+            )
+        except httpx.TransportError:
+            if not should_retry(None, attempt):
+                raise
+
+        if not should_retry(response, attempt):
+            return response
+
+        http_stats.retries += 1
+        time.sleep(backoff_seconds(attempt))
+
+
+async def close_clients():
+    global _async_client, _client
+
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+    if _client is not None:
+        _client.close()
+        _client = None
@@ -1,14 +1,49 @@
-import requests
+import asyncio
+import os
+from dataclasses import dataclass
 from typing import Optional
 from datetime import timedelta, datetime
 
 from tilenames2 import LatLng
+from clients.http import request, request_async
+
+OTP_URL = os.environ.get("OTP_URL", "http://localhost:8080")
+
+
+@dataclass(frozen=True)
+class OtpQueryProfile:
+    num_itineraries: int
+    search_window_seconds: int
+
+
+QUERY_PROFILES = {
+    # What the map originally asked for.
+    "full": OtpQueryProfile(num_itineraries=10, search_window_seconds=3600),
+    # We only keep the fastest itinerary. A 30 minute window still sees one
+    # departure of every line running at least half-hourly, and the router can
+    # stop after a few itineraries.
+    "fastest": OtpQueryProfile(num_itineraries=5, search_window_seconds=1800),
+}
+DEFAULT_QUERY_PROFILE = QUERY_PROFILES["full"]
+
+
+def get_query_profile(
+    name: str,
+    num_itineraries: Optional[int] = None,
+    search_window_seconds: Optional[int] = None,
+) -> OtpQueryProfile:
+    profile = QUERY_PROFILES[name]
+
+    return OtpQueryProfile(
+        num_itineraries=num_itineraries or profile.num_itineraries,
+        search_window_seconds=search_window_seconds or profile.search_window_seconds,
+    )
 
 
 def query_trip_between_latlng_points_old(
     origin_latlng: LatLng, destination_latlng: LatLng
 ) -> any:
-    url = "http://localhost:8080/otp/routers/default/plan"
+    url = f"{OTP_URL}/otp/routers/default/plan"
 
     query = {
         "fromPlace": format_coordinates(origin_latlng),
@@ -24,7 +59,7 @@ def query_trip_between_latlng_points_old(
         "baseLayer": "OSM Standard Tiles",
     }
 
-    response = requests.get(url, params=query)
+    response = request("GET", url, params=query)
     return response.json()
 
 
@@ -33,14 +68,53 @@ def query_trip_between_latlng_points(
     destination_latlng: LatLng,
     departure_datetime: datetime = None,
     arrival_datetime: datetime = None,
+    profile: OtpQueryProfile = DEFAULT_QUERY_PROFILE,
+) -> any:
+    url, query_json = prepare_plan_request(
+        origin_latlng,
+        destination_latlng,
+        departure_datetime,
+        arrival_datetime,
+        profile,
+    )
+
+    response = request("POST", url, json=query_json)
+    return response.json()["data"]["plan"]
+
+
+async def query_trip_between_latlng_points_async(
+    origin_latlng: LatLng,
+    destination_latlng: LatLng,
+    departure_datetime: datetime = None,
+    arrival_datetime: datetime = None,
+    profile: OtpQueryProfile = DEFAULT_QUERY_PROFILE,
 ) -> any:
+    url, query_json = prepare_plan_request(
+        origin_latlng,
+        destination_latlng,
+        departure_datetime,
+        arrival_datetime,
+        profile,
+    )
+
+    response = await request_async("POST", url, json=query_json)
+    return response.json()["data"]["plan"]
+
+
+def prepare_plan_request(
+    origin_latlng: LatLng,
+    destination_latlng: LatLng,
+    departure_datetime: Optional[datetime],
+    arrival_datetime: Optional[datetime],
+    profile: OtpQueryProfile = DEFAULT_QUERY_PROFILE,
+) -> tuple[str, dict]:
     if departure_datetime is not None and arrival_datetime is not None:
         raise ValueError("Cannot specify both departure_datetime and arrival_datetime")
 
-    url = "http://localhost:8080/otp/routers/default/index/graphql"
+    url = f"{OTP_URL}/otp/routers/default/index/graphql"
 
     query = """
-query ExampleQuery($arriveBy: Boolean, $date: String, $time: String, $from_lat: Float!, $from_lon: Float!, $to_lat: Float!, $to_lon: Float!) {
+query ExampleQuery($arriveBy: Boolean, $date: String, $time: String, $from_lat: Float!, $from_lon: Float!, $to_lat: Float!, $to_lon: Float!, $numItineraries: Int, $searchWindow: Long) {
   plan(
     from: {
       lat: $from_lat,
@@ -53,8 +127,8 @@ query ExampleQuery($arriveBy: Boolean, $date: String, $time: String, $from_lat:
     date: $date,
     time: $time,
     arriveBy: $arriveBy,
-    searchWindow: 3600,
-    numItineraries: 10
+    searchWindow: $searchWindow,
+    numItineraries: $numItineraries
   ) {
     itineraries {
       duration
@@ -67,6 +141,8 @@ query ExampleQuery($arriveBy: Boolean, $date: String, $time: String, $from_lat:
         "from_lon": origin_latlng[1],
         "to_lat": destination_latlng[0],
         "to_lon": destination_latlng[1],
+        "numItineraries": profile.num_itineraries,
+        "searchWindow": profile.search_window_seconds,
     }
 
     if departure_datetime is not None:
@@ -85,8 +161,193 @@ query ExampleQuery($arriveBy: Boolean, $date: String, $time: String, $from_lat:
         "operationName": "ExampleQuery",
     }
 
-    response = requests.post(url, json=query_json)
-    return response.json()["data"]["plan"]
+    return url, query_json
+
+
+def prepare_batch_plan_request(
+    origin_latlng: LatLng,
+    destination_latlngs: list[LatLng],
+    departure_datetime: datetime,
+    profile: OtpQueryProfile = DEFAULT_QUERY_PROFILE,
+) -> tuple[str, dict]:
+    url = f"{OTP_URL}/otp/routers/default/index/graphql"
+
+    # One aliased plan field per destination, all sharing origin and time.
+    plan_fields = []
+    variable_definitions = [
+        "$date: String",
+        "$time: String",
+        "$from_lat: Float!",
+        "$from_lon: Float!",
+        "$numItineraries: Int",
+        "$searchWindow: Long",
+    ]
+    variables = {
+        "date": departure_datetime.strftime("%Y-%m-%d"),
+        "time": departure_datetime.strftime("%H:%M:%S"),
+        "from_lat": origin_latlng[0],
+        "from_lon": origin_latlng[1],
+        "numItineraries": profile.num_itineraries,
+        "searchWindow": profile.search_window_seconds,
+    }
+
+    for i, destination_latlng in enumerate(destination_latlngs):
+        variable_definitions += [f"$to_lat_{i}: Float!", f"$to_lon_{i}: Float!"]
+        variables[f"to_lat_{i}"] = destination_latlng[0]
+        variables[f"to_lon_{i}"] = destination_latlng[1]
+        plan_fields.append(f"""
+  p{i}: plan(
+    from: {{ lat: $from_lat, lon: $from_lon }},
+    to: {{ lat: $to_lat_{i}, lon: $to_lon_{i} }},
+    date: $date,
+    time: $time,
+    arriveBy: false,
+    searchWindow: $searchWindow,
+    numItineraries: $numItineraries
+  ) {{
+    itineraries {{
+      duration
+    }}
+  }}""")
+
+    query = f"""
+query BatchQuery({", ".join(variable_definitions)}) {{{"".join(plan_fields)}
+}}"""
+
+    query_json = {
+        "query": query,
+        "variables": variables,
+        "operationName": "BatchQuery",
+    }
+
+    return url, query_json
+
+
+async def query_trips_from_latlng_point_async(
+    origin_latlng: LatLng,
+    destination_latlngs: list[LatLng],
+    departure_datetime: datetime,
+    profile: OtpQueryProfile = DEFAULT_QUERY_PROFILE,
+) -> list[any]:
+    url, query_json = prepare_batch_plan_request(
+        origin_latlng, destination_latlngs, departure_datetime, profile
+    )
+
+    response = await request_async("POST", url, json=query_json)
+    data = response.json().get("data") or {}
+
+    return [data.get(f"p{i}") for i in range(len(destination_latlngs))]
+
+
+class PlanBatcher:
+    # Collects plan queries for the same origin and departure time for up to
+    # window_seconds (or max_batch_size queries) and sends them as one
+    # multi-plan GraphQL request.
+
+    def __init__(
+        self,
+        max_batch_size: int,
+        window_seconds: float,
+        profile: OtpQueryProfile = DEFAULT_QUERY_PROFILE,
+    ):
+        self.max_batch_size = max_batch_size
+        self.window_seconds = window_seconds
+        self.profile = profile
+        self.pending: dict[tuple, list[tuple[LatLng, asyncio.Future]]] = {}
+        # The event loop only keeps weak references to tasks, a collected
+        # batch would leave all of its waiters hanging.
+        self.sending: set[asyncio.Task] = set()
+        self.batches_sent = 0
+        self.plans_sent = 0
+
+    async def query_trip(
+        self,
+        origin_latlng: LatLng,
+        destination_latlng: LatLng,
+        departure_datetime: datetime,
+    ) -> any:
+        loop = asyncio.get_running_loop()
+        batch_key = (tuple(origin_latlng), departure_datetime)
+
+        batch = self.pending.get(batch_key)
+        if batch is None:
+            batch = []
+            self.pending[batch_key] = batch
+            loop.call_later(self.window_seconds, self.flush, batch_key, batch)
+
+        future = loop.create_future()
+        batch.append((destination_latlng, future))
+
+        if len(batch) >= self.max_batch_size:
+            self.flush(batch_key, batch)
+
+        return await future
+
+    def flush(self, batch_key: tuple, batch: list):
+        # The timer of a batch that was already flushed because it was full
+        # must not flush its successor.
+        if self.pending.get(batch_key) is not batch:
+            return
+
+        del self.pending[batch_key]
+        task = asyncio.ensure_future(self.send(batch_key, batch))
+        self.sending.add(task)
+        task.add_done_callback(self.sending.discard)
+
+    async def send(self, batch_key: tuple, batch: list):
+        origin_latlng, departure_datetime = batch_key
+        destination_latlngs = [destination_latlng for destination_latlng, _ in batch]
+
+        self.batches_sent += 1
+        self.plans_sent += len(batch)
+
+        try:
+            trips = await query_trips_from_latlng_point_async(
+                origin_latlng, destination_latlngs, departure_datetime, self.profile
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (destination_latlng, future), trip in zip(batch, trips):
+            if future.done():
+                continue
+
+            if trip is None:
+                future.set_exception(
+                    RuntimeError(f"OTP returned no plan for {destination_latlng}")
+                )
+            else:
+                future.set_result(trip)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches_sent,
+            "plans": self.plans_sent,
+        }
+
+
+async def query_isochrones_async(
+    origin_latlng: LatLng,
+    departure_datetime: datetime,
+    cutoffs: list[timedelta],
+) -> any:
+    # Uses the TravelTime sandbox API, which has to be enabled in OTP's
+    # otp-config.json ("SandboxAPITravelTime").
+    url = f"{OTP_URL}/otp/traveltime/isochrone"
+
+    query = [
+        ("location", f"{origin_latlng[0]},{origin_latlng[1]}"),
+        ("time", departure_datetime.isoformat()),
+        ("modes", "WALK,TRANSIT"),
+        *[("cutoff", f"{int(cutoff.total_seconds())}S") for cutoff in cutoffs],
+    ]
+
+    response = await request_async("GET", url, params=query)
+    response.raise_for_status()
+    return response.json()
 
 
 def get_best_journey_time_from_plan(trip: any) -> Optional[timedelta]:
@@ -1,8 +1,18 @@
-import requests
+import os
 from typing import Optional, Literal
 from datetime import timedelta, datetime
 
 from tilenames2 import LatLng
+from clients.http import request, request_async
+
+# The test instance also offers a STOPFINDER at
+# http://openservice-test.vrr.de/static02/XML_STOPFINDER_REQUEST
+VRR_STOPFINDER_URL = os.environ.get(
+    "VRR_STOPFINDER_URL", "http://www.vrr.de/vrr-efa/XML_STOPFINDER_REQUEST"
+)
+VRR_TRIP_URL = os.environ.get(
+    "VRR_TRIP_URL", "http://openservice-test.vrr.de/static03/XML_TRIP_REQUEST2"
+)
 
 common_vrr_query_params = {"outputFormat": "rapidJSON", "version": "10.4.18.18"}
 
@@ -26,8 +36,7 @@ def format_coordinates(latlng: LatLng) -> str:
 
 
 def search_locations(search: str) -> any:
-    url = "http://openservice-test.vrr.de/static02/XML_STOPFINDER_REQUEST"
-    url = "http://www.vrr.de/vrr-efa/XML_STOPFINDER_REQUEST"
+    url = VRR_STOPFINDER_URL
 
     query = {
         "name_sf": search,
@@ -48,7 +57,7 @@ def search_locations(search: str) -> any:
         **common_vrr_query_params,
     }
 
-    response = requests.get(url, params=query)
+    response = request("GET", url, params=query)
     return response.json()
 
 
@@ -58,10 +67,38 @@ def query_trip_between_latlng_points(
     departure_datetime: datetime = None,
     arrival_datetime: datetime = None,
 ) -> any:
+    url, query = prepare_trip_request(
+        origin_latlng, destination_latlng, departure_datetime, arrival_datetime
+    )
+
+    response = request("GET", url, params=query)
+    return response.json()
+
+
+async def query_trip_between_latlng_points_async(
+    origin_latlng: LatLng,
+    destination_latlng: LatLng,
+    departure_datetime: datetime = None,
+    arrival_datetime: datetime = None,
+) -> any:
+    url, query = prepare_trip_request(
+        origin_latlng, destination_latlng, departure_datetime, arrival_datetime
+    )
+
+    response = await request_async("GET", url, params=query)
+    return response.json()
+
+
+def prepare_trip_request(
+    origin_latlng: LatLng,
+    destination_latlng: LatLng,
+    departure_datetime: Optional[datetime],
+    arrival_datetime: Optional[datetime],
+) -> tuple[str, dict]:
     if departure_datetime is not None and arrival_datetime is not None:
         raise ValueError("Cannot specify both departure_datetime and arrival_datetime")
 
-    url = "http://openservice-test.vrr.de/static03/XML_TRIP_REQUEST2"
+    url = VRR_TRIP_URL
 
     query = {
         "name_origin": format_coordinates(origin_latlng),
@@ -74,8 +111,7 @@ def query_trip_between_latlng_points(
         **common_vrr_query_params,
     }
 
-    response = requests.get(url, params=query)
-    return response.json()
+    return url, query
 
 
 def prepare_planed_time_option(
@@ -0,0 +1,41 @@
+import sys
+from array import array
+from typing import Optional
+
+import tilenames2
+from tile_renderer import duration_to_minute_bucket
+
+# uint16 value of tiles without a duration (no journey or not computed).
+NO_DURATION = 0xFFFF
+
+BoundingBox = tuple[float, float, float, float]  # S,W,N,E
+
+# The web mercator tiles end here, tile_xy fails at the poles.
+MAX_LATITUDE = 85.0511
+
+
+def tile_range(bbox: BoundingBox, z: int, tile_size: int) -> tuple[int, int, int, int]:
+    # Returns x, y of the north west tile and the width and height of the grid.
+    south, west, north, east = bbox
+    x1, y1 = tilenames2.tile_xy(north, west, z, tile_size)
+    x2, y2 = tilenames2.tile_xy(south, east, z, tile_size)
+
+    return (x1, y1, max(0, x2 - x1 + 1), max(0, y2 - y1 + 1))
+
+
+def encode_minutes_uint16(minutes: list[Optional[int]]) -> bytes:
+    values = array(
+        "H",
+        (
+            NO_DURATION if value is None else min(value, NO_DURATION - 1)
+            for value in minutes
+        ),
+    )
+    if sys.byteorder == "big":
+        values.byteswap()
+
+    return values.tobytes()
+
+
+def durations_to_minutes(durations: list) -> list[Optional[int]]:
+    return [duration_to_minute_bucket(duration) for duration in durations]
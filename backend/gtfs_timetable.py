@@ -0,0 +1,384 @@
+import csv
+import io
+import os
+import zipfile
+from array import array
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Iterator, Optional, TextIO
+
+import numpy as np
+
+from stop_index import StopIndex, distance_meters, read_stops
+from tilenames2 import LatLng
+
+# Walking, including detours, for access, egress and transfers.
+RAPTOR_WALK_METERS_PER_SECOND = float(
+    os.environ.get("RAPTOR_WALK_METERS_PER_SECOND", "1.0")
+)
+RAPTOR_ACCESS_METERS = float(os.environ.get("RAPTOR_ACCESS_METERS", "1000"))
+RAPTOR_EGRESS_METERS = float(os.environ.get("RAPTOR_EGRESS_METERS", "1000"))
+RAPTOR_TRANSFER_METERS = float(os.environ.get("RAPTOR_TRANSFER_METERS", "400"))
+RAPTOR_CHANGE_SECONDS = int(os.environ.get("RAPTOR_CHANGE_SECONDS", "120"))
+RAPTOR_MAX_ROUNDS = int(os.environ.get("RAPTOR_MAX_ROUNDS", "6"))
+RAPTOR_MAX_MINUTES = int(os.environ.get("RAPTOR_MAX_MINUTES", "120"))
+
+UNREACHED = np.iinfo(np.int32).max
+# Times are seconds since midnight of the service day, GTFS allows more than
+# 24:00:00 for trips running past midnight.
+TIME_SPAN = 1 << 20
+
+WEEKDAYS = [
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+]
+
+
+@contextmanager
+def open_feed_file(feed_path: str, name: str) -> Iterator[Optional[TextIO]]:
+    # A feed is either a directory or the zip it is usually distributed as.
+    # Yields None for optional files the feed does not have.
+    if os.path.isdir(feed_path):
+        path = os.path.join(feed_path, name)
+        if not os.path.exists(path):
+            yield None
+            return
+
+        with open(path, encoding="utf-8-sig", newline="") as file:
+            yield file
+        return
+
+    with zipfile.ZipFile(feed_path) as feed:
+        if name not in feed.namelist():
+            yield None
+            return
+
+        with feed.open(name) as raw:
+            yield io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+
+
+def read_feed_rows(feed_path: str, name: str) -> Iterator[dict]:
+    with open_feed_file(feed_path, name) as file:
+        if file is not None:
+            yield from csv.DictReader(file)
+
+
+def parse_gtfs_date(value: str) -> date:
+    return date(int(value[0:4]), int(value[4:6]), int(value[6:8]))
+
+
+def parse_gtfs_time(value: str) -> int:
+    hours, minutes, seconds = value.strip().split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def active_service_ids(feed_path: str, service_date: date) -> set[str]:
+    service_ids = set()
+    weekday = WEEKDAYS[service_date.weekday()]
+
+    for row in read_feed_rows(feed_path, "calendar.txt"):
+        start_date = parse_gtfs_date(row["start_date"])
+        end_date = parse_gtfs_date(row["end_date"])
+        if row[weekday] == "1" and start_date <= service_date <= end_date:
+            service_ids.add(row["service_id"])
+
+    for row in read_feed_rows(feed_path, "calendar_dates.txt"):
+        if parse_gtfs_date(row["date"]) != service_date:
+            continue
+
+        if row["exception_type"] == "1":
+            service_ids.add(row["service_id"])
+        elif row["exception_type"] == "2":
+            service_ids.discard(row["service_id"])
+
+    return service_ids
+
+
+def walk_seconds(distance: float) -> int:
+    return int(distance / RAPTOR_WALK_METERS_PER_SECOND)
+
+
+class StopArrivals:
+    # The result of one search: the earliest arrival at every stop, answering
+    # the duration to any destination via the stops around it.
+
+    def __init__(
+        self,
+        timetable: "GtfsTimetable",
+        origin_latlng: LatLng,
+        departure_seconds: int,
+        arrivals: np.ndarray,
+        rounds: int,
+    ):
+        self.timetable = timetable
+        self.origin_latlng = origin_latlng
+        self.departure_seconds = departure_seconds
+        self.arrivals = arrivals
+        self.rounds = rounds
+
+    def duration_to(self, destination_latlng: LatLng) -> Optional[timedelta]:
+        best = UNREACHED
+
+        distance = distance_meters(self.origin_latlng, destination_latlng)
+        if distance <= RAPTOR_EGRESS_METERS:
+            best = self.departure_seconds + walk_seconds(distance)
+
+        for i, distance in self.timetable.stop_index.within(
+            destination_latlng, RAPTOR_EGRESS_METERS
+        ):
+            if self.arrivals[i] != UNREACHED:
+                best = min(best, int(self.arrivals[i]) + walk_seconds(distance))
+
+        if best == UNREACHED:
+            return None
+
+        return timedelta(seconds=best - self.departure_seconds)
+
+    def reached_stops(self) -> int:
+        return int(np.count_nonzero(self.arrivals != UNREACHED))
+
+
+class GtfsTimetable:
+    # The trips of one service day in flat numpy arrays, searched with RAPTOR
+    # (Delling et al., "Round-Based Public Transit Routing").
+    #
+    # Trips calling at the same stops in the same order form a pattern, with
+    # no trip overtaking another. Every stop of every pattern is a position,
+    # and the times of a position are one column, sorted by trip. A round
+    # boards the earliest trip at every position with one searchsorted over
+    # all columns, and carries it along the pattern with a running minimum,
+    # so a search costs a few numpy passes per round, whatever the number of
+    # patterns.
+
+    def __init__(self, stops, patterns: list[tuple[list[int], np.ndarray]]):
+        # patterns are (stop indices, trips x positions x (arrival, departure)).
+        self.stops = stops
+        self.stop_index = StopIndex(stops)
+        self.pattern_count = len(patterns)
+        self.trip_count = sum(len(times) for _, times in patterns)
+
+        pos_stop = []
+        pos_trip_count = []
+        pos_first = []
+        pos_pattern = []
+        arrivals = []
+        departures = []
+        for pattern, (stop_indices, times) in enumerate(patterns):
+            for j, stop in enumerate(stop_indices):
+                pos_stop.append(stop)
+                pos_trip_count.append(len(times))
+                pos_first.append(j == 0)
+                pos_pattern.append(pattern)
+                arrivals.append(times[:, j, 0])
+                departures.append(times[:, j, 1])
+
+        self.pos_stop = np.array(pos_stop, dtype=np.int32)
+        self.pos_trip_count = np.array(pos_trip_count, dtype=np.int64)
+        self.pos_first = np.array(pos_first, dtype=bool)
+        self.pos_pattern = np.array(pos_pattern, dtype=np.int64)
+        self.col_start = np.concatenate(([0], np.cumsum(self.pos_trip_count)[:-1]))
+        # Every pattern gets its own range of values in the running maximum.
+        self.trip_span = int(self.pos_trip_count.max(initial=0)) + 1
+        self.pattern_base = self.pos_pattern * self.trip_span
+        self.arrivals = np.concatenate(arrivals or [[]]).astype(np.int32)
+        departures = np.concatenate(departures or [[]]).astype(np.int64)
+
+        # One sorted key per (position, departure) for the boarding search.
+        positions = np.repeat(np.arange(len(pos_stop)), self.pos_trip_count)
+        self.departure_keys = positions * TIME_SPAN + departures
+
+        # Positions grouped by stop, to take the best arrival per stop.
+        self.pos_by_stop = np.argsort(self.pos_stop, kind="stable")
+        self.stops_with_positions, self.stop_group_starts = np.unique(
+            self.pos_stop[self.pos_by_stop], return_index=True
+        )
+
+        self.transfer_from, self.transfer_to, self.transfer_seconds = (
+            self.build_transfers()
+        )
+
+    def build_transfers(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        transfer_from = array("i")
+        transfer_to = array("i")
+        transfer_seconds = array("i")
+
+        for i, stop in enumerate(self.stops):
+            for j, distance in self.stop_index.within(
+                (stop.lat, stop.lng), RAPTOR_TRANSFER_METERS
+            ):
+                if i != j:
+                    transfer_from.append(i)
+                    transfer_to.append(j)
+                    transfer_seconds.append(walk_seconds(distance))
+
+        return (
+            np.frombuffer(transfer_from, dtype=np.int32),
+            np.frombuffer(transfer_to, dtype=np.int32),
+            np.frombuffer(transfer_seconds, dtype=np.int32),
+        )
+
+    @classmethod
+    def from_gtfs(cls, feed_path: str, service_date: date) -> "GtfsTimetable":
+        with open_feed_file(feed_path, "stops.txt") as file:
+            stops = read_stops(file)
+        stop_indices = {stop.stop_id: i for i, stop in enumerate(stops)}
+
+        service_ids = active_service_ids(feed_path, service_date)
+        trip_indices = {}
+        for row in read_feed_rows(feed_path, "trips.txt"):
+            if row["service_id"] in service_ids:
+                trip_indices[row["trip_id"]] = len(trip_indices)
+
+        # stop_times.txt is by far the largest file, so its rows of the day
+        # go straight into compact arrays. Stops without times (not timing
+        # points) are skipped, trips cannot be boarded there.
+        trip_column = array("i")
+        sequence_column = array("i")
+        stop_column = array("i")
+        arrival_column = array("i")
+        departure_column = array("i")
+        for row in read_feed_rows(feed_path, "stop_times.txt"):
+            trip = trip_indices.get(row["trip_id"])
+            stop = stop_indices.get(row["stop_id"])
+            if trip is None or stop is None or not row["departure_time"]:
+                continue
+
+            trip_column.append(trip)
+            sequence_column.append(int(row["stop_sequence"]))
+            stop_column.append(stop)
+            arrival_column.append(
+                parse_gtfs_time(row["arrival_time"] or row["departure_time"])
+            )
+            departure_column.append(parse_gtfs_time(row["departure_time"]))
+
+        trips = np.frombuffer(trip_column, dtype=np.int32)
+        order = np.lexsort((np.frombuffer(sequence_column, dtype=np.int32), trips))
+        trips = trips[order]
+        stop_column = np.frombuffer(stop_column, dtype=np.int32)[order]
+        times = np.stack(
+            (
+                np.frombuffer(arrival_column, dtype=np.int32)[order],
+                np.frombuffer(departure_column, dtype=np.int32)[order],
+            ),
+            axis=1,
+        )
+
+        # Trips by stop sequence, then split where a trip would overtake one.
+        trips_by_stops: dict[bytes, list[np.ndarray]] = {}
+        boundaries = np.flatnonzero(np.diff(trips)) + 1
+        for start, end in zip(
+            np.concatenate(([0], boundaries)), np.append(boundaries, len(trips))
+        ):
+            if end - start < 2:
+                continue
+            key = stop_column[start:end].tobytes()
+            trips_by_stops.setdefault(key, []).append(times[start:end])
+
+        patterns = []
+        for key, trip_times in trips_by_stops.items():
+            stop_sequence = np.frombuffer(key, dtype=np.int32).tolist()
+            trip_times.sort(key=lambda trip: trip[0, 1])
+
+            groups: list[list[np.ndarray]] = []
+            for trip in trip_times:
+                for group in groups:
+                    if np.all(trip >= group[-1]):
+                        group.append(trip)
+                        break
+                else:
+                    groups.append([trip])
+
+            for group in groups:
+                patterns.append((stop_sequence, np.stack(group)))
+
+        return cls(stops, patterns)
+
+    def earliest_arrivals(
+        self, origin_latlng: LatLng, departure_seconds: int
+    ) -> StopArrivals:
+        stop_count = len(self.stops)
+        latest = departure_seconds + RAPTOR_MAX_MINUTES * 60
+
+        best = np.full(stop_count, UNREACHED, dtype=np.int64)
+        for i, distance in self.stop_index.within(origin_latlng, RAPTOR_ACCESS_METERS):
+            best[i] = departure_seconds + walk_seconds(distance)
+
+        # Only stops improved in the last round are boarded from, the others
+        # were boarded from before.
+        marked = best.copy()
+        change_seconds = 0
+        rounds = 0
+
+        for _ in range(RAPTOR_MAX_ROUNDS):
+            if not np.any(marked != UNREACHED):
+                break
+            rounds += 1
+
+            ready = marked[self.pos_stop]
+            boardable = ready != UNREACHED
+            keys = np.arange(len(self.pos_stop)) * TIME_SPAN + np.minimum(
+                ready + change_seconds, TIME_SPAN - 1
+            )
+            trip = np.searchsorted(self.departure_keys, keys) - self.col_start
+            trip = np.where(boardable, trip, self.pos_trip_count)
+
+            # Earliest trip boarded at or before every position of its
+            # pattern, as a running maximum that restarts at every pattern.
+            span = self.trip_span
+            carried = np.maximum.accumulate(self.pattern_base + (span - 1 - trip))
+            carried = span - 1 - (carried - self.pattern_base)
+            # Alighting is only possible after boarding.
+            carried = np.roll(carried, 1)
+            carried[self.pos_first] = span
+
+            on_trip = carried < self.pos_trip_count
+            arrival = np.full(len(self.pos_stop), UNREACHED, dtype=np.int64)
+            arrival[on_trip] = self.arrivals[self.col_start[on_trip] + carried[on_trip]]
+
+            round_best = np.full(stop_count, UNREACHED, dtype=np.int64)
+            round_best[self.stops_with_positions] = np.minimum.reduceat(
+                arrival[self.pos_by_stop], self.stop_group_starts
+            )
+            round_best[round_best > latest] = UNREACHED
+
+            improved = round_best < best
+            best = np.minimum(best, round_best)
+
+            # Walking transfers from the stops reached by this round.
+            from_improved = improved[self.transfer_from]
+            walked = np.full(stop_count, UNREACHED, dtype=np.int64)
+            np.minimum.at(
+                walked,
+                self.transfer_to[from_improved],
+                best[self.transfer_from[from_improved]]
+                + self.transfer_seconds[from_improved],
+            )
+            walked[walked > latest] = UNREACHED
+            improved |= walked < best
+            best = np.minimum(best, walked)
+
+            marked = np.where(improved, best, UNREACHED)
+            change_seconds = RAPTOR_CHANGE_SECONDS
+
+        return StopArrivals(
+            self, origin_latlng, departure_seconds, best.astype(np.int32), rounds
+        )
+
+    def stats(self) -> dict:
+        return {
+            "stops": len(self.stops),
+            "patterns": self.pattern_count,
+            "trips": self.trip_count,
+            "positions": len(self.pos_stop),
+            "transfers": len(self.transfer_from),
+            "array_bytes": sum(
+                value.nbytes
+                for value in vars(self).values()
+                if isinstance(value, np.ndarray)
+            ),
+        }
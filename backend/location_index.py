@@ -0,0 +1,158 @@
+import bisect
+import functools
+import os
+import threading
+from typing import Callable, Iterable, List
+
+from lru_cache import LRUCache
+from stop_index import load_stops_txt
+
+# A query is answered locally when the index has at least this many matches,
+# otherwise upstream is asked and its results are added to the index.
+LOCATION_SEARCH_MIN_RESULTS = int(os.environ.get("LOCATION_SEARCH_MIN_RESULTS", "5"))
+LOCATION_SEARCH_MAX_RESULTS = int(os.environ.get("LOCATION_SEARCH_MAX_RESULTS", "20"))
+LOCATION_SEARCH_CACHE_SIZE = int(os.environ.get("LOCATION_SEARCH_CACHE_SIZE", "10000"))
+# GTFS stops.txt to preload the index with, defaults to the one of the
+# origin snapping.
+LOCATION_STOPS_TXT = os.environ.get("LOCATION_STOPS_TXT", os.environ.get("STOPS_TXT"))
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.casefold().replace(",", " ").split())
+
+
+class LocationIndex:
+    # An in-memory prefix index over the locations upstream returned before
+    # (and optionally all stops of a GTFS feed). Every word of a location name
+    # is kept in a sorted array, so all words starting with a query word are
+    # one bisect away. A location matches if every query word is the prefix
+    # of one of its words.
+
+    def __init__(self):
+        self.locations: dict[str, dict] = {}
+        self.words: list[tuple[str, str]] = []
+        self.queries = LRUCache(max_size=LOCATION_SEARCH_CACHE_SIZE)
+        self.lock = threading.Lock()
+
+        self.local_hits = 0
+        self.upstream_queries = 0
+
+    def location_key(self, location: dict) -> str:
+        return location.get("id") or location.get("name", "")
+
+    def add_locations(self, locations: Iterable[dict]):
+        with self.lock:
+            for location in locations:
+                key = self.location_key(location)
+                if not key or key in self.locations:
+                    continue
+
+                self.locations[key] = location
+                for word in set(normalize(location.get("name", "")).split()):
+                    bisect.insort(self.words, (word, key))
+
+    def load_stops_txt(self, path: str):
+        # Stations and stops in the shape of the VRR rapidJSON locations, one
+        # per name, so the platforms of a station are not listed separately.
+        stops_by_name = {}
+        for stop in load_stops_txt(path, location_types=("0", "1")):
+            stops_by_name.setdefault(normalize(stop.name), stop)
+
+        with self.lock:
+            for stop in stops_by_name.values():
+                self.locations.setdefault(
+                    stop.stop_id,
+                    {
+                        "id": stop.stop_id,
+                        "name": stop.name,
+                        "type": "stop",
+                        "coord": [stop.lat, stop.lng],
+                    },
+                )
+
+            self.words = sorted(
+                (word, key)
+                for key, location in self.locations.items()
+                for word in set(normalize(location.get("name", "")).split())
+            )
+
+    def words_with_prefix(self, prefix: str) -> set[str]:
+        keys = set()
+        i = bisect.bisect_left(self.words, (prefix, ""))
+        while i < len(self.words) and self.words[i][0].startswith(prefix):
+            keys.add(self.words[i][1])
+            i += 1
+        return keys
+
+    def match(self, q: str) -> List[dict]:
+        query = normalize(q)
+        words = query.split()
+        if not words:
+            return []
+
+        with self.lock:
+            keys = self.words_with_prefix(words[0])
+            for word in words[1:]:
+                if not keys:
+                    break
+                keys &= self.words_with_prefix(word)
+
+            locations = [self.locations[key] for key in keys]
+
+        # Names starting with the query first, then the shortest names.
+        return sorted(
+            locations,
+            key=lambda location: (
+                not normalize(location.get("name", "")).startswith(query),
+                len(location.get("name", "")),
+                location.get("name", ""),
+            ),
+        )[:LOCATION_SEARCH_MAX_RESULTS]
+
+    def wrap_location_search(
+        self, func: Callable[[str], dict]
+    ) -> Callable[[str], dict]:
+        @functools.wraps(func)
+        def wrapper(q: str) -> dict:
+            query = normalize(q)
+
+            # The LRU cache is not thread-safe, and sync endpoints run in a
+            # threadpool.
+            with self.lock:
+                result = self.queries.get(query)
+            if result is not None:
+                return result
+
+            locations = self.match(query)
+            if len(locations) >= LOCATION_SEARCH_MIN_RESULTS:
+                with self.lock:
+                    self.local_hits += 1
+                return {"locations": locations}
+
+            with self.lock:
+                self.upstream_queries += 1
+            result = func(q)
+            self.add_locations(result.get("locations") or [])
+            with self.lock:
+                self.queries.set(query, result)
+
+            return result
+
+        return wrapper
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "locations": len(self.locations),
+                "local_hits": self.local_hits,
+                "upstream_queries": self.upstream_queries,
+                "queries": self.queries.stats(),
+            }
+
+
+def create_location_index() -> LocationIndex:
+    location_index = LocationIndex()
+    if LOCATION_STOPS_TXT:
+        location_index.load_stops_txt(LOCATION_STOPS_TXT)
+
+    return location_index
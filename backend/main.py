@@ -1,85 +1,620 @@
+import asyncio
+import math
 import os
-from typing import Annotated
+from typing import Annotated, Optional
 
-from fastapi import FastAPI, Response, Path, Query
+import numpy as np
+from fastapi import FastAPI, Header, HTTPException, Request, Response, Path, Query
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.routing import Match
 
 import tilenames2
-import route_durations.opentripplanner
-import route_durations.vrr
-import route_durations.hafas
-from route_durations.route_duration_provider import RouteDurationProvider
-from tile_renderer import render_tile
+from route_durations.route_duration_provider import (
+    AsyncRouteDurationProvider,
+    RouteDurationResult,
+)
+from tile_renderer import (
+    render_tile,
+    render_heatmap_tile,
+    prerender_tiles,
+    tile_cache_info,
+    tile_etag,
+    heatmap_tile_etag,
+)
 
 import clients.vrr_api as vrr_api
+from clients.http import close_clients, http_stats
+from location_index import create_location_index
+from metrics import (
+    instrument_provider,
+    render_metrics,
+    tile_request_seconds,
+    tile_requests_in_flight,
+)
+from duration_grid import (
+    MAX_LATITUDE,
+    durations_to_minutes,
+    encode_minutes_uint16,
+    tile_range,
+)
+from cache_policy import is_stale
+from origin_snapping import snap_origin, snapped_origin_headers
+from prewarm import PREWARM_CONCURRENCY, PREWARM_RATE_PER_SECOND, PrewarmJob
+from provider_registry import (
+    ENABLED_PROVIDERS,
+    ProviderRegistry,
+    parse_enabled_providers,
+)
+from tile_quadtree import TileDurationStore
+from upstream_limiter import UpstreamOverloaded, upstream_limiters
 from wrap_as_memcached import get_memcached_wrapper
 
 
 memcache_wrapper = get_memcached_wrapper(os.environ.get("MEMCACHED_URL"))
 
-route_duration_providers: dict[str, RouteDurationProvider] = {
-    "vrr": memcache_wrapper.wrap_duration_provider(
-        "vrr", route_durations.vrr.query_best_route_duration
-    ),
-    "otp": memcache_wrapper.wrap_duration_provider(
-        "otp", route_durations.opentripplanner.query_best_route_duration
-    ),
-    "hafas": memcache_wrapper.wrap_duration_provider(
-        "hafas", route_durations.hafas.query_best_route_duration
-    ),
-}
 
-search_locations_fn = memcache_wrapper.wrap_location_search(vrr_api.search_locations)
+def wrap_provider(
+    name: str, func: AsyncRouteDurationProvider
+) -> AsyncRouteDurationProvider:
+    # Cache, then the upstream limiter, then the upstream metrics.
+    func = instrument_provider(name, func)
+    if name in upstream_limiters:
+        func = upstream_limiters[name].wrap(func)
+
+    return memcache_wrapper.wrap_duration_provider(name, func)
+
+
+# otp-iso is not limited per tile, OTP is only queried once per origin for the
+# surface. raptor is routed in-process on a local GTFS feed.
+route_duration_providers = ProviderRegistry(
+    parse_enabled_providers(ENABLED_PROVIDERS), wrap_provider
+)
+
+# Serve tiles of a new zoom level from the tiles of the neighbouring levels
+# while their own durations are not cached yet.
+TILE_QUADTREE = os.environ.get("TILE_QUADTREE", "1") == "1"
+# Tiles sample N x N destinations and render them as a heatmap for N > 1.
+TILE_SAMPLES = int(os.environ.get("TILE_SAMPLES", "1"))
+tile_store = TileDurationStore()
+background_tasks = set()
+
+GRID_MAX_TILES = int(os.environ.get("GRID_MAX_TILES", "4096"))
+PREWARM_MAX_TILES = int(os.environ.get("PREWARM_MAX_TILES", "100000"))
+prewarm_jobs: dict[str, PrewarmJob] = {}
+
+# Deeper zoom levels have more tiles than memcached could hold anyway.
+MAX_ZOOM = 20
+Latitude = Annotated[float, Query(ge=-MAX_LATITUDE, le=MAX_LATITUDE)]
+Longitude = Annotated[float, Query(ge=-180, le=180)]
+
+location_index = create_location_index()
+search_locations_fn = location_index.wrap_location_search(
+    memcache_wrapper.wrap_location_search(vrr_api.search_locations)
+)
+
+prerender_tile_sizes = os.environ.get("PRERENDER_TILE_SIZES", "64")
 
 
 app = FastAPI()
 
 
+@app.on_event("startup")
+async def startup():
+    # Rendered in the background, so the worker serves right away. Tiles not
+    # rendered yet are rendered on demand.
+    if prerender_tile_sizes:
+        asyncio.get_running_loop().run_in_executor(
+            None,
+            prerender_tiles,
+            [int(size) for size in prerender_tile_sizes.split(",")],
+        )
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_clients()
+
+
+TILE_PATH = "/api/{src}/{origin_lat},{origin_lng}/{tile_size}/{z}/{x}/{y}.png"
+GRID_PATH = "/api/{src}/{origin_lat},{origin_lng}/{tile_size}/{z}/grid"
+TRACKED_ENDPOINTS = {TILE_PATH: "tile", GRID_PATH: "grid"}
+
+
+def matched_route_path(request: Request) -> Optional[str]:
+    # The router only sets scope["route"] after the middleware, so match the
+    # routes in the same order it does.
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", None)
+
+    return None
+
+
+@app.middleware("http")
+async def track_tile_requests(request: Request, call_next):
+    # By route, static files like /marker-icon.png are not tiles.
+    endpoint = TRACKED_ENDPOINTS.get(matched_route_path(request))
+    if endpoint is None:
+        return await call_next(request)
+
+    with tile_requests_in_flight.track_inprogress():
+        with tile_request_seconds.labels(endpoint).time():
+            return await call_next(request)
+
+
+@app.get("/metrics")
+def get_metrics():
+    content, media_type = render_metrics()
+    return Response(content=content, media_type=media_type)
+
+
 @app.get("/api/locations/search/")
 def search_locations(q: str = Annotated[str, Query(min_length=2)]):
     return search_locations_fn(q)
 
 
+@app.get("/api/stats")
+def get_stats():
+    return {
+        "tile_cache": tile_cache_info(),
+        "cache": memcache_wrapper.stats(),
+        "otp_batches": loaded_provider_stats("otp", "plan_batcher"),
+        "http": http_stats.stats(),
+        "locations": location_index.stats(),
+        "raptor": loaded_provider_stats("raptor"),
+        "providers": {
+            "enabled": route_duration_providers.enabled,
+            "loaded": sorted(route_duration_providers.modules),
+        },
+    }
+
+
+def loaded_provider_stats(src: str, attribute: Optional[str] = None):
+    # Stats of providers that were not used yet are not worth loading them.
+    module = route_duration_providers.loaded_module(src)
+    if module is None:
+        return None
+
+    if attribute is not None:
+        return getattr(module, attribute).stats()
+
+    return module.stats()
+
+
+@app.get("/api/providers")
+def get_providers():
+    # The src the frontend may offer, in the order of ENABLED_PROVIDERS.
+    return route_duration_providers.enabled
+
+
+@app.get("/api/limits")
+def get_limits():
+    return {name: limiter.stats() for name, limiter in upstream_limiters.items()}
+
+
+@app.post("/api/prewarm/{src}/{origin_lat},{origin_lng}")
+async def start_prewarm(
+    src: Annotated[str, Path(regex="^(vrr|otp|hafas|otp-iso|raptor)$")],
+    origin_lat: float,
+    origin_lng: float,
+    south: Latitude,
+    west: Longitude,
+    north: Latitude,
+    east: Longitude,
+    min_zoom: Annotated[int, Query(ge=0, le=MAX_ZOOM)],
+    max_zoom: Annotated[int, Query(ge=0, le=MAX_ZOOM)],
+    tile_size: Annotated[int, Query(le=256, ge=64)] = 64,
+    concurrency: Annotated[int, Query(ge=1, le=64)] = PREWARM_CONCURRENCY,
+    rate_per_second: Annotated[float, Query(gt=0)] = PREWARM_RATE_PER_SECOND,
+):
+    if src not in route_duration_providers:
+        raise HTTPException(status_code=404, detail=f"{src} is not enabled")
+    check_bbox(south, west, north, east)
+
+    try:
+        job = PrewarmJob(
+            src,
+            (origin_lat, origin_lng),
+            (south, west, north, east),
+            min_zoom,
+            max_zoom,
+            tile_size,
+            max_tiles=PREWARM_MAX_TILES,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    task = asyncio.create_task(
+        job.run(route_duration_providers[src], concurrency, rate_per_second)
+    )
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+    prewarm_jobs[job.id] = job
+    return job.progress()
+
+
+def check_bbox(south: float, west: float, north: float, east: float):
+    if south >= north:
+        raise HTTPException(
+            status_code=400, detail=f"south {south} must be less than north {north}"
+        )
+    if west >= east:
+        raise HTTPException(
+            status_code=400, detail=f"west {west} must be less than east {east}"
+        )
+
+
+@app.get("/api/prewarm")
+def list_prewarm_jobs():
+    return [job.progress() for job in prewarm_jobs.values()]
+
+
+@app.get("/api/prewarm/{job_id}")
+def get_prewarm_job(job_id: str):
+    if job_id not in prewarm_jobs:
+        raise HTTPException(status_code=404, detail="Unknown prewarm job")
+
+    return prewarm_jobs[job_id].progress()
+
+
 @app.get(
-    "/api/{src}/{origin_lat},{origin_lng}/{tile_size}/{z}/{x}/{y}.png",
+    TILE_PATH,
     responses={200: {"content": {"image/png": {}}}},
     response_class=Response,
 )
-def generate_random_noice_tile_image(
-    src: Annotated[str, Path(regex="^(vrr|otp|hafas)$")],
+async def generate_random_noice_tile_image(
+    src: Annotated[str, Path(regex="^(vrr|otp|hafas|otp-iso|raptor)$")],
     origin_lat: float,
     origin_lng: float,
     tile_size: Annotated[int, Path(le=256, ge=64)],
-    z: int,
+    z: Annotated[int, Path(ge=0, le=MAX_ZOOM)],
     x: int,
     y: int,
+    samples: Annotated[int, Query(ge=1, le=16)] = TILE_SAMPLES,
+    if_none_match: Annotated[Optional[str], Header()] = None,
 ):
-    origin_latlng = (origin_lat, origin_lng)
+    origin_latlng, snapped_to = snap_origin((origin_lat, origin_lng))
 
     center_latlng = tilenames2.xy_to_latlon(x, y, z, tile_size_pixels=tile_size)
 
     if src not in route_duration_providers:
-        raise Exception("Unknown src")
+        raise HTTPException(status_code=404, detail=f"{src} is not enabled")
+
+    if samples > 1:
+        return await render_sampled_tile(
+            src, origin_latlng, snapped_to, tile_size, z, x, y, samples, if_none_match
+        )
+
+    if if_none_match is not None:
+        # Revalidation of a tile the browser already has, answered from the
+        # cache without calling the provider while the entry is fresh.
+        cache_entry = await memcache_wrapper.lookup(src, origin_latlng, center_latlng)
+        if (
+            cache_entry is not None
+            and cache_entry.is_present
+            and not is_stale(cache_entry)
+        ):
+            etag = tile_etag(src, tile_size, cache_entry.duration)
+            if etag_matches(if_none_match, etag):
+                return not_modified_response(etag, origin_latlng, snapped_to)
+
+    await memcache_wrapper.prefetch_tile_block(src, origin_latlng, tile_size, z, x, y)
 
     provider = route_duration_providers[src]
-    route_duration_result = provider(
-        origin_latlng,
-        center_latlng,
+
+    derived = None
+    if TILE_QUADTREE:
+        derived = tile_store.derive(src, origin_latlng, tile_size, z, x, y)
+        if derived is not None and derived.derived_from == "ancestor":
+            # Prefer the real duration if another worker already cached it.
+            cached = await memcache_wrapper.lookup(src, origin_latlng, center_latlng)
+            if cached is not None:
+                derived = None
+
+    provisional = derived is not None and derived.derived_from == "ancestor"
+    overloaded = False
+    failed = False
+
+    if derived is None:
+        try:
+            route_duration_result = await provider(
+                origin_latlng,
+                center_latlng,
+            )
+        except UpstreamOverloaded:
+            # Answer right away with what we know instead of queueing longer,
+            # the browser asks again since the tile is not cacheable.
+            overloaded = True
+            fallback = tile_store.derive(src, origin_latlng, tile_size, z, x, y)
+            route_duration_result = RouteDurationResult(
+                duration=fallback.duration if fallback is not None else None,
+                x_headers={"x-upstream-overloaded": "true"},
+            )
+        if route_duration_result is None:
+            # The upstream failed. Drawn as N/A, but only until the error TTL
+            # of the cache entry runs out, not for a day.
+            failed = True
+            route_duration_result = RouteDurationResult(duration=None, x_headers={})
+    else:
+        route_duration_result = RouteDurationResult(
+            duration=derived.duration,
+            x_headers={"x-tile-derived-from": derived.derived_from},
+        )
+
+    if provisional:
+        # The real duration is computed in the background, and the browser
+        # must ask again instead of caching the provisional tile.
+        task = asyncio.create_task(
+            compute_tile_in_background(
+                provider, src, origin_latlng, tile_size, z, x, y, center_latlng
+            )
+        )
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    elif TILE_QUADTREE and not overloaded and not failed:
+        tile_store.record(
+            src,
+            origin_latlng,
+            tile_size,
+            z,
+            x,
+            y,
+            route_duration_result.duration,
+            derived_from=derived.derived_from if derived is not None else None,
+        )
+
+    mark_as_new_tile = (
+        "x-cache-computed" in route_duration_result.x_headers
+        or provisional
+        or overloaded
     )
 
-    mark_as_new_tile = "x-cache-computed" in route_duration_result.x_headers
+    # Provisional and failed tiles are not stored by the browser, so have no
+    # ETag.
+    temporary = provisional or overloaded or failed
+    etag = None
+    if not temporary:
+        etag = tile_etag(
+            src, tile_size, route_duration_result.duration, mark_as_new_tile
+        )
+        if if_none_match is not None and etag_matches(if_none_match, etag):
+            return not_modified_response(etag, origin_latlng, snapped_to)
 
     image = render_tile(
         tile_size, route_duration_result.duration, mark_as_new_tile=mark_as_new_tile
     )
 
-    return Response(
-        content=image,
-        media_type="image/png",
-        headers={
-            "Cache-Control": "public, max-age=86400",
-            **route_duration_result.x_headers,
+    headers = {
+        "Cache-Control": "no-store" if temporary else "public, max-age=86400",
+        **route_duration_result.x_headers,
+    }
+    if etag is not None:
+        headers["ETag"] = etag
+    headers.update(snapped_origin_headers(origin_latlng, snapped_to))
+
+    return Response(content=image, media_type="image/png", headers=headers)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison and may list several ETags.
+    if if_none_match.strip() == "*":
+        return True
+
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+
+def not_modified_response(
+    etag: str, origin_latlng: tuple[float, float], snapped_to: Optional[str]
+) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+    headers.update(snapped_origin_headers(origin_latlng, snapped_to))
+
+    return Response(status_code=304, headers=headers)
+
+
+async def compute_tile_in_background(
+    provider: AsyncRouteDurationProvider,
+    src: str,
+    origin_latlng: tuple[float, float],
+    tile_size: int,
+    z: int,
+    x: int,
+    y: int,
+    center_latlng: tuple[float, float],
+):
+    try:
+        route_duration_result = await provider(origin_latlng, center_latlng)
+    except Exception as e:
+        print("Background tile computation failed")
+        print(e)
+        return
+
+    # A failure is not a duration, the next request asks again.
+    if route_duration_result is None:
+        return
+
+    tile_store.record(
+        src, origin_latlng, tile_size, z, x, y, route_duration_result.duration
+    )
+
+
+async def render_sampled_tile(
+    src: str,
+    origin_latlng: tuple[float, float],
+    snapped_to: Optional[str],
+    tile_size: int,
+    z: int,
+    x: int,
+    y: int,
+    samples: int,
+    if_none_match: Optional[str] = None,
+) -> Response:
+    # Every sample point is a destination of its own, cached like a tile
+    # centre, at the centres of a samples x samples grid across the tile.
+    provider = route_duration_providers[src]
+    offsets = (np.arange(samples) + 0.5) / samples
+    dx, dy = np.meshgrid(offsets, offsets)
+    lats, lngs = tilenames2.xy_to_latlon_batch(
+        x + dx.ravel(), y + dy.ravel(), z, tile_size_pixels=tile_size
+    )
+
+    results = await asyncio.gather(
+        *(
+            provider(origin_latlng, sample_latlng)
+            for sample_latlng in zip(lats.tolist(), lngs.tolist())
+        ),
+        return_exceptions=True,
+    )
+
+    complete = True
+    is_new = False
+    minutes = []
+    for result in results:
+        if isinstance(result, BaseException):
+            if not isinstance(result, UpstreamOverloaded):
+                print("Tile sample computation failed")
+                print(result)
+            complete = False
+            minutes.append(math.nan)
+        elif result is None:
+            # Failed upstream, not cacheable like a missing journey.
+            complete = False
+            minutes.append(math.nan)
+        elif result.duration is None:
+            minutes.append(math.nan)
+        else:
+            is_new = is_new or "x-cache-computed" in result.x_headers
+            minutes.append(result.duration.total_seconds() / 60)
+
+    minutes = np.array(minutes).reshape(samples, samples)
+    mark_as_new_tile = is_new or not complete
+
+    etag = None
+    if complete:
+        etag = heatmap_tile_etag(src, tile_size, minutes, mark_as_new_tile)
+        if if_none_match is not None and etag_matches(if_none_match, etag):
+            return not_modified_response(etag, origin_latlng, snapped_to)
+
+    image = render_heatmap_tile(tile_size, minutes, mark_as_new_tile=mark_as_new_tile)
+
+    headers = {
+        "Cache-Control": "public, max-age=86400" if complete else "no-store",
+        "x-tile-samples": str(samples),
+    }
+    if etag is not None:
+        headers["ETag"] = etag
+    headers.update(snapped_origin_headers(origin_latlng, snapped_to))
+
+    return Response(content=image, media_type="image/png", headers=headers)
+
+
+@app.get(GRID_PATH)
+async def get_duration_grid(
+    src: Annotated[str, Path(regex="^(vrr|otp|hafas|otp-iso|raptor)$")],
+    origin_lat: float,
+    origin_lng: float,
+    tile_size: Annotated[int, Path(le=256, ge=64)],
+    z: Annotated[int, Path(ge=0, le=MAX_ZOOM)],
+    south: Latitude,
+    west: Longitude,
+    north: Latitude,
+    east: Longitude,
+    format: Annotated[str, Query(regex="^(json|uint16)$")] = "json",
+):
+    # The durations of all tiles of a viewport in one response, row by row
+    # from the north west tile, in whole minutes.
+    if src not in route_duration_providers:
+        raise HTTPException(status_code=404, detail=f"{src} is not enabled")
+    check_bbox(south, west, north, east)
+
+    origin_latlng, snapped_to = snap_origin((origin_lat, origin_lng))
+    x1, y1, width, height = tile_range((south, west, north, east), z, tile_size)
+
+    if width * height > GRID_MAX_TILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{width * height} tiles exceed the limit of {GRID_MAX_TILES}",
+        )
+
+    provider = route_duration_providers[src]
+    tiles = [(x, y) for y in range(y1, y1 + height) for x in range(x1, x1 + width)]
+
+    for x, y in tiles:
+        await memcache_wrapper.prefetch_tile_block(
+            src, origin_latlng, tile_size, z, x, y
+        )
+
+    results = await asyncio.gather(
+        *(
+            provider(
+                origin_latlng,
+                tilenames2.xy_to_latlon(x, y, z, tile_size_pixels=tile_size),
+            )
+            for x, y in tiles
+        ),
+        return_exceptions=True,
+    )
+
+    # Tiles that failed or were shed by the limiter are missing, and the
+    # client has to ask again.
+    complete = True
+    durations = []
+    for (x, y), result in zip(tiles, results):
+        if isinstance(result, BaseException):
+            if not isinstance(result, UpstreamOverloaded):
+                print("Grid tile computation failed")
+                print(result)
+            complete = False
+            durations.append(None)
+            continue
+
+        if result is None:
+            complete = False
+            durations.append(None)
+            continue
+
+        duration = result.duration
+        durations.append(duration)
+        if TILE_QUADTREE:
+            tile_store.record(src, origin_latlng, tile_size, z, x, y, duration)
+
+    minutes = durations_to_minutes(durations)
+
+    headers = {
+        "Cache-Control": "public, max-age=86400" if complete else "no-store",
+        "x-grid-z": str(z),
+        "x-grid-x": str(x1),
+        "x-grid-y": str(y1),
+        "x-grid-width": str(width),
+        "x-grid-height": str(height),
+        "x-grid-complete": "true" if complete else "false",
+    }
+    headers.update(snapped_origin_headers(origin_latlng, snapped_to))
+
+    if format == "uint16":
+        return Response(
+            content=encode_minutes_uint16(minutes),
+            media_type="application/octet-stream",
+            headers=headers,
+        )
+
+    return JSONResponse(
+        content={
+            "z": z,
+            "x": x1,
+            "y": y1,
+            "width": width,
+            "height": height,
+            "complete": complete,
+            "minutes": minutes,
         },
+        headers=headers,
     )
 
 
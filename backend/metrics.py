@@ -0,0 +1,144 @@
+import os
+import time
+from typing import Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from route_durations.route_duration_provider import (
+    AsyncRouteDurationProvider,
+    RouteDurationResult,
+)
+from tilenames2 import LatLng
+
+# With several uvicorn workers, point PROMETHEUS_MULTIPROC_DIR to an empty
+# directory shared by them (cleared on deploy), so /metrics of any worker
+# reports all of them.
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+UPSTREAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CACHE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.5)
+RENDER_BUCKETS = (0.00001, 0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+PNG_BYTES_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 65536)
+
+upstream_request_seconds = Histogram(
+    "upstream_request_seconds",
+    "Latency of the route duration queries to the upstream APIs",
+    ["provider"],
+    buckets=UPSTREAM_BUCKETS,
+)
+upstream_errors = Counter(
+    "upstream_errors_total",
+    "Failed route duration queries to the upstream APIs",
+    ["provider", "error"],
+)
+
+cache_operation_seconds = Histogram(
+    "cache_operation_seconds",
+    "Latency of the memcached (or SQLite) operations",
+    ["operation"],
+    buckets=CACHE_BUCKETS,
+)
+cache_errors = Counter(
+    "cache_errors_total", "Failed memcached (or SQLite) operations", ["operation"]
+)
+cache_lookups = Counter(
+    "cache_lookups_total",
+    "Route duration lookups by where they were answered from",
+    ["provider", "result"],
+)
+
+tile_render_seconds = Histogram(
+    "tile_render_seconds", "Time to render a tile PNG", ["kind"], buckets=RENDER_BUCKETS
+)
+tile_png_bytes = Histogram(
+    "tile_png_bytes",
+    "Size of the rendered tile PNGs",
+    ["kind"],
+    buckets=PNG_BYTES_BUCKETS,
+)
+tile_request_seconds = Histogram(
+    "tile_request_seconds",
+    "Latency of the tile and grid endpoints",
+    ["endpoint"],
+    buckets=UPSTREAM_BUCKETS,
+)
+tile_requests_in_flight = Gauge(
+    "tile_requests_in_flight",
+    "Tile and grid requests currently being served",
+    multiprocess_mode="livesum",
+)
+
+
+def instrument_provider(
+    name: str, func: AsyncRouteDurationProvider
+) -> AsyncRouteDurationProvider:
+    async def wrapper(
+        origin_latlng: LatLng, destination_latlng: LatLng
+    ) -> Optional[RouteDurationResult]:
+        start = time.perf_counter()
+        try:
+            result = await func(origin_latlng, destination_latlng)
+        except Exception as e:
+            upstream_errors.labels(name, type(e).__name__).inc()
+            raise
+        finally:
+            upstream_request_seconds.labels(name).observe(time.perf_counter() - start)
+
+        if result is None:
+            upstream_errors.labels(name, "no_result").inc()
+
+        return result
+
+    return wrapper
+
+
+class InstrumentedCacheClient:
+    # Times the operations of a memcached (or SQLite) client and counts the
+    # ones that raise.
+
+    def __init__(self, client):
+        self.client = client
+
+    def call(self, operation: str, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return getattr(self.client, operation)(*args, **kwargs)
+        except Exception:
+            cache_errors.labels(operation).inc()
+            raise
+        finally:
+            cache_operation_seconds.labels(operation).observe(
+                time.perf_counter() - start
+            )
+
+    def get(self, *args, **kwargs):
+        return self.call("get", *args, **kwargs)
+
+    def get_many(self, *args, **kwargs):
+        return self.call("get_many", *args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        return self.call("set", *args, **kwargs)
+
+    def add(self, *args, **kwargs):
+        return self.call("add", *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self.call("delete", *args, **kwargs)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,124 @@
+import math
+import os
+from typing import Optional
+
+from stop_index import StopIndex, load_stops_txt
+from tilenames2 import LatLng
+
+# Snapping the origin makes nearby origins share their cache keys. One of
+# "none", "grid", "geohash" or "stop".
+ORIGIN_SNAPPING = os.environ.get("ORIGIN_SNAPPING", "none")
+ORIGIN_SNAP_GRID_METERS = float(os.environ.get("ORIGIN_SNAP_GRID_METERS", "200"))
+ORIGIN_SNAP_GEOHASH_PRECISION = int(
+    os.environ.get("ORIGIN_SNAP_GEOHASH_PRECISION", "7")
+)
+ORIGIN_SNAP_MAX_STOP_METERS = float(
+    os.environ.get("ORIGIN_SNAP_MAX_STOP_METERS", "300")
+)
+STOPS_TXT = os.environ.get("STOPS_TXT")
+
+METERS_PER_DEGREE = 111320
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+_stop_index: Optional[StopIndex] = None
+
+
+def snap_to_grid(latlng: LatLng, cell_meters: float) -> LatLng:
+    lat_step = cell_meters / METERS_PER_DEGREE
+    lat = (math.floor(latlng[0] / lat_step) + 0.5) * lat_step
+
+    lng_step = cell_meters / (METERS_PER_DEGREE * math.cos(math.radians(lat)))
+    lng = (math.floor(latlng[1] / lng_step) + 0.5) * lng_step
+
+    return (round(lat, 6), round(lng, 6))
+
+
+def geohash_encode(latlng: LatLng, precision: int) -> str:
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(geohash) < precision:
+        value, value_range = (latlng[1], lng_range) if even else (latlng[0], lat_range)
+        middle = (value_range[0] + value_range[1]) / 2
+
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            value_range[0] = middle
+        else:
+            value_range[1] = middle
+
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(geohash)
+
+
+def geohash_decode(geohash: str) -> LatLng:
+    # Returns the centre of the geohash cell.
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+
+    for char in geohash:
+        bits = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            value_range = lng_range if even else lat_range
+            middle = (value_range[0] + value_range[1]) / 2
+            if bits >> shift & 1:
+                value_range[0] = middle
+            else:
+                value_range[1] = middle
+            even = not even
+
+    return (
+        round((lat_range[0] + lat_range[1]) / 2, 6),
+        round((lng_range[0] + lng_range[1]) / 2, 6),
+    )
+
+
+def get_stop_index() -> StopIndex:
+    global _stop_index
+
+    if _stop_index is None:
+        if STOPS_TXT is None:
+            raise ValueError("ORIGIN_SNAPPING=stop requires STOPS_TXT")
+        _stop_index = StopIndex(load_stops_txt(STOPS_TXT))
+
+    return _stop_index
+
+
+def snap_origin(latlng: LatLng) -> tuple[LatLng, Optional[str]]:
+    # Returns the snapped origin and a description of what it was snapped to,
+    # None if the origin was left as it is.
+    if ORIGIN_SNAPPING == "grid":
+        return snap_to_grid(latlng, ORIGIN_SNAP_GRID_METERS), "grid"
+
+    if ORIGIN_SNAPPING == "geohash":
+        geohash = geohash_encode(latlng, ORIGIN_SNAP_GEOHASH_PRECISION)
+        return geohash_decode(geohash), f"geohash:{geohash}"
+
+    if ORIGIN_SNAPPING == "stop":
+        stop = get_stop_index().nearest(latlng, ORIGIN_SNAP_MAX_STOP_METERS)
+        if stop is not None:
+            return (stop.lat, stop.lng), f"stop:{stop.stop_id}"
+
+    return latlng, None
+
+
+def snapped_origin_headers(origin_latlng: LatLng, snapped_to: Optional[str]) -> dict:
+    if snapped_to is None:
+        return {}
+
+    return {
+        "x-origin-snapped": f"{origin_latlng[0]},{origin_latlng[1]}",
+        "x-origin-snapped-to": snapped_to,
+    }
@@ -0,0 +1,276 @@
+# Fills the duration cache for an origin and a viewport ahead of time, so the
+# first user of a popular origin does not pay the upstream latency. Tiles are
+# computed through the wrapped route_duration_providers, exactly like the tile
+# endpoint would.
+#
+# Run from the backend directory:
+#   python -m prewarm --src vrr --origin 51.4508,7.0131 \
+#       --bbox 51.35,6.85,51.55,7.20 --zoom 10-14 --progress-file essen.progress
+
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from typing import Iterator, Optional
+
+import numpy as np
+
+import tilenames2
+from duration_grid import tile_range
+from origin_snapping import snap_origin
+from route_durations.route_duration_provider import AsyncRouteDurationProvider
+from tilenames2 import LatLng
+
+PREWARM_CONCURRENCY = int(os.environ.get("PREWARM_CONCURRENCY", "8"))
+PREWARM_RATE_PER_SECOND = float(os.environ.get("PREWARM_RATE_PER_SECOND", "20"))
+
+BoundingBox = tuple[float, float, float, float]  # S,W,N,E
+
+
+def count_tiles(bbox: BoundingBox, min_zoom: int, max_zoom: int, tile_size: int) -> int:
+    # An upper bound of the tiles enumerate_tiles yields, without enumerating
+    # them.
+    count = 0
+    for z in range(min_zoom, max_zoom + 1):
+        _, _, width, height = tile_range(bbox, z, tile_size)
+        count += width * height
+
+    return count
+
+
+def enumerate_tiles(
+    bbox: BoundingBox, min_zoom: int, max_zoom: int, tile_size: int
+) -> Iterator[tuple[int, int, int]]:
+    south, west, north, east = bbox
+
+    for z in range(min_zoom, max_zoom + 1):
+        x1, y1, width, height = tile_range(bbox, z, tile_size)
+
+        xs, ys = np.meshgrid(np.arange(x1, x1 + width), np.arange(y1, y1 + height))
+        xs, ys = xs.T.ravel(), ys.T.ravel()
+
+        # Skip tiles that only touch the bbox with their edge.
+        s, w, n, e = tilenames2.tile_edges_batch(xs, ys, z, tile_size)
+        inside = (s < north) & (n > south) & (w < east) & (e > west)
+
+        for x, y in zip(xs[inside].tolist(), ys[inside].tolist()):
+            yield (z, x, y)
+
+
+class RateLimiter:
+    # Spaces out the starts of the requests evenly, at most rate_per_second.
+
+    def __init__(self, rate_per_second: float):
+        self.interval = 1 / rate_per_second if rate_per_second > 0 else 0
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            if self.next_start > now:
+                await asyncio.sleep(self.next_start - now)
+            self.next_start = max(now, self.next_start) + self.interval
+
+
+class PrewarmJob:
+    def __init__(
+        self,
+        src: str,
+        origin_latlng: LatLng,
+        bbox: BoundingBox,
+        min_zoom: int,
+        max_zoom: int,
+        tile_size: int,
+        progress_path: Optional[str] = None,
+        max_tiles: Optional[int] = None,
+    ):
+        # Checked before enumerating, a large bbox at a high zoom level has
+        # billions of tiles.
+        if max_tiles is not None:
+            tiles = count_tiles(bbox, min_zoom, max_zoom, tile_size)
+            if tiles > max_tiles:
+                raise ValueError(f"{tiles} tiles exceed the limit of {max_tiles}")
+
+        self.id = uuid.uuid4().hex
+        self.src = src
+        # Snapped like in the tile endpoint, so the cache keys match.
+        self.origin_latlng, _ = snap_origin(origin_latlng)
+        self.bbox = bbox
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.tile_size = tile_size
+        self.progress_path = progress_path
+
+        self.tiles = list(enumerate_tiles(bbox, min_zoom, max_zoom, tile_size))
+        self.completed = self.load_progress()
+        self.resumed = len(self.completed)
+        self.failed = 0
+        self.status = "pending"
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def tile_name(self, z: int, x: int, y: int) -> str:
+        return f"{z}/{x}/{y}"
+
+    def load_progress(self) -> set[str]:
+        # The progress file lists one completed tile per line, so an interrupted
+        # job continues where it stopped.
+        if self.progress_path is None or not os.path.exists(self.progress_path):
+            return set()
+
+        with open(self.progress_path) as file:
+            return set(line.strip() for line in file if line.strip())
+
+    def progress(self) -> dict:
+        done = len(self.completed) - self.resumed
+        remaining = len(self.tiles) - len(self.completed)
+
+        elapsed = 0.0
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+
+        tiles_per_second = done / elapsed if elapsed > 0 else 0.0
+        eta_seconds = remaining / tiles_per_second if tiles_per_second > 0 else None
+
+        return {
+            "id": self.id,
+            "src": self.src,
+            "origin": self.origin_latlng,
+            "status": self.status,
+            "tiles": len(self.tiles),
+            "completed": len(self.completed),
+            "resumed": self.resumed,
+            "failed": self.failed,
+            "elapsed_seconds": elapsed,
+            "tiles_per_second": tiles_per_second,
+            "eta_seconds": eta_seconds,
+        }
+
+    async def run(
+        self,
+        provider: AsyncRouteDurationProvider,
+        concurrency: int = PREWARM_CONCURRENCY,
+        rate_per_second: float = PREWARM_RATE_PER_SECOND,
+    ):
+        self.status = "running"
+        self.started_at = time.monotonic()
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for z, x, y in self.tiles:
+            if self.tile_name(z, x, y) not in self.completed:
+                queue.put_nowait((z, x, y))
+
+        rate_limiter = RateLimiter(rate_per_second)
+        progress_file = None
+        if self.progress_path is not None:
+            progress_file = open(self.progress_path, "a")
+
+        async def worker():
+            while True:
+                try:
+                    z, x, y = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+
+                await rate_limiter.wait()
+                center_latlng = tilenames2.xy_to_latlon(
+                    x, y, z, tile_size_pixels=self.tile_size
+                )
+
+                try:
+                    await provider(self.origin_latlng, center_latlng)
+                except Exception as e:
+                    print(f"Prewarming {self.tile_name(z, x, y)} failed: {e!r}")
+                    self.failed += 1
+                    continue
+
+                self.completed.add(self.tile_name(z, x, y))
+                if progress_file is not None:
+                    progress_file.write(self.tile_name(z, x, y) + "\n")
+                    progress_file.flush()
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            self.status = "done"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        finally:
+            self.finished_at = time.monotonic()
+            if progress_file is not None:
+                progress_file.close()
+
+
+def parse_bbox(value: str) -> BoundingBox:
+    south, west, north, east = (float(part) for part in value.split(","))
+    return (south, west, north, east)
+
+
+def parse_zoom_range(value: str) -> tuple[int, int]:
+    min_zoom, _, max_zoom = value.partition("-")
+    return (int(min_zoom), int(max_zoom or min_zoom))
+
+
+async def report_progress(job: PrewarmJob, interval_seconds: float):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        progress = job.progress()
+        eta = progress["eta_seconds"]
+        print(
+            f"{progress['completed']}/{progress['tiles']} tiles,"
+            f" {progress['failed']} failed,"
+            f" {progress['tiles_per_second']:.1f} tiles/s,"
+            f" ETA {'-' if eta is None else f'{eta:.0f}s'}"
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--src", required=True)
+    parser.add_argument("--origin", required=True, help="lat,lng")
+    parser.add_argument("--bbox", required=True, help="south,west,north,east")
+    parser.add_argument("--zoom", required=True, help="min-max, e.g. 10-14")
+    parser.add_argument("--tile-size", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=PREWARM_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=PREWARM_RATE_PER_SECOND)
+    parser.add_argument("--progress-file")
+    parser.add_argument("--report-seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    # The providers are shared with the app, the tile images are not needed.
+    os.environ.setdefault("PRERENDER_TILE_SIZES", "")
+    from main import route_duration_providers
+    from clients.http import close_clients
+
+    lat, lng = (float(part) for part in args.origin.split(","))
+    min_zoom, max_zoom = parse_zoom_range(args.zoom)
+    job = PrewarmJob(
+        args.src,
+        (lat, lng),
+        parse_bbox(args.bbox),
+        min_zoom,
+        max_zoom,
+        args.tile_size,
+        progress_path=args.progress_file,
+    )
+    print(f"{len(job.tiles)} tiles, {job.resumed} already done")
+
+    reporter = asyncio.create_task(report_progress(job, args.report_seconds))
+    try:
+        await job.run(route_duration_providers[args.src], args.concurrency, args.rate)
+    finally:
+        reporter.cancel()
+        await close_clients()
+
+    progress = job.progress()
+    print(
+        f"Done: {progress['completed']}/{progress['tiles']} tiles,"
+        f" {progress['failed']} failed in {progress['elapsed_seconds']:.0f}s"
+        f" ({progress['tiles_per_second']:.1f} tiles/s)"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
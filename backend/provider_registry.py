@@ -0,0 +1,76 @@
+import importlib
+import os
+import threading
+from types import ModuleType
+from typing import Callable, Optional
+
+from route_durations.route_duration_provider import AsyncRouteDurationProvider
+
+# The module of every src, each with a query_best_route_duration_async. They
+# are only imported, and their clients built, when the src is first used.
+PROVIDER_MODULES = {
+    "vrr": "route_durations.vrr",
+    "otp": "route_durations.opentripplanner",
+    "hafas": "route_durations.hafas",
+    "otp-iso": "route_durations.opentripplanner_isochrone",
+    "raptor": "route_durations.gtfs_raptor",
+}
+
+# Comma separated, e.g. "otp,otp-iso" for a deployment that only has OTP.
+# raptor is enabled by default when there is a GTFS feed.
+ENABLED_PROVIDERS = os.environ.get(
+    "ENABLED_PROVIDERS",
+    "vrr,otp,hafas,otp-iso" + (",raptor" if os.environ.get("GTFS_FEED") else ""),
+)
+
+ProviderWrapper = Callable[
+    [str, AsyncRouteDurationProvider], AsyncRouteDurationProvider
+]
+
+
+class ProviderRegistry:
+    # route_duration_providers, as a mapping of the enabled src to their
+    # wrapped providers, created on first access.
+
+    def __init__(self, enabled: list[str], wrap: ProviderWrapper):
+        unknown = [src for src in enabled if src not in PROVIDER_MODULES]
+        if unknown:
+            raise ValueError(f"Unknown providers in ENABLED_PROVIDERS: {unknown}")
+
+        self.enabled = enabled
+        self.wrap = wrap
+        self.providers: dict[str, AsyncRouteDurationProvider] = {}
+        self.modules: dict[str, ModuleType] = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, src: str) -> bool:
+        return src in self.enabled or src in self.providers
+
+    def __getitem__(self, src: str) -> AsyncRouteDurationProvider:
+        provider = self.providers.get(src)
+        if provider is not None:
+            return provider
+
+        if src not in self.enabled:
+            raise KeyError(src)
+
+        with self.lock:
+            if src not in self.providers:
+                module = importlib.import_module(PROVIDER_MODULES[src])
+                self.modules[src] = module
+                self.providers[src] = self.wrap(
+                    src, module.query_best_route_duration_async
+                )
+
+            return self.providers[src]
+
+    def __setitem__(self, src: str, provider: AsyncRouteDurationProvider):
+        self.providers[src] = provider
+
+    def loaded_module(self, src: str) -> Optional[ModuleType]:
+        # The provider module, if the src was used yet.
+        return self.modules.get(src)
+
+
+def parse_enabled_providers(value: str) -> list[str]:
+    return [src.strip() for src in value.split(",") if src.strip()]
@@ -0,0 +1,106 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Optional
+
+from tilenames2 import LatLng
+from gtfs_timetable import GtfsTimetable, StopArrivals
+from lru_cache import LRUCache
+from single_flight import SingleFlight
+from util import get_9am_on_next_monday
+
+from .route_duration_provider import RouteDurationResult
+
+# GTFS directory or zip, e.g. the VRR feed. The provider is only offered when
+# it is set.
+GTFS_FEED = os.environ.get("GTFS_FEED")
+RAPTOR_MAX_WORKERS = int(os.environ.get("RAPTOR_MAX_WORKERS", "2"))
+
+# Loading a feed takes a while and the searches are CPU bound, so both run
+# off the event loop.
+raptor_executor = ThreadPoolExecutor(
+    max_workers=RAPTOR_MAX_WORKERS, thread_name_prefix="raptor"
+)
+
+# One timetable per service day, which only changes once a week.
+timetables = LRUCache(max_size=1)
+timetable_single_flight = SingleFlight()
+
+# The arrivals at all stops are a few dozen KB per origin.
+stop_arrivals = LRUCache(
+    max_size=int(os.environ.get("RAPTOR_ARRIVALS_CACHE_SIZE", "256")),
+    ttl_seconds=24 * 60 * 60,
+)
+stop_arrivals_single_flight = SingleFlight()
+
+
+async def get_timetable(service_date: date) -> GtfsTimetable:
+    timetable = timetables.get(service_date)
+    if timetable is not None:
+        return timetable
+
+    async def load_timetable() -> GtfsTimetable:
+        timetable = await asyncio.get_running_loop().run_in_executor(
+            raptor_executor, GtfsTimetable.from_gtfs, GTFS_FEED, service_date
+        )
+        timetables.set(service_date, timetable)
+        return timetable
+
+    timetable, _ = await timetable_single_flight.do(
+        service_date.isoformat(), load_timetable
+    )
+    return timetable
+
+
+async def get_stop_arrivals(
+    origin_latlng: LatLng, departure_datetime: datetime
+) -> StopArrivals:
+    key = (round(origin_latlng[0], 6), round(origin_latlng[1], 6), departure_datetime)
+
+    arrivals = stop_arrivals.get(key)
+    if arrivals is not None:
+        return arrivals
+
+    async def search() -> StopArrivals:
+        timetable = await get_timetable(departure_datetime.date())
+        departure_seconds = (
+            departure_datetime.hour * 3600
+            + departure_datetime.minute * 60
+            + departure_datetime.second
+        )
+        arrivals = await asyncio.get_running_loop().run_in_executor(
+            raptor_executor,
+            timetable.earliest_arrivals,
+            origin_latlng,
+            departure_seconds,
+        )
+        stop_arrivals.set(key, arrivals)
+        return arrivals
+
+    # All tiles of a new origin arrive at once, one search answers them all.
+    arrivals, _ = await stop_arrivals_single_flight.do(str(key), search)
+    return arrivals
+
+
+async def query_best_route_duration_async(
+    origin_latlng: LatLng, destination_latlng: LatLng
+) -> Optional[RouteDurationResult]:
+    arrivals = await get_stop_arrivals(origin_latlng, get_9am_on_next_monday())
+
+    return RouteDurationResult(
+        duration=arrivals.duration_to(destination_latlng),
+        x_headers={
+            "x-src": "raptor",
+        },
+    )
+
+
+def stats() -> dict:
+    return {
+        "timetables": {
+            service_date.isoformat(): timetable.stats()
+            for service_date, (_, timetable) in timetables.entries.items()
+        },
+        "stop_arrivals": stop_arrivals.stats(),
+    }
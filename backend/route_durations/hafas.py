@@ -1,3 +1,7 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Optional, List, Dict
 
@@ -90,9 +94,36 @@ class DBProfileCoords(DBProfile):
         }
 
 
-profile = DBProfileCoords()
-profile.activate_retry()
-client = HafasClient(profile, debug=True)
+# Points the client to another HAFAS mgate endpoint, e.g. a local stub.
+HAFAS_URL = os.environ.get("HAFAS_URL")
+# Logs every request and response, too slow for serving tiles.
+HAFAS_DEBUG = os.environ.get("HAFAS_DEBUG", "0") == "1"
+
+client: Optional[HafasClient] = None
+client_lock = threading.Lock()
+
+
+def get_client() -> HafasClient:
+    # Built on first use, the queries run on the hafas_executor threads.
+    global client
+
+    with client_lock:
+        if client is None:
+            profile = DBProfileCoords()
+            if HAFAS_URL:
+                profile.baseUrl = HAFAS_URL
+            profile.activate_retry()
+            client = HafasClient(profile, debug=HAFAS_DEBUG)
+
+        return client
+
+
+# pyhafas is blocking, so the async provider runs it on a dedicated, bounded
+# pool instead of the shared default executor.
+HAFAS_MAX_WORKERS = int(os.environ.get("HAFAS_MAX_WORKERS", "8"))
+hafas_executor = ThreadPoolExecutor(
+    max_workers=HAFAS_MAX_WORKERS, thread_name_prefix="hafas"
+)
 
 
 def query_best_route_duration(
@@ -105,7 +136,7 @@ def query_best_route_duration(
         id="", latitude=destination_latlng[0], longitude=destination_latlng[1]
     )
 
-    trip = client.journeys(
+    trip = get_client().journeys(
         origin_station,
         destination_station,
         date=get_9am_on_next_monday(),
@@ -123,6 +154,11 @@ def query_best_route_duration(
         },
     )
 
+    # No journeys usually means HAFAS failed to resolve the coordinates, which
+    # is cached briefly as a failure instead of raising on min([]).
+    if not trip:
+        return None
+
     best_trip_time = min([journey.duration for journey in trip])
 
     return RouteDurationResult(
@@ -131,3 +167,12 @@ def query_best_route_duration(
             "x-src": "hafas",
         },
     )
+
+
+async def query_best_route_duration_async(
+    origin_latlng: LatLng, destination_latlng: LatLng
+) -> Optional[RouteDurationResult]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        hafas_executor, query_best_route_duration, origin_latlng, destination_latlng
+    )
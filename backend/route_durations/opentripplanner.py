@@ -1,16 +1,40 @@
+import os
 from datetime import timedelta, datetime
 from typing import Optional
 
 from tilenames2 import LatLng
 from clients.opentripplanner_api import (
     query_trip_between_latlng_points,
+    query_trip_between_latlng_points_async,
     get_best_journey_time_from_plan,
+    PlanBatcher,
+    get_query_profile,
 )
 from util import get_9am_on_next_monday
 
 from .route_duration_provider import RouteDurationResult
 
 
+# Concurrent tiles of the same origin are sent to OTP as one multi-plan
+# request of up to OTP_BATCH_SIZE plans, 1 disables batching.
+OTP_BATCH_SIZE = int(os.environ.get("OTP_BATCH_SIZE", "16"))
+OTP_BATCH_WINDOW_MS = float(os.environ.get("OTP_BATCH_WINDOW_MS", "5"))
+
+# See clients.opentripplanner_api.QUERY_PROFILES, "fastest" trades the 10
+# itineraries over one hour for 5 over 30 minutes.
+query_profile = get_query_profile(
+    os.environ.get("OTP_QUERY_PROFILE", "full"),
+    num_itineraries=int(os.environ.get("OTP_NUM_ITINERARIES", "0")),
+    search_window_seconds=int(os.environ.get("OTP_SEARCH_WINDOW_SECONDS", "0")),
+)
+
+plan_batcher = PlanBatcher(
+    max_batch_size=OTP_BATCH_SIZE,
+    window_seconds=OTP_BATCH_WINDOW_MS / 1000,
+    profile=query_profile,
+)
+
+
 def query_best_route_duration(
     origin_latlng: LatLng, destination_latlng: LatLng
 ) -> Optional[timedelta]:
@@ -18,8 +42,31 @@ def query_best_route_duration(
         origin_latlng,
         destination_latlng,
         departure_datetime=get_9am_on_next_monday(),
+        profile=query_profile,
     )
 
+    return to_route_duration_result(trip)
+
+
+async def query_best_route_duration_async(
+    origin_latlng: LatLng, destination_latlng: LatLng
+) -> Optional[RouteDurationResult]:
+    if OTP_BATCH_SIZE > 1:
+        trip = await plan_batcher.query_trip(
+            origin_latlng, destination_latlng, get_9am_on_next_monday()
+        )
+    else:
+        trip = await query_trip_between_latlng_points_async(
+            origin_latlng,
+            destination_latlng,
+            departure_datetime=get_9am_on_next_monday(),
+            profile=query_profile,
+        )
+
+    return to_route_duration_result(trip)
+
+
+def to_route_duration_result(trip: any) -> RouteDurationResult:
     best_trip_time = get_best_journey_time_from_plan(trip)
 
     return RouteDurationResult(
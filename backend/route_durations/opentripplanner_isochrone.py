@@ -0,0 +1,69 @@
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from tilenames2 import LatLng
+from clients.opentripplanner_api import query_isochrones_async
+from lru_cache import LRUCache
+from single_flight import SingleFlight
+from travel_time_surface import TravelTimeSurface
+from util import get_9am_on_next_monday
+
+from .route_duration_provider import RouteDurationResult
+
+OTP_TIMEZONE = ZoneInfo(os.environ.get("OTP_TIMEZONE", "Europe/Berlin"))
+ISOCHRONE_MAX_MINUTES = int(os.environ.get("ISOCHRONE_MAX_MINUTES", "60"))
+ISOCHRONE_STEP_MINUTES = int(os.environ.get("ISOCHRONE_STEP_MINUTES", "2"))
+
+# Surfaces are a few hundred KB each, so only the most recent origins are kept.
+surfaces = LRUCache(
+    max_size=int(os.environ.get("ISOCHRONE_SURFACE_CACHE_SIZE", "32")),
+    ttl_seconds=24 * 60 * 60,
+)
+surface_single_flight = SingleFlight()
+
+
+async def get_travel_time_surface(
+    origin_latlng: LatLng, departure_datetime: datetime
+) -> TravelTimeSurface:
+    key = (round(origin_latlng[0], 6), round(origin_latlng[1], 6), departure_datetime)
+
+    surface = surfaces.get(key)
+    if surface is not None:
+        return surface
+
+    async def query_surface() -> TravelTimeSurface:
+        feature_collection = await query_isochrones_async(
+            origin_latlng,
+            departure_datetime.replace(tzinfo=OTP_TIMEZONE),
+            cutoffs=[
+                timedelta(minutes=minutes)
+                for minutes in range(
+                    ISOCHRONE_STEP_MINUTES,
+                    ISOCHRONE_MAX_MINUTES + 1,
+                    ISOCHRONE_STEP_MINUTES,
+                )
+            ],
+        )
+        surface = TravelTimeSurface.from_geojson(feature_collection)
+        surfaces.set(key, surface)
+        return surface
+
+    # All tiles of a new origin arrive at once, but only one of them should
+    # trigger the heavy isochrone query.
+    surface, _ = await surface_single_flight.do(str(key), query_surface)
+    return surface
+
+
+async def query_best_route_duration_async(
+    origin_latlng: LatLng, destination_latlng: LatLng
+) -> Optional[RouteDurationResult]:
+    surface = await get_travel_time_surface(origin_latlng, get_9am_on_next_monday())
+
+    return RouteDurationResult(
+        duration=surface.sample(destination_latlng),
+        x_headers={
+            "x-src": "otp-iso",
+        },
+    )
@@ -1,4 +1,4 @@
-from typing import Callable, Optional
+from typing import Awaitable, Callable, Optional
 from datetime import timedelta
 from dataclasses import dataclass
 from pydantic import BaseModel
@@ -12,3 +12,7 @@ class RouteDurationResult(BaseModel):
 RouteDurationProvider = Callable[
     [tuple[float, float], tuple[float, float]], RouteDurationResult
 ]
+
+AsyncRouteDurationProvider = Callable[
+    [tuple[float, float], tuple[float, float]], Awaitable[RouteDurationResult]
+]
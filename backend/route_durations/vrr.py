@@ -4,6 +4,7 @@ from typing import Optional
 from tilenames2 import LatLng
 from clients.vrr_api import (
     query_trip_between_latlng_points,
+    query_trip_between_latlng_points_async,
     get_best_journey_time_from_trip,
 )
 from util import get_9am_on_next_monday
@@ -19,6 +20,22 @@ def query_best_route_duration(
         departure_datetime=get_9am_on_next_monday(),
     )
 
+    return to_route_duration_result(trip)
+
+
+async def query_best_route_duration_async(
+    origin_latlng: LatLng, destination_latlng: LatLng
+) -> Optional[RouteDurationResult]:
+    trip = await query_trip_between_latlng_points_async(
+        origin_latlng,
+        destination_latlng,
+        departure_datetime=get_9am_on_next_monday(),
+    )
+
+    return to_route_duration_result(trip)
+
+
+def to_route_duration_result(trip: any) -> RouteDurationResult:
     best_trip_time = get_best_journey_time_from_trip(trip)
 
     return RouteDurationResult(
@@ -0,0 +1,27 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+
+class SingleFlight:
+    def __init__(self):
+        self.in_flight: dict[str, asyncio.Future] = {}
+        self.coalesced = 0
+
+    # Runs func once per key, concurrent callers share its result. Returns the
+    # result and whether it was shared with an earlier caller.
+    async def do(
+        self, key: str, func: Callable[[], Awaitable[Any]]
+    ) -> tuple[Any, bool]:
+        task = self.in_flight.get(key)
+        shared = task is not None
+
+        if task is None:
+            # The computation runs as its own task, so it is not cancelled
+            # when the first caller goes away while others still wait on it.
+            task = asyncio.ensure_future(func())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(task), shared
@@ -0,0 +1,216 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, Optional, Union
+
+# Bounds the store, the entries stored first are evicted first.
+SQLITE_CACHE_MAX_ENTRIES = int(os.environ.get("SQLITE_CACHE_MAX_ENTRIES", "2000000"))
+# Expired entries are removed and the file is compacted every N writes, in a
+# background thread and in batches, so the writes in between are not blocked
+# for long.
+SQLITE_CACHE_COMPACT_EVERY = int(os.environ.get("SQLITE_CACHE_COMPACT_EVERY", "10000"))
+SQLITE_CACHE_COMPACT_BATCH = 1000
+
+
+class SqliteCacheClient:
+    # A persistent local alternative to memcached, implementing the subset of
+    # the pymemcache client that the cache wrapper uses. The database runs in
+    # WAL mode, so all workers of a host can share one file.
+
+    def __init__(self, path: str, max_entries: int = SQLITE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.writes = 0
+        self.write_errors = 0
+        self.lock = threading.Lock()
+        self.compaction: Optional[threading.Thread] = None
+
+        # Also used from the threadpool of the sync endpoints.
+        self.connection = sqlite3.connect(
+            path, timeout=1, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " expires_at INTEGER NOT NULL,"
+            " stored_at REAL NOT NULL"
+            ")"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS cache_stored_at ON cache (stored_at)"
+        )
+
+    def expires_at(self, expire: int) -> int:
+        # Like memcached, 0 means the entry never expires.
+        return int(time.time()) + expire if expire else 0
+
+    def get(self, key: str, default=None) -> Optional[bytes]:
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys: Iterable[str]) -> dict[str, bytes]:
+        keys = list(keys)
+        if not keys:
+            return {}
+
+        placeholders = ",".join("?" * len(keys))
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT key, value FROM cache WHERE key IN ({placeholders})"
+                " AND (expires_at = 0 OR expires_at > ?)",
+                [*keys, int(time.time())],
+            ).fetchall()
+
+        return {key: value for key, value in rows}
+
+    def set(
+        self,
+        key: str,
+        value: Union[bytes, str],
+        expire: int = 0,
+        noreply: Optional[bool] = None,
+    ) -> bool:
+        return not self.set_many({key: value}, expire)
+
+    def set_many(
+        self,
+        values: dict[str, Union[bytes, str]],
+        expire: int = 0,
+        noreply: Optional[bool] = None,
+    ) -> list[str]:
+        expires_at = self.expires_at(expire)
+        now = time.time()
+
+        # Like memcached, returns the keys that were not stored. Another
+        # worker may hold the write lock for longer than the timeout.
+        try:
+            with self.lock:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                    [
+                        (key, to_bytes(value), expires_at, now)
+                        for key, value in values.items()
+                    ],
+                )
+        except sqlite3.OperationalError as e:
+            self.count_write_error(e)
+            return list(values)
+
+        self.count_writes(len(values))
+        return []
+
+    def add(
+        self,
+        key: str,
+        value: Union[bytes, str],
+        expire: int = 0,
+        noreply: Optional[bool] = None,
+    ) -> bool:
+        # Only succeeds if the key is missing or expired. Errors are raised,
+        # the caller cannot tell a failed add from a taken key otherwise.
+        now = time.time()
+
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT INTO cache VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE"
+                " SET value = excluded.value, expires_at = excluded.expires_at,"
+                " stored_at = excluded.stored_at"
+                " WHERE cache.expires_at != 0 AND cache.expires_at <= ?",
+                (key, to_bytes(value), self.expires_at(expire), now, int(now)),
+            )
+
+        self.count_writes(1)
+        return cursor.rowcount == 1
+
+    def delete(self, key: str, noreply: Optional[bool] = None) -> bool:
+        try:
+            with self.lock:
+                cursor = self.connection.execute(
+                    "DELETE FROM cache WHERE key = ?", (key,)
+                )
+        except sqlite3.OperationalError as e:
+            self.count_write_error(e)
+            return False
+
+        return cursor.rowcount == 1
+
+    def count_write_error(self, e: sqlite3.OperationalError):
+        self.write_errors += 1
+        print("SQLite cache write failed (exception)")
+        print(e)
+
+    def count_writes(self, writes: int):
+        self.writes += writes
+        if self.writes < SQLITE_CACHE_COMPACT_EVERY:
+            return
+
+        with self.lock:
+            if self.compaction is not None and self.compaction.is_alive():
+                return
+
+            self.writes = 0
+            self.compaction = threading.Thread(
+                target=self.compact, name="sqlite-cache-compact", daemon=True
+            )
+            self.compaction.start()
+
+    def compact(self):
+        # On its own connection, the other workers' connections and this
+        # one's reads carry on between the batches.
+        connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        try:
+            delete_expired(connection)
+
+            (entries,) = connection.execute("SELECT COUNT(*) FROM cache").fetchone()
+            excess = entries - self.max_entries
+            while excess > 0:
+                batch = min(excess, SQLITE_CACHE_COMPACT_BATCH)
+                connection.execute(
+                    "DELETE FROM cache WHERE key IN"
+                    " (SELECT key FROM cache ORDER BY stored_at LIMIT ?)",
+                    (batch,),
+                )
+                excess -= batch
+
+            connection.execute("PRAGMA incremental_vacuum")
+            connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.OperationalError as e:
+            print("SQLite cache compaction failed (exception)")
+            print(e)
+        finally:
+            connection.close()
+
+    def close(self):
+        if self.compaction is not None:
+            self.compaction.join()
+        self.connection.close()
+
+
+def delete_expired(connection: sqlite3.Connection):
+    # Walks the table in rowid order, one short write per batch.
+    now = int(time.time())
+    last_rowid = 0
+    while True:
+        rows = connection.execute(
+            "SELECT rowid, expires_at FROM cache WHERE rowid > ?"
+            " ORDER BY rowid LIMIT ?",
+            (last_rowid, SQLITE_CACHE_COMPACT_BATCH),
+        ).fetchall()
+        if not rows:
+            return
+
+        last_rowid = rows[-1][0]
+        expired = [rowid for rowid, expires_at in rows if 0 < expires_at <= now]
+        if expired:
+            placeholders = ",".join("?" * len(expired))
+            connection.execute(
+                f"DELETE FROM cache WHERE rowid IN ({placeholders})", expired
+            )
+
+
+def to_bytes(value: Union[bytes, str]) -> bytes:
+    return value.encode("utf-8") if isinstance(value, str) else value
@@ -0,0 +1,101 @@
+import csv
+import math
+from typing import NamedTuple, Optional, TextIO
+
+from tilenames2 import LatLng
+
+EARTH_RADIUS_METERS = 6371000
+
+
+class Stop(NamedTuple):
+    stop_id: str
+    name: str
+    lat: float
+    lng: float
+
+
+def distance_meters(a: LatLng, b: LatLng) -> float:
+    lat1, lng1 = math.radians(a[0]), math.radians(a[1])
+    lat2, lng2 = math.radians(b[0]), math.radians(b[1])
+
+    h = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(h))
+
+
+def load_stops_txt(path: str, location_types: tuple = ("0",)) -> list[Stop]:
+    with open(path, encoding="utf-8-sig", newline="") as file:
+        return read_stops(file, location_types)
+
+
+def read_stops(file: TextIO, location_types: tuple = ("0",)) -> list[Stop]:
+    # Reads the stops of a GTFS feed. By default stations and entrances
+    # (location_type != 0) are skipped, since trips only call at the stops.
+    stops = []
+
+    for row in csv.DictReader(file):
+        if (row.get("location_type") or "0") not in location_types:
+            continue
+
+        stops.append(
+            Stop(
+                stop_id=row["stop_id"],
+                name=row.get("stop_name", ""),
+                lat=float(row["stop_lat"]),
+                lng=float(row["stop_lon"]),
+            )
+        )
+
+    return stops
+
+
+class StopIndex:
+    # Buckets stops into a grid of cell_degrees, so radius queries only look at
+    # the cells around the query point.
+
+    def __init__(self, stops: list[Stop], cell_degrees: float = 0.01):
+        self.stops = stops
+        self.cell_degrees = cell_degrees
+        self.cells: dict[tuple[int, int], list[int]] = {}
+
+        for i, stop in enumerate(stops):
+            self.cells.setdefault(self.cell(stop.lat, stop.lng), []).append(i)
+
+    def cell(self, lat: float, lng: float) -> tuple[int, int]:
+        return (int(lat // self.cell_degrees), int(lng // self.cell_degrees))
+
+    def within(self, latlng: LatLng, radius_meters: float) -> list[tuple[int, float]]:
+        # Returns (stop index, distance) of all stops within the radius.
+        lat_cells = math.ceil(radius_meters / 111320 / self.cell_degrees)
+        lng_cells = math.ceil(
+            radius_meters
+            / (111320 * max(math.cos(math.radians(latlng[0])), 0.01))
+            / self.cell_degrees
+        )
+
+        center_lat_cell, center_lng_cell = self.cell(latlng[0], latlng[1])
+        result = []
+
+        for lat_cell in range(
+            center_lat_cell - lat_cells, center_lat_cell + lat_cells + 1
+        ):
+            for lng_cell in range(
+                center_lng_cell - lng_cells, center_lng_cell + lng_cells + 1
+            ):
+                for i in self.cells.get((lat_cell, lng_cell), []):
+                    stop = self.stops[i]
+                    distance = distance_meters(latlng, (stop.lat, stop.lng))
+                    if distance <= radius_meters:
+                        result.append((i, distance))
+
+        return result
+
+    def nearest(self, latlng: LatLng, max_meters: float) -> Optional[Stop]:
+        candidates = self.within(latlng, max_meters)
+        if not candidates:
+            return None
+
+        i, _ = min(candidates, key=lambda candidate: candidate[1])
+        return self.stops[i]
@@ -0,0 +1,174 @@
+# RAPTOR on a small hand-made feed, whose earliest arrivals are known:
+#
+#   A --line 1--> B --> C ~280 m walk D --line 2--> E --line 3--> F
+#
+# Line 1 has an express that overtakes the first trip, so it is a pattern of
+# its own. Line 2 leaves D once before the walk from C plus the change time
+# is over, and once after. Line 4 waits at B long enough for a passenger who
+# arrived there with line 1 to board it, and must not take them back to B
+# before they arrived.
+#
+# Run from the backend directory:
+#   python -m pytest tests
+
+import csv
+from datetime import date, timedelta
+
+import pytest
+
+import gtfs_timetable
+from gtfs_timetable import UNREACHED, GtfsTimetable, walk_seconds
+from stop_index import distance_meters
+
+SERVICE_DATE = date(2024, 1, 1)  # a Monday
+DEPARTURE = 9 * 3600
+
+STOPS = {
+    "A": (51.0, 7.0),
+    "B": (51.0, 7.1),
+    "C": (51.0, 7.2),
+    "D": (51.0, 7.204),
+    "E": (51.0, 7.3),
+    "F": (51.0, 7.4),
+    "G": (51.1, 7.15),
+    "H": (51.1, 7.05),
+}
+
+TRIPS = {
+    # trip_id: (service_id, [(stop_id, time or (arrival, departure)), ...])
+    "line1-early": (
+        "daily",
+        [("A", "09:05:00"), ("B", "09:15:00"), ("C", "09:25:00")],
+    ),
+    "line1-late": (
+        "daily",
+        [("A", "09:35:00"), ("B", "09:45:00"), ("C", "09:55:00")],
+    ),
+    "line1-express": (
+        "daily",
+        [("A", "09:10:00"), ("B", "09:14:00"), ("C", "09:20:00")],
+    ),
+    "line1-sunday": (
+        "sunday",
+        [("A", "09:01:00"), ("B", "09:02:00"), ("C", "09:03:00")],
+    ),
+    "line2-early": ("daily", [("D", "09:25:00"), ("E", "09:35:00")]),
+    "line2-late": ("daily", [("D", "09:28:00"), ("E", "09:38:00")]),
+    "line3": ("daily", [("E", "09:45:00"), ("F", "09:55:00")]),
+    "line4": (
+        "daily",
+        [("H", "09:00:00"), ("B", ("09:10:00", "09:30:00")), ("G", "09:40:00")],
+    ),
+}
+
+
+def seconds(value: str) -> int:
+    hours, minutes, secs = value.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(secs)
+
+
+def write(path, name: str, header: list[str], rows):
+    with open(path / name, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def stop_time_columns(time) -> tuple[str, str]:
+    return time if isinstance(time, tuple) else (time, time)
+
+
+@pytest.fixture
+def timetable(tmp_path) -> GtfsTimetable:
+    write(
+        tmp_path,
+        "stops.txt",
+        ["stop_id", "stop_name", "stop_lat", "stop_lon"],
+        [(stop_id, stop_id, lat, lng) for stop_id, (lat, lng) in STOPS.items()],
+    )
+    write(
+        tmp_path,
+        "calendar.txt",
+        ["service_id", *gtfs_timetable.WEEKDAYS, "start_date", "end_date"],
+        [
+            ["daily", 1, 1, 1, 1, 1, 1, 1, "20240101", "20241231"],
+            ["sunday", 0, 0, 0, 0, 0, 0, 1, "20240101", "20241231"],
+        ],
+    )
+    write(
+        tmp_path,
+        "trips.txt",
+        ["route_id", "service_id", "trip_id"],
+        [(trip_id, service_id, trip_id) for trip_id, (service_id, _) in TRIPS.items()],
+    )
+    write(
+        tmp_path,
+        "stop_times.txt",
+        ["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence"],
+        [
+            (trip_id, *stop_time_columns(time), stop_id, sequence)
+            for trip_id, (_, stop_times) in TRIPS.items()
+            for sequence, (stop_id, time) in enumerate(stop_times)
+        ],
+    )
+
+    return GtfsTimetable.from_gtfs(str(tmp_path), SERVICE_DATE)
+
+
+def arrival_at(arrivals, stop_id: str) -> int:
+    return int(arrivals.arrivals[list(STOPS).index(stop_id)])
+
+
+def walk_between(a: str, b: str) -> int:
+    return walk_seconds(distance_meters(STOPS[a], STOPS[b]))
+
+
+def test_from_gtfs(timetable):
+    # The overtaking express is split from line 1, the Sunday trip left out.
+    assert timetable.stats()["patterns"] == 5
+    assert timetable.stats()["trips"] == 7
+    # Only C and D are within walking distance of each other.
+    assert sorted(zip(timetable.transfer_from, timetable.transfer_to)) == [
+        (2, 3),
+        (3, 2),
+    ]
+
+
+def test_earliest_arrivals(timetable):
+    arrivals = timetable.earliest_arrivals(STOPS["A"], DEPARTURE)
+
+    assert arrival_at(arrivals, "A") == DEPARTURE
+    # Not 09:10, line 4 is only boarded at 09:30.
+    assert arrival_at(arrivals, "B") == seconds("09:14:00")
+    assert arrival_at(arrivals, "G") == seconds("09:40:00")
+    assert arrival_at(arrivals, "C") == seconds("09:20:00")
+    # A trip followed by a walk.
+    assert arrival_at(arrivals, "D") == seconds("09:20:00") + walk_between("C", "D")
+    # The 09:25 from D leaves before the walk plus the change time are over.
+    assert walk_between("C", "D") <= 5 * 60 < walk_between("C", "D") + 120
+    assert arrival_at(arrivals, "E") == seconds("09:38:00")
+    assert arrival_at(arrivals, "F") == seconds("09:55:00")
+
+
+def test_round_limit(timetable, monkeypatch):
+    # F takes three trips.
+    monkeypatch.setattr(gtfs_timetable, "RAPTOR_MAX_ROUNDS", 2)
+    arrivals = timetable.earliest_arrivals(STOPS["A"], DEPARTURE)
+
+    assert arrival_at(arrivals, "E") == seconds("09:38:00")
+    assert arrival_at(arrivals, "F") == UNREACHED
+
+
+def test_duration_to(timetable):
+    arrivals = timetable.earliest_arrivals(STOPS["A"], DEPARTURE)
+
+    # 500 m north of C, closer to C than to D.
+    destination = (STOPS["C"][0] + 0.0045, STOPS["C"][1])
+    expected = (
+        seconds("09:20:00")
+        + walk_seconds(distance_meters(STOPS["C"], destination))
+        - DEPARTURE
+    )
+    assert arrivals.duration_to(destination) == timedelta(seconds=expected)
+
+    assert arrivals.duration_to((52.0, 7.0)) is None
@@ -0,0 +1,78 @@
+# The numpy batch conversions must agree with the scalar ones.
+#
+# Run from the backend directory:
+#   python -m pytest tests
+
+import numpy as np
+import pytest
+
+import tilenames2
+
+Z = 14
+TILE_SIZE = 64
+POINTS = 1000
+TOLERANCE_DEGREES = 1e-9
+TOLERANCE_TILES = 1e-6
+
+
+@pytest.fixture
+def points() -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(42)
+    return rng.uniform(-85, 85, POINTS), rng.uniform(-180, 180, POINTS)
+
+
+def scalar_results(func, a: np.ndarray, b: np.ndarray) -> tuple[np.ndarray, ...]:
+    # One array per element of the tuples the scalar function returns.
+    return tuple(
+        np.array(values)
+        for values in zip(
+            *(func(x, y, Z, TILE_SIZE) for x, y in zip(a.tolist(), b.tolist()))
+        )
+    )
+
+
+def test_num_tiles():
+    assert tilenames2.num_tiles(0, 256) == 1
+    assert tilenames2.num_tiles(14, 64) == 4 * 2**14
+
+
+def test_latlon_to_xy_batch(points):
+    lat, lon = points
+    expected = scalar_results(tilenames2.latlon_to_xy, lat, lon)
+    actual = tilenames2.latlon_to_xy_batch(lat, lon, Z, TILE_SIZE)
+
+    for expected_values, values in zip(expected, actual):
+        np.testing.assert_allclose(
+            values, expected_values, rtol=0, atol=TOLERANCE_TILES
+        )
+
+
+def test_tile_xy_batch(points):
+    lat, lon = points
+    expected = scalar_results(tilenames2.tile_xy, lat, lon)
+    actual = tilenames2.tile_xy_batch(lat, lon, Z, TILE_SIZE)
+
+    for expected_values, values in zip(expected, actual):
+        np.testing.assert_array_equal(values, expected_values)
+
+
+def test_xy_to_latlon_batch(points):
+    x, y = tilenames2.latlon_to_xy_batch(*points, Z, TILE_SIZE)
+    expected = scalar_results(tilenames2.xy_to_latlon, x, y)
+    actual = tilenames2.xy_to_latlon_batch(x, y, Z, TILE_SIZE)
+
+    for expected_values, values in zip(expected, actual):
+        np.testing.assert_allclose(
+            values, expected_values, rtol=0, atol=TOLERANCE_DEGREES
+        )
+
+
+def test_tile_edges_batch(points):
+    x, y = tilenames2.tile_xy_batch(*points, Z, TILE_SIZE)
+    expected = scalar_results(tilenames2.tile_edges, x, y)
+    actual = tilenames2.tile_edges_batch(x, y, Z, TILE_SIZE)
+
+    for expected_values, values in zip(expected, actual):
+        np.testing.assert_allclose(
+            values, expected_values, rtol=0, atol=TOLERANCE_DEGREES
+        )
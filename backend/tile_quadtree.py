@@ -0,0 +1,95 @@
+import os
+from datetime import timedelta
+from typing import NamedTuple, Optional
+
+from lru_cache import LRUCache
+from tilenames2 import LatLng
+
+TILE_STORE_SIZE = int(os.environ.get("TILE_STORE_SIZE", "100000"))
+# How many zoom levels up a child tile looks for a provisional value.
+TILE_STORE_MAX_ANCESTOR_LEVELS = int(
+    os.environ.get("TILE_STORE_MAX_ANCESTOR_LEVELS", "3")
+)
+
+
+class DerivedDuration(NamedTuple):
+    duration: Optional[timedelta]
+    # "children" if it was aggregated from the four child tiles, "ancestor"
+    # if it was inherited from a lower zoom tile and is only provisional, None
+    # if the tile was computed itself.
+    derived_from: Optional[str]
+
+
+class TileDurationStore:
+    # Remembers the duration of every (z, x, y) tile this worker has served, so
+    # tiles on neighbouring zoom levels can be derived from them. A tile at
+    # zoom z covers the tiles (2x, 2y) .. (2x + 1, 2y + 1) at zoom z + 1.
+
+    def __init__(self, max_size: int = TILE_STORE_SIZE):
+        self.durations = LRUCache(max_size=max_size)
+
+    def tile_key(
+        self, src: str, origin_latlng: LatLng, tile_size: int, z: int, x: int, y: int
+    ) -> tuple:
+        return (
+            src,
+            round(origin_latlng[0], 6),
+            round(origin_latlng[1], 6),
+            tile_size,
+            z,
+            x,
+            y,
+        )
+
+    def record(
+        self,
+        src: str,
+        origin_latlng: LatLng,
+        tile_size: int,
+        z: int,
+        x: int,
+        y: int,
+        duration: Optional[timedelta],
+        derived_from: Optional[str] = None,
+    ):
+        key = self.tile_key(src, origin_latlng, tile_size, z, x, y)
+        self.durations.set(key, DerivedDuration(duration, derived_from))
+
+    def lookup(
+        self, src: str, origin_latlng: LatLng, tile_size: int, z: int, x: int, y: int
+    ) -> Optional[DerivedDuration]:
+        return self.durations.get(self.tile_key(src, origin_latlng, tile_size, z, x, y))
+
+    # Returns None if the tile has to be computed (or was computed before).
+    def derive(
+        self, src: str, origin_latlng: LatLng, tile_size: int, z: int, x: int, y: int
+    ) -> Optional[DerivedDuration]:
+        own = self.lookup(src, origin_latlng, tile_size, z, x, y)
+        if own is not None:
+            return own if own.derived_from == "children" else None
+
+        children = [
+            self.lookup(src, origin_latlng, tile_size, z + 1, 2 * x + dx, 2 * y + dy)
+            for dx in (0, 1)
+            for dy in (0, 1)
+        ]
+
+        if all(child is not None for child in children):
+            durations = [
+                child.duration for child in children if child.duration is not None
+            ]
+
+            duration = None
+            if durations:
+                duration = sum(durations, timedelta()) / len(durations)
+
+            return DerivedDuration(duration, "children")
+
+        for levels in range(1, min(z, TILE_STORE_MAX_ANCESTOR_LEVELS) + 1):
+            ancestor = self.lookup(
+                src, origin_latlng, tile_size, z - levels, x >> levels, y >> levels
+            )
+            if ancestor is not None:
+                return DerivedDuration(ancestor.duration, "ancestor")
+
+        return None
@@ -1,7 +1,22 @@
 from PIL import Image, ImageDraw, ImageFont
 from typing import Optional
 from datetime import timedelta
+import functools
 import io
+import os
+import time
+import zlib
+
+import numpy as np
+
+from metrics import tile_png_bytes, tile_render_seconds
+
+TILE_CACHE_SIZE = int(os.environ.get("TILE_CACHE_SIZE", "4096"))
+
+# Durations of MAX_MINUTES and more get the same colour.
+MAX_MINUTES = 60
+
+TILE_ETAG_VERSION = "1"
 
 
 def minute_to_color(timedelta: Optional[timedelta]):
@@ -10,11 +25,10 @@ def minute_to_color(timedelta: Optional[timedelta]):
 
     minutes = int(timedelta.total_seconds() / 60)
 
-    max_minutes = 60
-    if minutes > max_minutes:
-        minutes = max_minutes
+    if minutes > MAX_MINUTES:
+        minutes = MAX_MINUTES
 
-    return calculate_color(minutes / max_minutes)
+    return calculate_color(minutes / MAX_MINUTES)
 
 
 def calculate_color(percent):
@@ -30,8 +44,64 @@ def calculate_color(percent):
     return (red, green, blue)
 
 
+def duration_to_minute_bucket(best_journey_time: Optional[timedelta]) -> Optional[int]:
+    if best_journey_time is None:
+        return None
+
+    return int(best_journey_time.total_seconds() / 60)
+
+
 def render_tile(
     tile_size: int, best_journey_time: Optional[timedelta], mark_as_new_tile=False
+) -> bytes:
+    # The image only depends on the whole minute, so all durations within the
+    # same minute share one cached PNG.
+    with tile_render_seconds.labels("flat").time():
+        image = render_tile_for_minutes(
+            tile_size, duration_to_minute_bucket(best_journey_time), mark_as_new_tile
+        )
+
+    tile_png_bytes.labels("flat").observe(len(image))
+    return image
+
+
+def tile_etag(
+    src: str,
+    tile_size: int,
+    best_journey_time: Optional[timedelta],
+    mark_as_new_tile=False,
+) -> str:
+    # Identifies the PNG of render_tile without rendering it. Bump
+    # TILE_ETAG_VERSION when the tile images change.
+    minutes = duration_to_minute_bucket(best_journey_time)
+    bucket = "na" if minutes is None else str(minutes)
+    suffix = "-new" if mark_as_new_tile else ""
+    return f'"{TILE_ETAG_VERSION}-{src}-{tile_size}-{bucket}{suffix}"'
+
+
+def heatmap_tile_etag(
+    src: str, tile_size: int, minutes: np.ndarray, mark_as_new_tile=False
+) -> str:
+    # The samples decide the whole image, so they identify it.
+    checksum = zlib.crc32(np.asarray(minutes, dtype=np.float32).tobytes())
+    samples = minutes.shape[0]
+    suffix = "-new" if mark_as_new_tile else ""
+    return f'"{TILE_ETAG_VERSION}-{src}-{tile_size}-s{samples}-{checksum:08x}{suffix}"'
+
+
+@functools.lru_cache(maxsize=TILE_CACHE_SIZE)
+def render_tile_for_minutes(
+    tile_size: int, minutes: Optional[int], mark_as_new_tile: bool = False
+) -> bytes:
+    best_journey_time = None
+    if minutes is not None:
+        best_journey_time = timedelta(minutes=minutes)
+
+    return render_tile_uncached(tile_size, best_journey_time, mark_as_new_tile)
+
+
+def render_tile_uncached(
+    tile_size: int, best_journey_time: Optional[timedelta], mark_as_new_tile=False
 ) -> bytes:
     color = minute_to_color(best_journey_time)
 
@@ -61,3 +131,75 @@ def render_tile(
     image.save(byte_io, "PNG")
 
     return byte_io.getvalue()
+
+
+def interpolate_grid(samples: np.ndarray, size: int) -> np.ndarray:
+    # Bilinear interpolation of N x N samples taken at the centres of the
+    # sample cells up to size x size pixels. NaN (no duration) spreads to the
+    # pixels next to it.
+    n = samples.shape[0]
+    positions = np.clip((np.arange(size) + 0.5) * n / size - 0.5, 0, n - 1)
+    lower = np.floor(positions).astype(np.intp)
+    upper = np.minimum(lower + 1, n - 1)
+    weight = (positions - lower).astype(np.float32)
+
+    rows = (
+        samples[lower, :] * (1 - weight)[:, None] + samples[upper, :] * weight[:, None]
+    )
+    return rows[:, lower] * (1 - weight)[None, :] + rows[:, upper] * weight[None, :]
+
+
+def minutes_to_rgba(minutes: np.ndarray) -> np.ndarray:
+    # The vectorised counterpart of minute_to_color.
+    has_duration = ~np.isnan(minutes)
+    percent = np.clip(np.nan_to_num(minutes) / MAX_MINUTES, 0, 1)
+
+    rgba = np.empty(minutes.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = np.where(has_duration, percent * 255, 0)
+    rgba[..., 1] = np.where(has_duration, (1 - percent) * 255, 0)
+    rgba[..., 2] = np.where(has_duration, 0, 255)
+    rgba[..., 3] = 255
+
+    return rgba
+
+
+def render_heatmap_tile(
+    tile_size: int, minutes: np.ndarray, mark_as_new_tile=False
+) -> bytes:
+    # minutes is an N x N grid of durations sampled across the tile, row by
+    # row from the north west, with NaN where there is no duration.
+    start = time.perf_counter()
+
+    # float32 halves the memory of the intermediate pixel arrays.
+    rgba = minutes_to_rgba(interpolate_grid(minutes.astype(np.float32), tile_size))
+    image = Image.fromarray(rgba, "RGBA")
+
+    if mark_as_new_tile:
+        draw = ImageDraw.Draw(image)
+        draw.font = ImageFont.load_default(30 * tile_size / 128)
+        draw.text((2, 0), "*", fill=(0, 0, 0))
+
+    byte_io = io.BytesIO()
+    image.save(byte_io, "PNG")
+
+    tile_render_seconds.labels("heatmap").observe(time.perf_counter() - start)
+    tile_png_bytes.labels("heatmap").observe(byte_io.tell())
+    return byte_io.getvalue()
+
+
+def prerender_tiles(tile_sizes: list[int], max_minutes: int = 60):
+    for tile_size in tile_sizes:
+        for minutes in [None, *range(max_minutes + 1)]:
+            for mark_as_new_tile in (False, True):
+                render_tile_for_minutes(tile_size, minutes, mark_as_new_tile)
+
+
+def tile_cache_info() -> dict:
+    info = render_tile_for_minutes.cache_info()
+
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "max_size": info.maxsize,
+    }
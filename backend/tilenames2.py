@@ -11,12 +11,14 @@
 from math import *
 from collections import namedtuple
 
+import numpy as np
+
 
 LatLng = namedtuple("LatLng", ["lat", "lng"])
 
 
 def num_tiles(z, tile_size_pixels):
-    return pow(2, z) * (256 / tile_size_pixels)
+    return (1 << z) * (256 / tile_size_pixels)
 
 
 def sec(x):
@@ -78,3 +80,46 @@ def tile_edges(x, y, z, tile_size_pixels):
 
 def mercator_to_lat(mercatorY):
     return degrees(atan(sinh(mercatorY)))
+
+
+# Batch versions of the functions above for numpy arrays of coordinates. They
+# agree with the scalar functions to within floating point rounding, see
+# tests/test_tilenames2.py and benchmarks/tilenames.py.
+
+
+def latlon_to_relative_xy_batch(lat, lon):
+    lat_radians = np.radians(lat)
+    x = (np.asarray(lon) + 180) / 360
+    y = (1 - np.log(np.tan(lat_radians) + 1 / np.cos(lat_radians)) / pi) / 2
+    return (x, y)
+
+
+def latlon_to_xy_batch(lat, lon, z, tile_size_pixels):
+    n = num_tiles(z, tile_size_pixels)
+    x, y = latlon_to_relative_xy_batch(lat, lon)
+    return (n * x, n * y)
+
+
+def tile_xy_batch(lat, lon, z, tile_size_pixels):
+    x, y = latlon_to_xy_batch(lat, lon, z, tile_size_pixels)
+    return (x.astype(np.int64), y.astype(np.int64))
+
+
+def mercator_to_lat_batch(mercatorY):
+    return np.degrees(np.arctan(np.sinh(mercatorY)))
+
+
+def xy_to_latlon_batch(x, y, z, tile_size_pixels):
+    n = num_tiles(z, tile_size_pixels)
+    relY = np.asarray(y) / n
+    lat = mercator_to_lat_batch(pi * (1 - 2 * relY))
+    lon = -180.0 + 360.0 * np.asarray(x) / n
+    return (lat, lon)
+
+
+def tile_edges_batch(x, y, z, tile_size_pixels):
+    lat1, lon1 = xy_to_latlon_batch(x, y, z, tile_size_pixels)
+    lat2, lon2 = xy_to_latlon_batch(
+        np.asarray(x) + 1, np.asarray(y) + 1, z, tile_size_pixels
+    )
+    return (lat2, lon1, lat1, lon2)  # S,W,N,E
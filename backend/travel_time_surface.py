@@ -0,0 +1,107 @@
+import bisect
+from datetime import timedelta
+from typing import Optional
+
+from tilenames2 import LatLng
+
+# Sampled durations are memoised on a grid of this many degrees, which is
+# roughly 50 m in our latitudes and well below the size of a tile.
+GRID_CELL_DEGREES = 0.0005
+
+
+def point_in_ring(lng: float, lat: float, ring: list) -> bool:
+    inside = False
+    j = len(ring) - 1
+
+    for i in range(len(ring)):
+        lng_i, lat_i = ring[i][0], ring[i][1]
+        lng_j, lat_j = ring[j][0], ring[j][1]
+
+        if (lat_i > lat) != (lat_j > lat):
+            crossing_lng = lng_i + (lng_j - lng_i) * (lat - lat_i) / (lat_j - lat_i)
+            if lng < crossing_lng:
+                inside = not inside
+
+        j = i
+
+    return inside
+
+
+class Isochrone:
+    def __init__(self, seconds: int, geometry: dict):
+        self.seconds = seconds
+
+        if geometry["type"] == "Polygon":
+            self.polygons = [geometry["coordinates"]]
+        elif geometry["type"] == "MultiPolygon":
+            self.polygons = geometry["coordinates"]
+        else:
+            self.polygons = []
+
+        self.bboxes = []
+        for polygon in self.polygons:
+            lngs = [point[0] for point in polygon[0]]
+            lats = [point[1] for point in polygon[0]]
+            self.bboxes.append((min(lngs), min(lats), max(lngs), max(lats)))
+
+    def contains(self, latlng: LatLng) -> bool:
+        lat, lng = latlng
+
+        for polygon, (min_lng, min_lat, max_lng, max_lat) in zip(
+            self.polygons, self.bboxes
+        ):
+            if not (min_lng <= lng <= max_lng and min_lat <= lat <= max_lat):
+                continue
+
+            outer_ring, *holes = polygon
+            if point_in_ring(lng, lat, outer_ring) and not any(
+                point_in_ring(lng, lat, hole) for hole in holes
+            ):
+                return True
+
+        return False
+
+
+class TravelTimeSurface:
+    # A travel time surface for one origin, built from OTP isochrones with
+    # increasing cutoffs. Since every isochrone contains the smaller ones, the
+    # duration of a point is the smallest cutoff containing it, found with a
+    # binary search over the cutoffs.
+
+    def __init__(self, isochrones: list[Isochrone]):
+        self.isochrones = sorted(isochrones, key=lambda isochrone: isochrone.seconds)
+        self.grid: dict[tuple[int, int], Optional[int]] = {}
+
+    @classmethod
+    def from_geojson(cls, feature_collection: dict) -> "TravelTimeSurface":
+        return cls(
+            [
+                Isochrone(int(feature["properties"]["time"]), feature["geometry"])
+                for feature in feature_collection["features"]
+            ]
+        )
+
+    def sample(self, latlng: LatLng) -> Optional[timedelta]:
+        cell = (
+            int(latlng[0] // GRID_CELL_DEGREES),
+            int(latlng[1] // GRID_CELL_DEGREES),
+        )
+
+        if cell not in self.grid:
+            self.grid[cell] = self.sample_uncached(latlng)
+
+        seconds = self.grid[cell]
+        if seconds is None:
+            return None
+
+        return timedelta(seconds=seconds)
+
+    def sample_uncached(self, latlng: LatLng) -> Optional[int]:
+        index = bisect.bisect_left(
+            self.isochrones, True, key=lambda isochrone: isochrone.contains(latlng)
+        )
+
+        if index == len(self.isochrones):
+            return None
+
+        return self.isochrones[index].seconds
@@ -0,0 +1,203 @@
+import asyncio
+import os
+import time
+from typing import Optional
+
+from route_durations.route_duration_provider import (
+    AsyncRouteDurationProvider,
+    RouteDurationResult,
+)
+from tilenames2 import LatLng
+
+# Per upstream: maximum concurrency, requests per second (0 = unlimited),
+# maximum number of queued requests. Upstreams are only limited when enabled
+# with e.g. UPSTREAM_LIMIT_VRR=8:10:200, or all of them with these defaults
+# with UPSTREAM_LIMITS_ENABLED=1. Shedding with limits below the real capacity
+# of an upstream only slows down the tiles.
+UPSTREAM_LIMITS_ENABLED = os.environ.get("UPSTREAM_LIMITS_ENABLED", "0") == "1"
+DEFAULT_UPSTREAM_LIMITS = {
+    "vrr": "8:10:200",
+    "otp": "32:0:500",
+    "hafas": "4:5:100",
+}
+UPSTREAM_QUEUE_TIMEOUT_SECONDS = float(
+    os.environ.get("UPSTREAM_QUEUE_TIMEOUT_SECONDS", "2")
+)
+UPSTREAM_MIN_CONCURRENCY = int(os.environ.get("UPSTREAM_MIN_CONCURRENCY", "1"))
+
+
+class UpstreamOverloaded(Exception):
+    pass
+
+
+class AdaptiveLimiter:
+    # Limits the concurrency to an upstream with AIMD: every success raises
+    # the limit by 1 / limit up to max_concurrency, a failure halves it. The
+    # requests already in flight then fail alike (e.g. all tiles of a failed
+    # OTP batch), so only requests started after the last decrease halve it
+    # again. On top of that a token bucket limits the request rate.
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        rate_per_second: float = 0,
+        max_queue: int = 100,
+        queue_timeout_seconds: float = UPSTREAM_QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.rate_per_second = rate_per_second
+        self.max_queue = max_queue
+        self.queue_timeout_seconds = queue_timeout_seconds
+
+        self.tokens = max(rate_per_second, 1)
+        self.tokens_updated_at = time.monotonic()
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.condition = asyncio.Condition()
+
+        self.accepted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.decreases = 0
+        self.decreased_at = 0.0
+
+    def has_capacity(self) -> bool:
+        return self.in_flight < max(int(self.limit), UPSTREAM_MIN_CONCURRENCY)
+
+    def reserve_token(self) -> float:
+        # Returns how long to wait for the reserved token.
+        if self.rate_per_second <= 0:
+            return 0
+
+        now = time.monotonic()
+        self.tokens = min(
+            max(self.rate_per_second, 1),
+            self.tokens + (now - self.tokens_updated_at) * self.rate_per_second,
+        )
+        self.tokens_updated_at = now
+        self.tokens -= 1
+
+        return max(0, -self.tokens / self.rate_per_second)
+
+    async def wait_for_slot(self):
+        async with self.condition:
+            await self.condition.wait_for(self.has_capacity)
+            self.in_flight += 1
+
+    async def acquire(self):
+        if self.waiting == 0 and self.has_capacity():
+            self.in_flight += 1
+        else:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise UpstreamOverloaded(f"{self.name}: queue is full")
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self.wait_for_slot(), self.queue_timeout_seconds)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise UpstreamOverloaded(f"{self.name}: queue deadline exceeded")
+            finally:
+                self.waiting -= 1
+
+        delay = self.reserve_token()
+        if delay > self.queue_timeout_seconds:
+            self.tokens += 1
+            self.timeouts += 1
+            await self.release()
+            raise UpstreamOverloaded(f"{self.name}: rate limit exceeded")
+
+        try:
+            await asyncio.sleep(delay)
+        except BaseException:
+            await self.release()
+            raise
+
+        self.accepted += 1
+
+    async def release(
+        self, success: Optional[bool] = None, started_at: Optional[float] = None
+    ):
+        if success is True:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        elif success is False:
+            self.failures += 1
+            if started_at is None or started_at >= self.decreased_at:
+                self.decreases += 1
+                self.decreased_at = time.monotonic()
+                self.limit = max(UPSTREAM_MIN_CONCURRENCY, self.limit / 2)
+
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def wrap(self, func: AsyncRouteDurationProvider) -> AsyncRouteDurationProvider:
+        async def wrapper(
+            origin_latlng: LatLng, destination_latlng: LatLng
+        ) -> Optional[RouteDurationResult]:
+            await self.acquire()
+            started_at = time.monotonic()
+
+            try:
+                result = await func(origin_latlng, destination_latlng)
+            except Exception:
+                await self.release(success=False, started_at=started_at)
+                raise
+            except BaseException:
+                # Cancelled, which says nothing about the upstream.
+                await self.release()
+                raise
+
+            await self.release(success=True)
+            return result
+
+        return wrapper
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "max_concurrency": self.max_concurrency,
+            "rate_per_second": self.rate_per_second,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_queue": self.max_queue,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "decreases": self.decreases,
+        }
+
+
+def create_limiter(name: str, config: str) -> AdaptiveLimiter:
+    max_concurrency, rate_per_second, max_queue = config.split(":")
+
+    return AdaptiveLimiter(
+        name,
+        max_concurrency=int(max_concurrency),
+        rate_per_second=float(rate_per_second),
+        max_queue=int(max_queue),
+    )
+
+
+def configured_limits() -> dict[str, str]:
+    limits = {}
+    for name, default in DEFAULT_UPSTREAM_LIMITS.items():
+        config = os.environ.get(f"UPSTREAM_LIMIT_{name.upper()}")
+        if config is None and UPSTREAM_LIMITS_ENABLED:
+            config = default
+        if config is not None:
+            limits[name] = config
+
+    return limits
+
+
+upstream_limiters = {
+    name: create_limiter(name, config) for name, config in configured_limits().items()
+}
@@ -1,15 +1,58 @@
-from pymemcache.client.base import Client
+from pymemcache.client.base import PooledClient
 from route_durations.route_duration_provider import (
-    RouteDurationProvider,
+    AsyncRouteDurationProvider,
     RouteDurationResult,
 )
 from datetime import timedelta, datetime, UTC
 from typing import Optional, List, Callable
 import json
+import tilenames2
 from tilenames2 import LatLng
 import functools
 from hashlib import md5
-from pydantic import BaseModel
+from cache_encoding import (
+    CacheEntry,
+    cache_entry_from_result,
+    encode_cache_entry,
+    decode_cache_entry,
+)
+from cache_policy import CACHE_ERROR_TTL_SECONDS, hard_ttl_seconds, is_stale
+from metrics import InstrumentedCacheClient, cache_lookups
+from single_flight import SingleFlight
+from sqlite_cache import SqliteCacheClient
+from lru_cache import LRUCache
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Coalesce cache misses across workers with a memcached lease (via add).
+MEMCACHED_LEASES = os.environ.get("MEMCACHED_LEASES", "0") == "1"
+MEMCACHED_LEASE_SECONDS = int(os.environ.get("MEMCACHED_LEASE_SECONDS", "30"))
+MEMCACHED_LEASE_POLL_SECONDS = 0.05
+
+# In-process cache of decoded entries in front of memcached, 0 disables it.
+L1_CACHE_SIZE = int(os.environ.get("L1_CACHE_SIZE", "10000"))
+L1_CACHE_TTL_SECONDS = float(os.environ.get("L1_CACHE_TTL_SECONDS", "3600"))
+
+# memcached (and SQLite) calls block, so the duration wrapper runs them on a
+# pool of threads, each with its own connection, instead of the event loop.
+MEMCACHED_MAX_WORKERS = int(os.environ.get("MEMCACHED_MAX_WORKERS", "8"))
+
+# Entries are stored in the compact v3 encoding. While migrating, misses also
+# look up the old v2 JSON entry and rewrite it as v3.
+CACHE_KEY_VERSION = "v3"
+CACHE_READ_V2 = os.environ.get("CACHE_READ_V2", "1") == "1"
+
+# The first tile of a PREFETCH_BLOCK_SIZE x PREFETCH_BLOCK_SIZE block fetches
+# the whole block with one get_many, its siblings are then served from a
+# short-lived buffer. 0 disables prefetching.
+PREFETCH_BLOCK_SIZE = int(os.environ.get("PREFETCH_BLOCK_SIZE", "4"))
+PREFETCH_TTL_SECONDS = float(os.environ.get("PREFETCH_TTL_SECONDS", "10"))
+
+# The event loop only keeps weak references to tasks, so the background
+# refreshes are kept here until they are done.
+refresh_tasks = set()
 
 
 def get_memcached_wrapper(memcached_url: str):
@@ -19,25 +62,105 @@ def get_memcached_wrapper(memcached_url: str):
         return MemcachedWrapper(memcached_url)
 
 
+def create_cache_client(memcached_url: str):
+    # sqlite:///var/cache/durations.db selects the persistent local store,
+    # anything else is a memcached server.
+    if memcached_url.startswith("sqlite://"):
+        return InstrumentedCacheClient(
+            SqliteCacheClient(memcached_url[len("sqlite://") :])
+        )
+
+    # A slow memcached must still not hold up the tiles for long.
+    return InstrumentedCacheClient(
+        PooledClient(
+            memcached_url,
+            connect_timeout=1,
+            timeout=0.5,
+            max_pool_size=MEMCACHED_MAX_WORKERS,
+        )
+    )
+
+
 def latlng_to_short_str(latlng: LatLng) -> str:
     return f"{latlng[0]:.6f},{latlng[1]:.6f}"
 
 
 def compute_cache_key(
-    prefix: str, origin_latlng: LatLng, destination_latlng: LatLng
+    prefix: str,
+    origin_latlng: LatLng,
+    destination_latlng: LatLng,
+    version: str = CACHE_KEY_VERSION,
 ) -> str:
-    value = f"v2-{prefix}-{latlng_to_short_str(origin_latlng)}-{latlng_to_short_str(destination_latlng)}"
+    value = f"{version}-{prefix}-{latlng_to_short_str(origin_latlng)}-{latlng_to_short_str(destination_latlng)}"
     return md5(value.encode("utf-8")).hexdigest()
 
 
-class CacheEntry(BaseModel):
-    is_present: bool
-    value: Optional[RouteDurationResult]
+def cache_entry_to_result(
+    cache_entry: CacheEntry, cache_headers: dict
+) -> Optional[RouteDurationResult]:
+    if not cache_entry.is_present:
+        return None
+
+    # Entries are shared between requests (L1, coalescing), so every caller
+    # gets its own headers.
+    return RouteDurationResult(
+        duration=cache_entry.duration,
+        x_headers={**cache_entry.x_headers, **cache_headers},
+    )
+
+
+def create_l1_cache() -> LRUCache:
+    return LRUCache(max_size=L1_CACHE_SIZE, ttl_seconds=L1_CACHE_TTL_SECONDS)
+
+
+def count_cache_lookup(prefix: str, cache_headers: dict):
+    if "x-cache-coalesced" in cache_headers:
+        result = "coalesced"
+    elif "x-cache-computed" in cache_headers:
+        result = "computed"
+    elif "x-cache-stale" in cache_headers:
+        result = "stale"
+    else:
+        result = cache_headers.get("x-cache-hit", "miss")
+
+    cache_lookups.labels(prefix, result).inc()
+
+
+def stamp_computed_at(value: Optional[RouteDurationResult]):
+    # is_stale takes entries without a timestamp for old ones.
+    if value is not None:
+        value.x_headers.update({"x-cache-computed-at": datetime.now(UTC).isoformat()})
+
+
+def set_l1_cache_entry(l1_cache: LRUCache, key: str, cache_entry: CacheEntry):
+    # Failures must not outlive their (short) TTL in L1 either.
+    ttl_seconds = min(L1_CACHE_TTL_SECONDS, hard_ttl_seconds(cache_entry))
+    l1_cache.set(key, cache_entry, ttl_seconds=ttl_seconds)
 
 
 class MemcachedWrapper:
     def __init__(self, memcached_url: str):
-        self.memcached_client = Client(memcached_url)
+        self.memcached_client = create_cache_client(memcached_url)
+        self.executor = ThreadPoolExecutor(
+            max_workers=MEMCACHED_MAX_WORKERS, thread_name_prefix="memcached"
+        )
+        self.l1_cache = create_l1_cache()
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.single_flight = SingleFlight()
+        self.remote_coalesced = 0
+        self.prefetch_buffer = LRUCache(
+            max_size=16 * 1024, ttl_seconds=PREFETCH_TTL_SECONDS
+        )
+        self.prefetched_blocks = LRUCache(
+            max_size=1024, ttl_seconds=PREFETCH_TTL_SECONDS
+        )
+        self.prefetch_batches = 0
+        self.refreshing = set()
+        self.refresh_attempts = LRUCache(
+            max_size=16 * 1024, ttl_seconds=CACHE_ERROR_TTL_SECONDS
+        )
+        self.stale_refreshes = 0
 
     def wrap_location_search(
         self, func: Callable[[str], List]
@@ -63,81 +186,395 @@ class MemcachedWrapper:
                 # print("Cache miss")
                 location_list = func(q)
 
-                self.memcached_client.set(
-                    key=key,
-                    value=json.dumps(location_list),
-                    expire=int(timedelta(weeks=1).total_seconds()),
-                )
+                try:
+                    self.memcached_client.set(
+                        key=key,
+                        value=json.dumps(location_list),
+                        expire=int(timedelta(weeks=1).total_seconds()),
+                    )
+                except Exception as e:
+                    print("Cache set failed (exception)")
+                    print(e)
 
             return location_list
 
         return wrapper
 
     def wrap_duration_provider(
-        self, prefix: str, func: RouteDurationProvider
-    ) -> RouteDurationProvider:
+        self, prefix: str, func: AsyncRouteDurationProvider
+    ) -> AsyncRouteDurationProvider:
         @functools.wraps(func)
-        def wrapper(
+        async def wrapper(
             origin_latlng: LatLng, destination_latlng: LatLng
         ) -> Optional[RouteDurationResult]:
             key = compute_cache_key(prefix, origin_latlng, destination_latlng)
 
             cache_headers = {}
 
+            cache_entry = await self.get_cache_entry(
+                prefix, origin_latlng, destination_latlng, cache_headers
+            )
+
+            if cache_entry is None:
+                # print("Cache miss")
+                cache_entry, shared = await self.single_flight.do(
+                    key,
+                    lambda: self.compute_cache_entry(
+                        key, func, origin_latlng, destination_latlng
+                    ),
+                )
+                cache_headers.update({"x-cache-computed": "true"})
+                if shared:
+                    cache_headers.update({"x-cache-coalesced": "true"})
+
+                set_l1_cache_entry(self.l1_cache, key, cache_entry)
+            elif is_stale(cache_entry):
+                cache_headers.update({"x-cache-stale": "true"})
+                self.refresh_in_background(
+                    key, func, origin_latlng, destination_latlng, cache_entry
+                )
+
+            count_cache_lookup(prefix, cache_headers)
+            cache_headers.update(self.hit_ratio_headers())
+            return cache_entry_to_result(cache_entry, cache_headers)
+
+        return wrapper
+
+    async def call(self, operation: str, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor,
+            functools.partial(
+                getattr(self.memcached_client, operation), *args, **kwargs
+            ),
+        )
+
+    async def get_cache_entry(
+        self,
+        prefix: str,
+        origin_latlng: LatLng,
+        destination_latlng: LatLng,
+        cache_headers: dict,
+    ) -> Optional[CacheEntry]:
+        key = compute_cache_key(prefix, origin_latlng, destination_latlng)
+
+        cache_entry = self.l1_cache.get(key)
+        if cache_entry is not None:
+            cache_headers.update({"x-cache-hit": "l1"})
+            return cache_entry
+
+        cache_entry = self.prefetch_buffer.get(key)
+        if cache_entry is not None:
+            cache_headers.update({"x-cache-hit": "prefetch"})
+            set_l1_cache_entry(self.l1_cache, key, cache_entry)
+            return cache_entry
+
+        legacy_key = None
+        if CACHE_READ_V2:
+            legacy_key = compute_cache_key(
+                prefix, origin_latlng, destination_latlng, version="v2"
+            )
+
+        cache_entry = await self.get_l2_cache_entry(key, legacy_key, cache_headers)
+        if cache_entry is not None:
+            set_l1_cache_entry(self.l1_cache, key, cache_entry)
+
+        return cache_entry
+
+    async def lookup(
+        self, prefix: str, origin_latlng: LatLng, destination_latlng: LatLng
+    ) -> Optional[CacheEntry]:
+        # A cache lookup that never calls the provider, None on a miss.
+        return await self.get_cache_entry(prefix, origin_latlng, destination_latlng, {})
+
+    async def get_l2_cache_entry(
+        self, key: str, legacy_key: Optional[str], cache_headers: dict
+    ) -> Optional[CacheEntry]:
+        keys = [key] if legacy_key is None else [key, legacy_key]
+
+        try:
+            cache_entries = await self.call("get_many", keys)
+        except Exception as e:
+            print("Cache miss (exception)")
+            print(e)
+            cache_entries = {}
+            cache_headers.update({"x-cache-hit": "exception"})
+
+        cache_entry = cache_entries.get(key)
+        is_legacy = cache_entry is None and legacy_key in cache_entries
+        if is_legacy:
+            cache_entry = cache_entries[legacy_key]
+
+        if cache_entry is None:
+            self.l2_misses += 1
+            return None
+
+        self.l2_hits += 1
+        cache_headers.update({"x-cache-hit": "l2"})
+        try:
+            cache_entry = decode_cache_entry(cache_entry)
+        except:
+            # print("Cache hit but invalid value")
+            cache_headers.update({"x-cache-value": "err"})
+            return None
+
+        if is_legacy:
+            await self.set_l2_cache_entry(key, cache_entry)
+
+        return cache_entry
+
+    async def prefetch_tile_block(
+        self,
+        prefix: str,
+        origin_latlng: LatLng,
+        tile_size: int,
+        z: int,
+        x: int,
+        y: int,
+    ):
+        if PREFETCH_BLOCK_SIZE <= 0:
+            return
+
+        block_x = x - x % PREFETCH_BLOCK_SIZE
+        block_y = y - y % PREFETCH_BLOCK_SIZE
+
+        block_key = (prefix, origin_latlng, tile_size, z, block_x, block_y)
+        if self.prefetched_blocks.get(block_key) is not None:
+            return
+        self.prefetched_blocks.set(block_key, True)
+
+        keys = []
+        for tile_x in range(block_x, block_x + PREFETCH_BLOCK_SIZE):
+            for tile_y in range(block_y, block_y + PREFETCH_BLOCK_SIZE):
+                center_latlng = tilenames2.xy_to_latlon(
+                    tile_x, tile_y, z, tile_size_pixels=tile_size
+                )
+                key = compute_cache_key(prefix, origin_latlng, center_latlng)
+                if key not in self.l1_cache:
+                    keys.append(key)
+
+        if not keys:
+            return
+
+        try:
+            cache_entries = await self.call("get_many", keys)
+        except Exception as e:
+            print("Prefetch failed (exception)")
+            print(e)
+            return
+
+        self.prefetch_batches += 1
+
+        for key, cache_entry in cache_entries.items():
+            try:
+                self.prefetch_buffer.set(key, decode_cache_entry(cache_entry))
+            except:
+                pass
+
+    async def set_l2_cache_entry(self, key: str, cache_entry: CacheEntry):
+        # The entry is still served from L1, it is only recomputed sooner.
+        try:
+            await self.call(
+                "set",
+                key=key,
+                value=encode_cache_entry(cache_entry),
+                expire=hard_ttl_seconds(cache_entry),
+            )
+        except Exception as e:
+            print("Cache set failed (exception)")
+            print(e)
+
+    def hit_ratio_headers(self) -> dict:
+        l2_lookups = self.l2_hits + self.l2_misses
+        l2_hit_ratio = self.l2_hits / l2_lookups if l2_lookups else 0.0
+
+        return {
+            "x-cache-l1-hit-ratio": f"{self.l1_cache.hit_ratio():.3f}",
+            "x-cache-l2-hit-ratio": f"{l2_hit_ratio:.3f}",
+        }
+
+    async def compute_cache_entry(
+        self,
+        key: str,
+        func: AsyncRouteDurationProvider,
+        origin_latlng: LatLng,
+        destination_latlng: LatLng,
+        stale_entry: Optional[CacheEntry] = None,
+    ) -> CacheEntry:
+        lease_key = f"{key}-lease"
+        has_lease = False
+
+        if MEMCACHED_LEASES:
+            has_lease = await self.acquire_lease(lease_key)
+            if not has_lease and stale_entry is not None:
+                # Another worker is already refreshing it.
+                return stale_entry
+            if not has_lease:
+                cache_entry = await self.wait_for_lease_holder(key)
+                if cache_entry is not None:
+                    return cache_entry
+
+        try:
+            value = await func(origin_latlng, destination_latlng)
+            stamp_computed_at(value)
+            cache_entry = cache_entry_from_result(value)
+
+            # A failed refresh keeps serving the stale entry.
+            if stale_entry is not None and not cache_entry.is_present:
+                return stale_entry
+
+            await self.set_l2_cache_entry(key, cache_entry)
+        finally:
+            # Also give up the lease if upstream failed or was overloaded.
+            if has_lease:
+                await self.release_lease(lease_key)
+
+        return cache_entry
+
+    def refresh_in_background(
+        self,
+        key: str,
+        func: AsyncRouteDurationProvider,
+        origin_latlng: LatLng,
+        destination_latlng: LatLng,
+        stale_entry: CacheEntry,
+    ):
+        # Retry a failed refresh only after the error TTL.
+        if key in self.refreshing or self.refresh_attempts.get(key) is not None:
+            return
+        self.refresh_attempts.set(key, True)
+        self.stale_refreshes += 1
+
+        async def refresh():
             try:
-                cache_entry = self.memcached_client.get(key, None)
+                cache_entry, _ = await self.single_flight.do(
+                    key,
+                    lambda: self.compute_cache_entry(
+                        key, func, origin_latlng, destination_latlng, stale_entry
+                    ),
+                )
             except Exception as e:
-                print("Cache miss (exception)")
+                print("Cache refresh failed")
                 print(e)
-                cache_entry = None
-                cache_headers.update({"x-cache-hit": "exception"})
+                return
+
+            set_l1_cache_entry(self.l1_cache, key, cache_entry)
+
+        task = asyncio.ensure_future(refresh())
+        refresh_tasks.add(task)
+        task.add_done_callback(refresh_tasks.discard)
+        self.refreshing.add(key)
+        task.add_done_callback(lambda _: self.refreshing.discard(key))
+
+    async def acquire_lease(self, lease_key: str) -> bool:
+        # memcached add only succeeds for one worker, so exactly one of them
+        # queries upstream while the others wait for its result.
+        try:
+            return await self.call(
+                "add", lease_key, b"1", expire=MEMCACHED_LEASE_SECONDS, noreply=False
+            )
+        except Exception:
+            return True
+
+    async def release_lease(self, lease_key: str):
+        # An unreleased lease expires after MEMCACHED_LEASE_SECONDS.
+        try:
+            await self.call("delete", lease_key)
+        except Exception as e:
+            print("Lease release failed (exception)")
+            print(e)
+
+    async def wait_for_lease_holder(self, key: str) -> Optional[CacheEntry]:
+        self.remote_coalesced += 1
+
+        deadline = time.monotonic() + MEMCACHED_LEASE_SECONDS
+        while time.monotonic() < deadline:
+            await asyncio.sleep(MEMCACHED_LEASE_POLL_SECONDS)
+
+            try:
+                cache_entry = await self.call("get", key, None)
+            except Exception:
+                return None
 
             if cache_entry is not None:
-                cache_headers.update({"x-cache-hit": "true"})
                 try:
-                    cache_entry = CacheEntry(**json.loads(cache_entry))
+                    return decode_cache_entry(cache_entry)
                 except:
-                    # print("Cache hit but invalid value")
-                    cache_entry = None
-                    cache_headers.update({"x-cache-value": "err"})
+                    return None
 
-            if cache_entry is None:
-                # print("Cache miss")
-                value = func(origin_latlng, destination_latlng)
-                cache_headers.update({"x-cache-computed": "true"})
+        # The lease holder died or is too slow, compute it ourselves.
+        return None
 
-                if value is None:
-                    cache_entry = CacheEntry(is_present=False, value=None)
-                else:
-                    value.x_headers.update(
-                        {"x-cache-computed-at": datetime.now(UTC).isoformat()}
-                    )
-                    cache_entry = CacheEntry(is_present=True, value=value)
+    def stats(self) -> dict:
+        return {
+            "l1": self.l1_cache.stats(),
+            "l2": {"hits": self.l2_hits, "misses": self.l2_misses},
+            "coalesced": self.single_flight.coalesced,
+            "coalesced_remote": self.remote_coalesced,
+            "stale_refreshes": self.stale_refreshes,
+            "prefetch": {
+                "batches": self.prefetch_batches,
+                **self.prefetch_buffer.stats(),
+            },
+        }
 
-                self.memcached_client.set(
-                    key=key,
-                    value=cache_entry.model_dump_json(),
-                    expire=int(timedelta(weeks=1).total_seconds()),
-                )
 
-            if cache_entry.is_present:
-                # print("Cache present", cache_entry)
-                value = cache_entry.value
-                value.x_headers.update(cache_headers)
-                return value
+class NoopWrapper:
+    # Without memcached there is only the in-process L1 cache.
+    def __init__(self):
+        self.l1_cache = create_l1_cache()
 
-            return None
+    def wrap_duration_provider(
+        self, key: str, func: AsyncRouteDurationProvider
+    ) -> AsyncRouteDurationProvider:
+        if self.l1_cache.max_size == 0:
+            return func
 
-        return wrapper
+        @functools.wraps(func)
+        async def wrapper(
+            origin_latlng: LatLng, destination_latlng: LatLng
+        ) -> Optional[RouteDurationResult]:
+            cache_key = compute_cache_key(key, origin_latlng, destination_latlng)
 
+            cache_entry = self.l1_cache.get(cache_key)
+            if cache_entry is not None:
+                cache_headers = {"x-cache-hit": "l1"}
+            else:
+                value = await func(origin_latlng, destination_latlng)
+                stamp_computed_at(value)
+                cache_entry = cache_entry_from_result(value)
+                set_l1_cache_entry(self.l1_cache, cache_key, cache_entry)
+                cache_headers = {"x-cache-computed": "true"}
 
-class NoopWrapper:
-    def wrap_duration_provider(
-        self, key: str, func: RouteDurationProvider
-    ) -> RouteDurationProvider:
-        return func
+            count_cache_lookup(key, cache_headers)
+            cache_headers.update(
+                {"x-cache-l1-hit-ratio": f"{self.l1_cache.hit_ratio():.3f}"}
+            )
+            return cache_entry_to_result(cache_entry, cache_headers)
+
+        return wrapper
 
     def wrap_location_search(
         self, func: Callable[[str], List]
     ) -> Callable[[str], List]:
         return func
+
+    async def lookup(
+        self, prefix: str, origin_latlng: LatLng, destination_latlng: LatLng
+    ) -> Optional[CacheEntry]:
+        return self.l1_cache.get(
+            compute_cache_key(prefix, origin_latlng, destination_latlng)
+        )
+
+    async def prefetch_tile_block(
+        self,
+        prefix: str,
+        origin_latlng: LatLng,
+        tile_size: int,
+        z: int,
+        x: int,
+        y: int,
+    ):
+        pass
+
+    def stats(self) -> dict:
+        return {"l1": self.l1_cache.stats()}
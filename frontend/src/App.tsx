@@ -10,7 +10,8 @@ import { MapContainer, TileLayer } from 'react-leaflet';
 import L from 'leaflet';
 import { useDebounce } from 'usehooks-ts';
 import { LocationLike, LocationSelectorInput } from './LocationSelectorInput';
-import { DATA_SOURCES, DataSource, DataSourceSelect, dataSourceForId, dataSourceToString } from './DataSourceSelect';
+import { DATA_SOURCES, DataSource, DataSourceSelect, dataSourceForId, dataSourceToString, useEnabledDataSources } from './DataSourceSelect';
+import { DurationTileLayer } from './DurationTileLayer';
 
 function usePersistentState<T>(initialState: T, key: string, encoder: Encoder<T>, decoder: Decoder<T>): [T, (value: T) => void] {
   // Parse the current URL search parameters
@@ -71,6 +72,14 @@ function App() {
   const [destinationLocationId, setDestinationLocationId] = usePersistentState<LocationLike | null>(null, "q", locationLikeToString, String);
   const destinationLocation = useLocationFromLocationLike(destinationLocationId);
   const [dataSource, setDataSource] = usePersistentState<DataSource>(DATA_SOURCES[0], 's', dataSourceToString, dataSourceForId);
+  const enabledDataSources = useEnabledDataSources();
+
+  // The default (or a shared link) may name a source this backend does not offer.
+  useEffect(() => {
+    if (enabledDataSources.length > 0 && !enabledDataSources.some((x) => x.id === dataSource.id)) {
+      setDataSource(enabledDataSources[0]);
+    }
+  }, [enabledDataSources, dataSource, setDataSource]);
 
   return (
     <>
@@ -93,6 +102,7 @@ function App() {
         />
         <div>
           <DataSourceSelect
+            items={enabledDataSources}
             selected={dataSource}
             onChange={setDataSource}
           />
@@ -167,7 +177,7 @@ function Test({destinationLocation, dataSource, onViewChanged, bounds}: TestProp
             attribution='&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
             url="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png"
           />
-          <TileLayer
+          <DurationTileLayer
             tileSize={64}
             opacity={0.6}
             attribution={dataSource.attribution}
@@ -1,5 +1,6 @@
 import { Button, MenuItem } from "@blueprintjs/core";
 import { Select } from "@blueprintjs/select";
+import { useEffect, useState } from "react";
 
 export function dataSourceForId(id: string | null): DataSource {
   return DATA_SOURCES.find((x) => x.id === id) as DataSource ?? DATA_SOURCES[0];
@@ -22,6 +23,18 @@ export const DATA_SOURCES: DataSource[] = [
     finePrint: 'faster',
     attribution: 'Contains data from &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors and &copy; Verkehrsverbund Rhein-Ruhr AöR <a href="http://opendefinition.org/licenses/cc-by/">Creative Commons Namensnennung (CC-BY)</a>',
   },
+  {
+    id: 'otp-iso',
+    humanName: 'OpenTripPlanner (isochrones)',
+    finePrint: 'fastest',
+    attribution: 'Contains data from &copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors and &copy; Verkehrsverbund Rhein-Ruhr AöR <a href="http://opendefinition.org/licenses/cc-by/">Creative Commons Namensnennung (CC-BY)</a>',
+  },
+  {
+    id: 'raptor',
+    humanName: 'Local timetable (RAPTOR)',
+    finePrint: 'local',
+    attribution: 'Contains data from &copy; Verkehrsverbund Rhein-Ruhr AöR <a href="http://opendefinition.org/licenses/cc-by/">Creative Commons Namensnennung (CC-BY)</a>',
+  },
   {
     id: 'hafas',
     humanName: 'Deutsche Bahn (HAFAS)',
@@ -30,6 +43,27 @@ export const DATA_SOURCES: DataSource[] = [
   }
 ];
 
+// The data sources the backend has enabled (see ENABLED_PROVIDERS), all of
+// them until it answered.
+export function useEnabledDataSources(): DataSource[] {
+  const [dataSources, setDataSources] = useState<DataSource[]>(DATA_SOURCES);
+
+  useEffect(() => {
+    fetch('/api/providers')
+      .then((res) => {
+        return res.json();
+      })
+      .then((enabled: string[]) => {
+        setDataSources(DATA_SOURCES.filter((x) => enabled.includes(x.id)));
+      })
+      .catch((error) => {
+        console.log(error);
+      });
+  }, []);
+
+  return dataSources;
+}
+
 export type DataSource = {
   id: string;
   humanName: string;
@@ -38,14 +72,15 @@ export type DataSource = {
 }
 
 export type DataSourceSelectProps = {
+  items: DataSource[];
   selected: DataSource;
   onChange: (value: DataSource) => void;
 }
 
-export function DataSourceSelect({selected, onChange}: DataSourceSelectProps): JSX.Element {
+export function DataSourceSelect({items, selected, onChange}: DataSourceSelectProps): JSX.Element {
   return (
     <Select
-      items={DATA_SOURCES}
+      items={items}
       itemRenderer={(item, props) => {
         if (!props.modifiers.matchesPredicate) {
           return null;
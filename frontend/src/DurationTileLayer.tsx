@@ -0,0 +1,82 @@
+import { useEffect } from 'react';
+import { useMap } from 'react-leaflet';
+
+import L from 'leaflet';
+
+// Tiles answered with "Cache-Control: no-store" are provisional (derived from
+// a lower zoom level while the real durations are computed, or shed while the
+// upstream is overloaded). They are loaded again until the final tile arrives.
+const REFRESH_DELAY_MS = 1000;
+const MAX_REFRESHES = 5;
+
+class RefreshingTileLayer extends L.TileLayer {
+  createTile(coords: L.Coords, done: L.DoneCallback): HTMLElement {
+    const tile = document.createElement('img');
+    tile.alt = '';
+    tile.setAttribute('role', 'presentation');
+
+    this.loadTile(tile, this.getTileUrl(coords), done, 0);
+
+    return tile;
+  }
+
+  private loadTile(tile: HTMLImageElement, url: string, done: L.DoneCallback, refreshes: number): void {
+    // fetch instead of the img src, to see the response headers.
+    fetch(url)
+      .then((res) => {
+        if (!res.ok) {
+          throw new Error(`Tile request failed with ${res.status}`);
+        }
+
+        const isProvisional = (res.headers.get('Cache-Control') ?? '').includes('no-store');
+        return res.blob().then((blob) => ({ blob, isProvisional }));
+      })
+      .then(({ blob, isProvisional }) => {
+        const objectUrl = URL.createObjectURL(blob);
+        tile.onload = () => {
+          URL.revokeObjectURL(objectUrl);
+          if (refreshes === 0) {
+            done(undefined, tile);
+          }
+        };
+        tile.src = objectUrl;
+
+        if (isProvisional && refreshes < MAX_REFRESHES) {
+          setTimeout(() => {
+            // Tiles scrolled out of view or of a removed layer are detached.
+            if (tile.isConnected) {
+              this.loadTile(tile, url, done, refreshes + 1);
+            }
+          }, REFRESH_DELAY_MS * 2 ** refreshes);
+        }
+      })
+      .catch((error) => {
+        // A failed refresh keeps the provisional tile.
+        if (refreshes === 0) {
+          done(error, tile);
+        }
+      });
+  }
+}
+
+export type DurationTileLayerProps = {
+  url: string;
+  tileSize: number;
+  opacity: number;
+  attribution: string;
+}
+
+export function DurationTileLayer({url, tileSize, opacity, attribution}: DurationTileLayerProps): null {
+  const map = useMap();
+
+  useEffect(() => {
+    const layer = new RefreshingTileLayer(url, {tileSize, opacity, attribution});
+    layer.addTo(map);
+
+    return () => {
+      layer.remove();
+    };
+  }, [map, url, tileSize, opacity, attribution]);
+
+  return null;
+}